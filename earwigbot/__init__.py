@@ -56,11 +56,14 @@ from earwigbot import lazy
 importer = lazy.LazyImporter()
 
 bot = importer.new("earwigbot.bot")
+cancellation = importer.new("earwigbot.cancellation")
 commands = importer.new("earwigbot.commands")
 config = importer.new("earwigbot.config")
+database = importer.new("earwigbot.database")
 exceptions = importer.new("earwigbot.exceptions")
 irc = importer.new("earwigbot.irc")
 managers = importer.new("earwigbot.managers")
+scheduler = importer.new("earwigbot.scheduler")
 tasks = importer.new("earwigbot.tasks")
 util = importer.new("earwigbot.util")
 wiki = importer.new("earwigbot.wiki")
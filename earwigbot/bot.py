@@ -22,12 +22,13 @@
 
 import logging
 from threading import Lock, Thread, enumerate as enumerate_threads
-from time import gmtime, sleep
 
 from earwigbot import __version__
+from earwigbot.cancellation import CancelToken
 from earwigbot.config import BotConfig
-from earwigbot.irc import Frontend, Watcher
+from earwigbot.irc import Frontend, Reactor, Watcher
 from earwigbot.managers import CommandManager, TaskManager
+from earwigbot.scheduler import Scheduler
 from earwigbot.wiki import SitesDB
 
 __all__ = ["Bot"]
@@ -57,18 +58,29 @@ class Bot(object):
     :py:meth:`bot.tasks.start() <earwigbot.managers.TaskManager.start>`, and
     sites can be loaded from the wiki toolset with
     :py:meth:`bot.wiki.get_site() <earwigbot.wiki.sitesdb.SitesDB.get_site>`.
+
+    :py:attr:`cancel_token` is a
+    :py:class:`~earwigbot.cancellation.CancelToken` cancelled when the bot
+    stops or restarts (and then replaced); it is the parent of every running
+    task's token, and the current token of commands.
+    We then wait up to :py:attr:`config.tasks["stopTimeout"]` seconds
+    (:py:attr:`STOP_TIMEOUT` by default) for running tasks to finish.
     """
+    STOP_TIMEOUT = 30
 
     def __init__(self, root_dir, level=logging.INFO):
         self.config = BotConfig(self, root_dir, level)
         self.logger = logging.getLogger("earwigbot")
         self.commands = CommandManager(self)
         self.tasks = TaskManager(self)
+        self.scheduler = Scheduler(self)
         self.wiki = SitesDB(self)
         self.frontend = None
         self.watcher = None
+        self.reactor = Reactor(self.logger.getChild("reactor"))
 
         self.component_lock = Lock()
+        self.cancel_token = CancelToken()
         self._keep_looping = True
 
         self.config.load()
@@ -87,10 +99,10 @@ class Bot(object):
         """Create a new IRC component, record it internally, and start it."""
         component = klass(self)
         setattr(self, name, component)
-        Thread(name="irc_" + name, target=component.loop).start()
+        self.reactor.add(component)
 
     def _start_irc_components(self):
-        """Start the IRC frontend/watcher in separate threads if enabled."""
+        """Start the IRC frontend/watcher in our reactor if enabled."""
         if self.config.components.get("irc_frontend"):
             self.logger.info("Starting IRC frontend")
             self._dispatch_irc_component("frontend", Frontend)
@@ -99,28 +111,42 @@ class Bot(object):
             self._dispatch_irc_component("watcher", Watcher)
 
     def _start_wiki_scheduler(self):
-        """Start the wiki scheduler in a separate thread if enabled."""
-        def wiki_scheduler():
-            run_at = 15
-            while self._keep_looping:
-                self.tasks.schedule()
-                sleep(60 + run_at - gmtime().tm_sec)
-
+        """Start (or reload) the wiki scheduler in our reactor if enabled."""
         if self.config.components.get("wiki_scheduler"):
-            self.logger.info("Starting wiki scheduler")
-            thread = Thread(name="wiki_scheduler", target=wiki_scheduler)
-            thread.daemon = True  # Stop if other threads stop
-            thread.start()
-
-    def _keep_irc_component_alive(self, name, klass):
-        """Ensure that IRC components stay connected, else restart them."""
-        component = getattr(self, name)
-        if component:
-            component.keep_alive()
-            if component.is_stopped():
-                log = "IRC {0} has stopped; restarting".format(name)
-                self.logger.warn(log)
-                self._dispatch_irc_component(name, klass)
+            if not self.scheduler.is_running:
+                self.logger.info("Starting wiki scheduler")
+            self.scheduler.start()
+        elif self.scheduler.is_running:
+            self.logger.info("Stopping wiki scheduler")
+            self.scheduler.stop()
+
+    def _start_wiki_warmup(self):
+        """Load the sitesdb and warm up sites in a separate thread.
+
+        The sitesdb is read into memory first (see :py:meth:`SitesDB.preload()
+        <earwigbot.wiki.sitesdb.SitesDB.preload>`), so the first site loaded
+        by a command or task doesn't wait for it. ``config.wiki["warmup"]`` is
+        a list of site names to log in to at startup, and
+        ``config.wiki["warmupWorkers"]`` is the number of them to handle at
+        once. See :py:meth:`SitesDB.warm_up()
+        <earwigbot.wiki.sitesdb.SitesDB.warm_up>`.
+        """
+        names = self.config.wiki.get("warmup")
+        workers = self.config.wiki.get("warmupWorkers")
+        thread = Thread(name="wiki:warmup", target=self._warm_up_wiki,
+                        args=(names, workers))
+        thread.daemon = True
+        thread.start()
+
+    def _warm_up_wiki(self, names, workers):
+        """Load the sitesdb, then warm up the given sites, if any."""
+        try:
+            self.wiki.preload()
+        except Exception:
+            self.logger.exception("Couldn't load the sitesdb:")
+        if names:
+            self.logger.info("Warming up {0} sites".format(len(names)))
+            self.wiki.warm_up(names, workers)
 
     def _stop_irc_components(self, msg):
         """Request the IRC frontend and watcher to stop if enabled."""
@@ -129,26 +155,68 @@ class Bot(object):
         if self.watcher:
             self.watcher.stop(msg)
 
+    def _cancel_work(self, stopping):
+        """Ask running tasks and commands to stop, and wait for the tasks.
+
+        Our :py:attr:`cancel_token` is cancelled and replaced with a new one
+        for work started afterwards. If we are *stopping*, queued tasks are
+        dropped, and child processes of tasks that outlast the deadline are
+        terminated and waited for.
+        """
+        token, self.cancel_token = self.cancel_token, CancelToken()
+        if stopping:
+            for job in self.tasks.get_queued():
+                self.tasks.cancel(job)
+        token.cancel()
+
+        timeout = self.config.tasks.get("stopTimeout", self.STOP_TIMEOUT)
+        if [job for job in self.tasks.get_jobs() if job.started]:
+            log = "Waiting up to {0} seconds for tasks to stop"
+            self.logger.info(log.format(timeout))
+        left = self.tasks.wait(timeout)
+        if left:
+            log = "Tasks still running after {0} seconds: {1}"
+            names = ", ".join(job.name for job in left)
+            self.logger.warn(log.format(timeout, names))
+        if stopping:
+            for job in left:
+                if job.process:
+                    self.tasks.cancel(job)
+
+    def _after_fork(self):
+        """Prepare a newly forked child process (running a task) for use.
+
+        Locks are replaced throughout, since another thread of the parent
+        process may have held them when it forked, and anything belonging to
+        the parent's threads (loaded sites, task jobs, command workers,
+        timers) is forgotten.
+        """
+        self.component_lock = Lock()
+        self.config._after_fork()
+        self.commands._after_fork()
+        self.tasks._after_fork()
+        self.scheduler._after_fork()
+        self.wiki._after_fork()
+        self.reactor._after_fork()
+
     def _stop_daemon_threads(self):
         """Notify the user of which threads are going to be killed.
 
-        Unfortunately, there is no method right now of stopping command and
-        task threads safely. This is because there is no way to tell them to
-        stop like the IRC components can be told; furthermore, they are run as
-        daemons, and daemon threads automatically stop without calling any
-        __exit__ or try/finally code when all non-daemon threads stop. They
-        were originally implemented as regular non-daemon threads, but this
-        meant there was no way to completely stop the bot if tasks were
-        running, because all other threads would exit and threading would
-        absorb KeyboardInterrupts.
-
-        The advantage of this is that stopping the bot is truly guarenteed to
-        *stop* the bot, while the disadvantage is that the threads are given no
-        advance warning of their forced shutdown.
+        Command and task threads are daemons, and daemon threads automatically
+        stop without calling any __exit__ or try/finally code when all
+        non-daemon threads stop. They were originally implemented as regular
+        non-daemon threads, but this meant there was no way to completely stop
+        the bot if tasks were running, because all other threads would exit
+        and threading would absorb KeyboardInterrupts.
+
+        By the time this is called, :py:meth:`_cancel_work` has asked them to
+        stop and waited for tasks to do so; anything left was too slow (or
+        doesn't check its cancellation token), and will be killed.
         """
         tasks = []
         component_names = self.config.components.keys()
-        skips = component_names + ["MainThread", "reminder", "irc:quit"]
+        skips = component_names + ["MainThread", "reminder", "irc:quit",
+                                   self.commands.IDLE_WORKER]
         for thread in enumerate_threads():
             if thread.is_alive() and not any(
                     thread.name.startswith(skip) for skip in skips):
@@ -169,18 +237,16 @@ class Bot(object):
     def run(self):
         """Main entry point into running the bot.
 
-        Starts all config-enabled components and then enters an idle loop,
-        ensuring that all components remain online and restarting components
-        that get disconnected from their servers.
+        Starts all config-enabled components and then runs our
+        :py:class:`~earwigbot.irc.reactor.Reactor` until the bot is stopped.
+        The reactor handles all IRC connections in this thread, reconnecting
+        components that get disconnected from their servers.
         """
         self.logger.info("Starting bot (EarwigBot {0})".format(__version__))
         self._start_irc_components()
         self._start_wiki_scheduler()
-        while self._keep_looping:
-            with self.component_lock:
-                self._keep_irc_component_alive("frontend", Frontend)
-                self._keep_irc_component_alive("watcher", Watcher)
-            sleep(2)
+        self._start_wiki_warmup()
+        self.reactor.run()
 
     def restart(self, msg=None):
         """Reload config, commands, tasks, and safely restart IRC components.
@@ -192,22 +258,33 @@ class Bot(object):
         :py:meth:`bot.tasks.load() <earwigbot.managers._ResourceManager.load>`.
         These should not interfere with running components or tasks.
 
+        Running tasks and commands are asked to stop first, and we wait a
+        while for tasks to finish (see :py:attr:`cancel_token`); queued tasks
+        are kept and run after the restart.
+
         If given, *msg* will be used as our quit message.
         """
         if msg:
             self.logger.info('Restarting bot ("{0}")'.format(msg))
         else:
             self.logger.info("Restarting bot")
+        # Not under the component lock, which the IRC watcher needs to keep
+        # handling events (and our connections alive) while we wait:
+        self._cancel_work(stopping=False)
         with self.component_lock:
             self._stop_irc_components(msg)
             self.config.load()
             self.commands.load()
             self.tasks.load()
             self._start_irc_components()
+            self._start_wiki_scheduler()
 
     def stop(self, msg=None):
         """Gracefully stop all bot components.
 
+        Running tasks and commands are asked to stop, and we wait a while for
+        tasks to finish before any left are killed.
+
         If given, *msg* will be used as our quit message.
         """
         if msg:
@@ -217,4 +294,7 @@ class Bot(object):
         with self.component_lock:
             self._stop_irc_components(msg)
         self._keep_looping = False
+        self.scheduler.stop()
+        self._cancel_work(stopping=True)
+        self.reactor.stop()
         self._stop_daemon_threads()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Lets running tasks and commands be asked to stop.
+
+Each task run gets a :py:class:`CancelToken` as its ``_cancel`` keyword
+argument, and commands run under :py:attr:`bot.cancel_token
+<earwigbot.bot.Bot.cancel_token>`. The token is also made the *current token*
+of the thread doing the work, so :py:meth:`Site.api_query()
+<earwigbot.wiki.site.Site.api_query>` can refuse to start new queries once it
+is cancelled (by raising :py:exc:`~earwigbot.exceptions.CancelledError`)
+without being given it. Threads started by a task can share its token with
+:py:func:`set_token`.
+"""
+
+from threading import Event, Lock, local
+import time
+from weakref import WeakSet
+
+from earwigbot.exceptions import CancelledError
+
+__all__ = ["CancelToken", "get_token", "set_token", "check", "sleep"]
+
+_local = local()
+
+class CancelToken(object):
+    """
+    **EarwigBot: Cancellation Token**
+
+    A flag that is set once, by :py:meth:`cancel`, and checked by the code it
+    was given to. If the token has a *parent*, cancelling the parent cancels
+    it too; the bot's token is the parent of each task run's.
+    """
+
+    def __init__(self, parent=None):
+        self._event = Event()
+        self._lock = Lock()
+        self._callbacks = []
+        self._children = WeakSet()
+        if parent:
+            parent._add_child(self)
+
+    def __repr__(self):
+        """Return the canonical string representation of the CancelToken."""
+        return "CancelToken()"
+
+    def __str__(self):
+        """Return a nice string representation of the CancelToken."""
+        state = "cancelled" if self.cancelled else "active"
+        return "<CancelToken ({0})>".format(state)
+
+    def _add_child(self, token):
+        """Cancel the given token whenever we are cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._children.add(token)
+                return
+        token.cancel()
+
+    @property
+    def cancelled(self):
+        """Whether or not the token has been cancelled."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the token, its children, and call its callbacks."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+            children = list(self._children)
+        for child in children:
+            child.cancel()
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """Call *callback* with no arguments when the token is cancelled.
+
+        If it already has been, *callback* is called right away. Callbacks
+        run in the thread that cancels the token, so they should be quick.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        """Raise :py:exc:`~earwigbot.exceptions.CancelledError` if cancelled.
+
+        Long loops should call this regularly.
+        """
+        if self._event.is_set():
+            raise CancelledError("The operation was cancelled")
+
+    def wait(self, timeout=None):
+        """Wait until the token is cancelled or *timeout* seconds pass.
+
+        Returns whether it was cancelled.
+        """
+        return self._event.wait(timeout)
+
+
+def get_token():
+    """Return the calling thread's current token, or ``None``."""
+    return getattr(_local, "token", None)
+
+def set_token(token):
+    """Set the calling thread's current token, returning the old one."""
+    old = getattr(_local, "token", None)
+    _local.token = token
+    return old
+
+def check():
+    """Check the current token, if any; see :py:meth:`CancelToken.check`."""
+    token = getattr(_local, "token", None)
+    if token:
+        token.check()
+
+def sleep(seconds):
+    """Sleep for *seconds*, but stop early if the current token is cancelled.
+
+    Raises :py:exc:`~earwigbot.exceptions.CancelledError` if it is.
+    """
+    token = getattr(_local, "token", None)
+    if not token:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        token.check()
@@ -27,6 +27,7 @@ import sqlite3 as sqlite
 from threading import Lock
 
 from earwigbot.commands import Command
+from earwigbot.database import Database
 
 class Notes(Command):
     """A mini IRC-based wiki for storing notes, tips, and reminders."""
@@ -48,6 +49,7 @@ class Notes(Command):
 
     def setup(self):
         self._dbfile = path.join(self.config.root_dir, "notes.db")
+        self._db = Database(self._dbfile)
         self._db_access_lock = Lock()
 
     def process(self, data):
@@ -111,7 +113,7 @@ class Notes(Command):
     def do_list(self, data):
         """Show a list of entries in the notes database."""
         query = "SELECT entry_title FROM entries"
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn:
             try:
                 entries = conn.execute(query).fetchall()
             except sqlite.OperationalError:
@@ -134,7 +136,7 @@ class Notes(Command):
             self.reply(data, "Please specify an entry to read from.")
             return
 
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn:
             try:
                 title, content = conn.execute(query, (slug,)).fetchone()
             except (sqlite.OperationalError, TypeError):
@@ -166,7 +168,7 @@ class Notes(Command):
             self.reply(data, "Please give some content to put in the entry.")
             return
 
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn, self._db_access_lock:
             create = True
             try:
                 id_, title, author = conn.execute(query1, (slug,)).fetchone()
@@ -206,7 +208,7 @@ class Notes(Command):
             self.reply(data, "Please specify an entry to get info on.")
             return
 
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn:
             try:
                 info = conn.execute(query, (slug,)).fetchall()
             except sqlite.OperationalError:
@@ -250,7 +252,7 @@ class Notes(Command):
             self.reply(data, "The old and new names are identical.")
             return
 
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn, self._db_access_lock:
             try:
                 id_, author = conn.execute(query1, (slug,)).fetchone()
             except (sqlite.OperationalError, TypeError):
@@ -282,7 +284,7 @@ class Notes(Command):
             self.reply(data, "Please specify an entry to delete.")
             return
 
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn, self._db_access_lock:
             try:
                 id_, author = conn.execute(query1, (slug,)).fetchone()
             except (sqlite.OperationalError, TypeError):
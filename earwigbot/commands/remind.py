@@ -24,7 +24,7 @@ import ast
 from itertools import chain
 import operator
 import random
-from threading import RLock, Thread
+from threading import RLock
 import time
 
 from earwigbot.commands import Command
@@ -122,7 +122,7 @@ class Remind(Command):
             self.reminders[user].append(reminder)
         else:
             self.reminders[user] = [reminder]
-        self._thread.add(reminder)
+        self._timer.add(reminder)
 
     def _create_reminder(self, data):
         """Create a new reminder for the given user."""
@@ -158,7 +158,7 @@ class Remind(Command):
 
     def _cancel_reminder(self, data, reminder):
         """Cancel a pending reminder."""
-        self._thread.remove(reminder)
+        self._timer.remove(reminder)
         self.unstore_reminder(reminder.id)
         self.reminders[data.host].remove(reminder)
         if not self.reminders[data.host]:
@@ -175,21 +175,27 @@ class Remind(Command):
             duration = None
 
         reminder.reset(duration)
+        self._timer.add(reminder)
         end = _format_time(reminder.end)
         msg = "Reminder \x0303{0}\x0F {1} until {2}."
         self.reply(data, msg.format(reminder.id, verb, end))
 
     def _load_reminders(self):
-        """Load previously made reminders from the database."""
+        """Load previously made reminders from the database.
+
+        Each reminder is stored as its own record, keyed by its ID. Reminders
+        saved by older versions as a single attribute are migrated here.
+        """
         permdb = self.config.irc["permissions"]
-        try:
-            database = permdb.get_attr("command:remind", "data")
-        except KeyError:
-            return
-        permdb.set_attr("command:remind", "data", "[]")
+        items = [ast.literal_eval(value) for value in
+                 permdb.get_records("command:remind").itervalues()]
+        if permdb.has_attr("command:remind", "data"):
+            legacy = permdb.get_attr("command:remind", "data")
+            items += ast.literal_eval(legacy)
+            permdb.remove_attr("command:remind", "data")
 
         connect_wait = 30
-        for item in ast.literal_eval(database):
+        for item in items:
             rid, user, wait, end, message, data = item
             if end < time.time() + connect_wait:
                 # Make reminders that have expired while the bot was offline
@@ -328,7 +334,7 @@ class Remind(Command):
     def setup(self):
         self.reminders = {}
         self._lock = RLock()
-        self._thread = _ReminderThread(self._lock)
+        self._timer = _ReminderTimer(self)
         self._load_reminders()
 
     def process(self, data):
@@ -336,97 +342,76 @@ class Remind(Command):
             self._process(data)
 
     def unload(self):
-        self._thread.stop()
+        self._timer.stop()
 
     def store_reminder(self, reminder):
         """Store a serialized reminder into the database."""
         permdb = self.config.irc["permissions"]
-        try:
-            dump = permdb.get_attr("command:remind", "data")
-        except KeyError:
-            dump = "[]"
-
-        database = ast.literal_eval(dump)
-        database.append(reminder)
-        permdb.set_attr("command:remind", "data", str(database))
+        permdb.set_record("command:remind", reminder[0], repr(reminder))
 
     def unstore_reminder(self, rid):
         """Remove a reminder from the database by ID."""
         permdb = self.config.irc["permissions"]
-        try:
-            dump = permdb.get_attr("command:remind", "data")
-        except KeyError:
-            dump = "[]"
-
-        database = ast.literal_eval(dump)
-        database = [item for item in database if item[0] != rid]
-        permdb.set_attr("command:remind", "data", str(database))
-
-
-class _ReminderThread(object):
-    """A single thread that handles reminders."""
-
-    def __init__(self, lock):
-        self._thread = None
-        self._abort = False
+        permdb.remove_record("command:remind", rid)
+
+class _ReminderTimer(object):
+    """Schedules reminders on the bot's reactor.
+
+    Each reminder gets a reactor timer for its end time, so nothing wakes up
+    until a reminder is actually due. The timer only hands the reminder to a
+    command worker thread, which triggers it; the reactor thread never waits
+    for the lock, IRC, or the database. Timers can't be canceled, so a timer
+    that fires for a reminder that was removed or rescheduled since it was
+    set is ignored.
+    """
+
+    def __init__(self, cmdobj):
+        self._commands = cmdobj.bot.commands
+        self._reactor = cmdobj.bot.reactor
+        self._lock = cmdobj.lock
         self._active = {}
-        self._lock = lock
-
-    def _running(self):
-        """Return if the thread should still be running."""
-        return self._active and not self._abort
-
-    def _get_soonest(self):
-        """Get the soonest reminder to trigger."""
-        return min(self._active.values(), key=lambda robj: robj.end)
-
-    def _get_ready_reminder(self):
-        """Block until a reminder is ready to be triggered."""
-        while self._running():
-            if self._get_soonest().end <= time.time():
-                return self._get_soonest()
-            self._lock.release()
-            time.sleep(0.25)
-            self._lock.acquire()
-
-    def _callback(self):
-        """Internal callback function to be executed by the reminder thread."""
+        self._stopped = False
+
+    def _schedule(self, reminder):
+        """Set a reactor timer for the reminder's current end time."""
+        self._active[reminder.id] = (reminder, reminder.end)
+        delay = max(reminder.end - time.time(), 0)
+        self._reactor.call_later(delay, self._callback, reminder, reminder.end)
+
+    def _callback(self, reminder, end):
+        """Internal callback function to be executed by the reactor."""
+        if not self._stopped:
+            self._commands.run_in_worker("reminder", self._trigger, reminder,
+                                         end)
+
+    def _trigger(self, reminder, end):
+        """Trigger a due reminder in a worker thread, if it's still current."""
         with self._lock:
-            while True:
-                reminder = self._get_ready_reminder()
-                if not reminder:
-                    break
-
-                if reminder.trigger():
-                    del self._active[reminder.id]
-            self._thread = None
-
-    def _start(self):
-        """Start the thread."""
-        self._thread = Thread(target=self._callback, name="reminder")
-        self._thread.daemon = True
-        self._thread.start()
-        self._abort = False
+            if self._stopped or self._active.get(reminder.id) != (reminder,
+                                                                  end):
+                return
+            if reminder.trigger():
+                del self._active[reminder.id]
+            else:
+                self._schedule(reminder)
 
     def add(self, reminder):
-        """Add a reminder to the table of active reminders."""
-        self._active[reminder.id] = reminder
-        if not self._thread:
-            self._start()
+        """Add a reminder to the table of active reminders.
+
+        This is also used to reschedule a reminder after its end time has
+        been changed.
+        """
+        self._schedule(reminder)
 
     def remove(self, reminder):
         """Remove a reminder from the table of active reminders."""
-        if reminder.id in self._active:
+        if self._active.get(reminder.id, (None,))[0] is reminder:
             del self._active[reminder.id]
-        if not self._active:
-            self.stop()
 
     def stop(self):
-        """Stop the thread."""
-        if not self._thread:
-            return
-        self._abort = True
-        self._thread = None
+        """Stop triggering reminders."""
+        self._stopped = True
+        self._active.clear()
 
 
 class _Reminder(object):
@@ -494,7 +479,7 @@ class _Reminder(object):
         self._save()
 
     def trigger(self):
-        """Hook run by the reminder thread."""
+        """Hook run by the reminder timer."""
         if not self._expired:
             self._fire()
             return False
@@ -39,6 +39,7 @@ class Stalk(Command):
         self._users = {}
         self._pages = {}
         self._load_stalks()
+        self._build_matchers()
 
     def check(self, data):
         if isinstance(data, RC):
@@ -123,18 +124,14 @@ class Stalk(Command):
                 else:
                     chans[item[0]] = None
 
-        def _regex_match(target, tag):
-            return target.startswith("re:") and re.match(target[3:], tag)
-
-        def _process(table, tag):
-            for target, stalks in table.iteritems():
-                if target == tag or _regex_match(target, tag):
-                    _update_chans(stalks)
+        def _process(table, matcher, tag):
+            for target in matcher.match(tag):
+                _update_chans(table.get(target, ()))
 
         chans = {}
-        _process(self._users, rc.user)
+        _process(self._users, self._user_matcher, rc.user)
         if rc.is_edit:
-            _process(self._pages, rc.page)
+            _process(self._pages, self._page_matcher, rc.page)
         if not chans:
             return
 
@@ -150,7 +147,7 @@ class Stalk(Command):
                         msg = pretty
                     if len(msg) > 400:
                         msg = msg[:397] + "..."
-                    frontend.say(chan, msg)
+                    frontend.say(chan, msg, priority=frontend.PRIORITY_RC)
 
     @staticmethod
     def _get_stalks_by_nick(nick, table):
@@ -194,7 +191,8 @@ class Stalk(Command):
 
         msg = "Now {0}ing {1} \x0302{2}\x0F. Remove with \x0306!un{0} {2}\x0F."
         self.reply(data, msg.format(verb, stalktype, target))
-        self._save_stalks()
+        self._build_matchers()
+        self._save_stalks(stalktype, target)
 
     def _remove_stalk(self, stalktype, data, target):
         """Remove a stalk entry from the given table."""
@@ -228,7 +226,8 @@ class Stalk(Command):
             del table[target]
         msg = "No longer {0}ing {1} \x0302{2}\x0F for you."
         self.reply(data, msg.format(verb, stalktype, target))
-        self._save_stalks()
+        self._build_matchers()
+        self._save_stalks(stalktype, target)
 
     def _remove_all_stalks(self, stalktype, data, target):
         """Remove all entries for a particular target from the given table."""
@@ -250,7 +249,8 @@ class Stalk(Command):
         else:
             msg = "No longer {0}ing {1} \x0302{2}\x0F for anyone."
             self.reply(data, msg.format(verb, stalktype, target))
-            self._save_stalks()
+            self._build_matchers()
+            self._save_stalks(stalktype, target)
 
     def _current_stalks(self, nick):
         """Return the given user's current stalks."""
@@ -307,17 +307,112 @@ class Stalk(Command):
                           len(pages), "s" if len(pages) != 1 else "",
                           uinfo if users else "", pinfo if pages else "")
 
+    def _build_matchers(self):
+        """Rebuild the matchers used by _process_rc() after stalks change."""
+        self._user_matcher = _StalkMatcher(self._users)
+        self._page_matcher = _StalkMatcher(self._pages)
+
     def _load_stalks(self):
-        """Load saved stalks from the database."""
-        permdb = self.config.irc["permissions"]
-        try:
-            data = permdb.get_attr("command:stalk", "data")
-        except KeyError:
-            return
-        self._users, self._pages = literal_eval(data)
+        """Load saved stalks from the database.
 
-    def _save_stalks(self):
-        """Save stalks to the database."""
+        Each stalked target is stored as its own record, keyed by the stalk
+        type and target, so changing one stalk only touches one row. Stalks
+        saved by older versions as a single attribute are migrated here.
+        """
         permdb = self.config.irc["permissions"]
-        data = str((self._users, self._pages))
-        permdb.set_attr("command:stalk", "data", data)
+        records = permdb.get_records("command:stalk")
+        for key, value in records.iteritems():
+            stalktype, target = literal_eval(key)
+            table = self._users if stalktype == "user" else self._pages
+            table[target] = literal_eval(value)
+
+        if permdb.has_attr("command:stalk", "data"):
+            users, pages = literal_eval(
+                permdb.get_attr("command:stalk", "data"))
+            self._users.update(users)
+            self._pages.update(pages)
+            items = [(repr(("user", target)), repr(info))
+                     for target, info in users.iteritems()]
+            items += [(repr(("page", target)), repr(info))
+                      for target, info in pages.iteritems()]
+            permdb.set_records("command:stalk", items)
+            permdb.remove_attr("command:stalk", "data")
+
+    def _save_stalks(self, stalktype, target):
+        """Save the stalks for a single target to the database."""
+        permdb = self.config.irc["permissions"]
+        table = self._users if stalktype == "user" else self._pages
+        key = repr((stalktype, target))
+        if target in table:
+            permdb.set_record("command:stalk", key, repr(table[target]))
+        else:
+            permdb.remove_record("command:stalk", key)
+
+class _StalkMatcher(object):
+    """Finds the targets in a stalk table that match a user or page name.
+
+    Literal targets are looked up in a dictionary. Regular expressions
+    (targets starting with "re:") are combined into as few compiled patterns
+    as Python's limit on groups allows, each testing all of its expressions
+    in one call with a lookahead per expression. Expressions that can't be
+    safely combined (those with backreferences, named groups, conditional
+    groups, or inline flags) are matched one at a time, and invalid ones are
+    ignored.
+    """
+    MAX_GROUPS = 99
+    UNCOMBINABLE = re.compile(r"\\\d|\(\?P|\(\?\(|\(\?[iLmsux]+\)")
+
+    def __init__(self, table):
+        self._exact = set()
+        self._combined = []  # List of (regex, [(group number, target)])
+        self._separate = []  # List of (regex, target)
+
+        patterns = []
+        for target in table:
+            if not target.startswith("re:"):
+                self._exact.add(target)
+                continue
+            try:
+                regex = re.compile(target[3:])
+            except (re.error, AssertionError):  # Or too many groups
+                continue
+            if (self.UNCOMBINABLE.search(target[3:]) or
+                    regex.groups >= self.MAX_GROUPS):
+                self._separate.append((regex, target))
+            else:
+                patterns.append((target, regex.groups))
+        self._combine(patterns)
+
+    def _combine(self, patterns):
+        """Compile combinable patterns into as few regexes as possible."""
+        parts, targets, groups = [], [], 0
+        for target, ngroups in patterns:
+            if groups + ngroups + 1 > self.MAX_GROUPS:
+                self._add_combined(parts, targets)
+                parts, targets, groups = [], [], 0
+            targets.append((groups + 1, target))
+            parts.append("(?:(?=({0}))|)".format(target[3:]))
+            groups += ngroups + 1
+        if parts:
+            self._add_combined(parts, targets)
+
+    def _add_combined(self, parts, targets):
+        """Add a combined regex, falling back to separate ones on error."""
+        try:
+            self._combined.append((re.compile("".join(parts)), targets))
+        except re.error:
+            for _, target in targets:
+                self._separate.append((re.compile(target[3:]), target))
+
+    def match(self, tag):
+        """Return a list of all targets that match the given *tag*."""
+        found = [tag] if tag in self._exact else []
+        for regex, targets in self._combined:
+            match = regex.match(tag)
+            for group, target in targets:
+                if match.group(group) is not None:
+                    found.append(target)
+        for regex, target in self._separate:
+            if regex.match(tag):
+                found.append(target)
+        return found
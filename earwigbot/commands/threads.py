@@ -22,6 +22,7 @@
 
 import threading
 import re
+from time import time
 
 from earwigbot.commands import Command
 
@@ -41,7 +42,7 @@ class Threads(Command):
             if data.command == "tasklist":
                 self.do_list()
             else:
-                msg = "No arguments provided. Maybe you wanted '!{0} list', '!{0} start', or '!{0} listall'?"
+                msg = "No arguments provided. Maybe you wanted '!{0} list', '!{0} start', '!{0} cancel', or '!{0} listall'?"
                 self.reply(data, msg.format(data.command))
             return
 
@@ -54,6 +55,9 @@ class Threads(Command):
         elif data.args[0] in ["listall", "all"]:
             self.do_listall()
 
+        elif data.args[0] == "cancel":
+            self.do_cancel()
+
         else:  # They asked us to do something we don't know
             msg = "Unknown argument: \x0303{0}\x0F.".format(data.args[0])
             self.reply(data, msg)
@@ -66,11 +70,14 @@ class Threads(Command):
 
         normal_threads = []
         daemon_threads = []
+        idle_workers = 0
 
         for thread in threads:
             tname = thread.name
             ident = thread.ident % 10000
-            if tname == "MainThread":
+            if tname.startswith(self.bot.commands.IDLE_WORKER):
+                idle_workers += 1
+            elif tname == "MainThread":
                 t = "\x0302main\x0F (id {0})"
                 normal_threads.append(t.format(ident))
             elif tname in self.config.components:
@@ -88,6 +95,9 @@ class Threads(Command):
                 else:
                     t = "\x0302{0}\x0F (id {1})"
                     daemon_threads.append(t.format(tname, ident))
+        if idle_workers:
+            t = "\x0302{0} idle command workers\x0F"
+            normal_threads.append(t.format(idle_workers))
 
         if daemon_threads:
             if len(daemon_threads) > 1:
@@ -100,24 +110,47 @@ class Threads(Command):
             msg = "\x02{0}\x0F threads active: {1}, and \x020\x0F command/task threads."
             msg = msg.format(len(threads), ', '.join(normal_threads))
 
+        queues = []
+        for name, stats in sorted(self.bot.commands.get_hook_stats().items()):
+            if stats["depth"] or stats["dropped"]:
+                t = "\x0302{0}\x0F ({1} queued, {2} dropped)"
+                queues.append(t.format(name, stats["depth"], stats["dropped"]))
+        if queues:
+            msg += " RC event queues: {0}.".format(", ".join(queues))
+
+        queued = self.bot.tasks.get_queued()
+        if queued:
+            now = time()
+            tasks = []
+            for job in queued:
+                t = "\x0302{0}\x0F (priority {1}, waiting {2}s)"
+                waited = int(now - job.queued)
+                tasks.append(t.format(job.name, job.priority, waited))
+            msg += " \x02{0}\x0F queued tasks: {1}.".format(
+                len(queued), ", ".join(tasks))
+
         self.reply(self.data, msg)
 
     def do_listall(self):
         """With !tasks listall or !tasks all, list all loaded tasks, and report
         whether they are currently running or idle."""
         threads = threading.enumerate()
+        queued = [job.name for job in self.bot.tasks.get_queued()]
         tasklist = []
         for task in sorted([task.name for task in self.bot.tasks]):
             threadlist = [t for t in threads if t.name.startswith(task)]
             ids = [str(t.ident) for t in threadlist]
             if not ids:
-                tasklist.append("\x0302{0}\x0F (idle)".format(task))
+                info = "\x0302{0}\x0F (idle".format(task)
             elif len(ids) == 1:
-                t = "\x0302{0}\x0F (\x02active\x0F as id {1})"
-                tasklist.append(t.format(task, ids[0]))
+                t = "\x0302{0}\x0F (\x02active\x0F as id {1}"
+                info = t.format(task, ids[0])
             else:
-                t = "\x0302{0}\x0F (\x02active\x0F as ids {1})"
-                tasklist.append(t.format(task, ', '.join(ids)))
+                t = "\x0302{0}\x0F (\x02active\x0F as ids {1}"
+                info = t.format(task, ', '.join(ids))
+            if task in queued:
+                info += ", {0} queued".format(queued.count(task))
+            tasklist.append(info + ")")
 
         tasks = ", ".join(tasklist)
 
@@ -126,7 +159,8 @@ class Threads(Command):
 
     def do_start(self):
         """With !tasks start, start any loaded task by name with or without
-        kwargs."""
+        kwargs. If too many tasks are running, it is queued ahead of
+        scheduled tasks."""
         data = self.data
 
         try:
@@ -145,6 +179,36 @@ class Threads(Command):
         data.kwargs["_IRCCallback"] = lambda: self.reply(
             data, "Task \x0302{0}\x0F finished.".format(task_name))
 
-        self.bot.tasks.start(task_name, **data.kwargs)
-        msg = "Task \x0302{0}\x0F started.".format(task_name)
+        tasks = self.bot.tasks
+        job = tasks.start(task_name, tasks.PRIORITY_HIGH, **data.kwargs)
+        queued = tasks.get_queued()
+        if job in queued:
+            msg = "Task \x0302{0}\x0F queued ({1} ahead of it)."
+            msg = msg.format(task_name, queued.index(job))
+        else:
+            msg = "Task \x0302{0}\x0F started.".format(task_name)
         self.reply(data, msg)
+
+    def do_cancel(self):
+        """With !tasks cancel, take all copies of a task off the queue, and
+        ask any running copies to stop."""
+        data = self.data
+
+        try:
+            task_name = data.args[1]
+        except IndexError:  # No task name given
+            self.reply(data, "What task do you want me to cancel?")
+            return
+
+        jobs = [job for job in self.bot.tasks.get_jobs()
+                if job.name == task_name]
+        if not jobs:
+            msg = "Task \x0302{0}\x0F isn't running or queued."
+            self.reply(data, msg.format(task_name))
+            return
+
+        cancelled = [job for job in jobs if self.bot.tasks.cancel(job)]
+        queued = len([job for job in cancelled if not job.started])
+        running = len(cancelled) - queued
+        msg = "Cancelled \x02{0}\x0F queued and asked \x02{1}\x0F running copies of \x0302{2}\x0F to stop."
+        self.reply(data, msg.format(queued, running, task_name))
@@ -27,6 +27,7 @@ import logging
 import logging.handlers
 from os import mkdir, path
 import stat
+from time import struct_time
 
 import yaml
 
@@ -37,6 +38,7 @@ from earwigbot.config.ordered_yaml import OrderedLoader
 from earwigbot.config.permissions import PermissionsDB
 from earwigbot.config.script import ConfigScript
 from earwigbot.exceptions import NoConfigError
+from earwigbot.scheduler import ScheduleEntry
 
 Blowfish = importer.new("Crypto.Cipher.Blowfish")
 bcrypt = importer.new("bcrypt")
@@ -168,6 +170,10 @@ class BotConfig(object):
         stream.setFormatter(color_formatter)
         logger.addHandler(stream)
 
+    def _after_fork(self):
+        """Replace our locks in a newly forked child process."""
+        self._permissions._after_fork()
+
     def _decrypt(self, node, nodes):
         """Try to decrypt the contents of a config node. Use self.decrypt()."""
         try:
@@ -328,30 +334,24 @@ class BotConfig(object):
         """Return a list of tasks scheduled to run at the specified time.
 
         The schedule data comes from our config file's ``schedule`` field,
-        which is stored as :py:attr:`self.data["schedule"] <data>`.
+        which is stored as :py:attr:`self.data["schedule"] <data>`; see
+        :py:mod:`earwigbot.scheduler` for its format. Invalid entries are
+        skipped. The :py:class:`~earwigbot.scheduler.Scheduler` doesn't use
+        this, as it compiles the schedule once instead of checking each entry
+        every minute.
         """
         # Tasks to run this turn, each as a list of either [task_name, kwargs],
         # or just the task_name:
         tasks = []
 
-        now = {"minute": minute, "hour": hour, "month_day": month_day,
-                "month": month, "week_day": week_day}
-
-        data = self._data.get("schedule", [])
-        for event in data:
-            do = True
-            for key, value in now.items():
-                try:
-                    requirement = event[key]
-                except KeyError:
-                    continue
-                if requirement != value:
-                    do = False
-                    break
-            if do:
-                try:
-                    tasks.extend(event["tasks"])
-                except KeyError:
-                    pass
+        now = struct_time((0, month, month_day, hour, minute, 0, week_day, 0,
+                           0))
+        for event in self._data.get("schedule", []):
+            try:
+                entry = ScheduleEntry(event)
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if entry.matches(now):
+                tasks.extend(entry.tasks)
 
         return tasks
@@ -20,12 +20,18 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from fnmatch import fnmatch
+from collections import OrderedDict
+from fnmatch import fnmatch, translate
+import re
 import sqlite3 as sqlite
 from threading import Lock
 
+from earwigbot.database import Database
+
 __all__ = ["PermissionsDB"]
 
+_WILDCARDS = re.compile(r"[*?[]")
+
 class PermissionsDB(object):
     """
     **EarwigBot: Permissions Database Manager**
@@ -35,12 +41,17 @@ class PermissionsDB(object):
     """
     ADMIN = 1
     OWNER = 2
+    CACHE_SIZE = 1024
 
     def __init__(self, dbfile):
         self._dbfile = dbfile
+        self._db = Database(dbfile)
         self._db_access_lock = Lock()
         self._users = {}
         self._attributes = {}
+        self._index = {}
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
 
     def __repr__(self):
         """Return the canonical string representation of the PermissionsDB."""
@@ -51,6 +62,11 @@ class PermissionsDB(object):
         """Return a nice string representation of the PermissionsDB."""
         return "<PermissionsDB at {0}>".format(self._dbfile)
 
+    def _after_fork(self):
+        """Replace our locks in a newly forked child process."""
+        self._db_access_lock = Lock()
+        self._cache_lock = Lock()
+
     def _create(self, conn):
         """Initialize the permissions database with its necessary tables."""
         query = """CREATE TABLE users (user_nick, user_ident, user_host,
@@ -58,26 +74,91 @@ class PermissionsDB(object):
                    CREATE TABLE attributes (attr_uid, attr_key, attr_value);"""
         conn.executescript(query)
 
-    def _is_rank(self, user, rank):
-        """Return True if the given user has the given rank, else False."""
+    def _create_records(self, conn):
+        """Add the records table to the database if it does not exist yet.
+
+        This is separate from :py:meth:`_create` so that databases made by
+        older versions of the bot are upgraded in place.
+        """
+        query = """CREATE TABLE IF NOT EXISTS records (rec_group, rec_key,
+                   rec_value, PRIMARY KEY (rec_group, rec_key))"""
+        conn.execute(query)
+
+    def _build_index(self):
+        """Rebuild the rule index used by :py:meth:`_is_rank`.
+
+        Rules without wildcards are looked up by their exact nick, ident, and
+        host; rules with a literal host are grouped by host; everything else
+        is matched with compiled patterns. Each rule keeps its position in
+        :py:attr:`users`, so the first matching rule wins, like a linear scan.
+        Cached decisions are cleared.
+        """
+        index = {}
+        for rank, rules in self._users.iteritems():
+            exact, by_host, wild = {}, {}, []
+            for pos, rule in enumerate(rules):
+                pats = rule.compile()
+                if not any(pats):
+                    key = (rule.nick, rule.ident, rule.host)
+                    exact.setdefault(key, (pos, rule))
+                elif not pats[2]:
+                    by_host.setdefault(rule.host, []).append((pos, rule))
+                else:
+                    wild.append((pos, rule))
+            index[rank] = (exact, by_host, wild)
+        with self._cache_lock:
+            self._index = index
+            self._cache.clear()
+
+    def _search_index(self, user, rank):
+        """Return the first rule of the given rank matching the user."""
         try:
-            for rule in self._users[rank]:
-                if user in rule:
-                    return rule
+            exact, by_host, wild = self._index[rank]
         except KeyError:
-            pass
-        return False
+            return False
+        best = exact.get((user.nick, user.ident, user.host))
+        for candidates in (by_host.get(user.host, ()), wild):
+            for pos, rule in candidates:
+                if best and pos > best[0]:
+                    break
+                if rule.matches(user):
+                    best = (pos, rule)
+                    break
+        return best[1] if best else False
+
+    def _is_rank(self, user, rank):
+        """Return True if the given user has the given rank, else False.
+
+        Recent decisions are kept in a small LRU cache, which is cleared
+        whenever the rules change.
+        """
+        key = (user.nick, user.ident, user.host, rank)
+        with self._cache_lock:
+            if key in self._cache:
+                result = self._cache.pop(key)
+                self._cache[key] = result
+                return result
+            index = self._index
+
+        result = self._search_index(user, rank)
+        with self._cache_lock:
+            if self._index is index:
+                self._cache[key] = result
+                if len(self._cache) > self.CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return result
 
     def _set_rank(self, user, rank):
         """Add a User to the database under a given rank."""
         query = "INSERT INTO users VALUES (?, ?, ?, ?)"
         with self._db_access_lock:
-            with sqlite.connect(self._dbfile) as conn:
+            with self._db.connect() as conn:
                 conn.execute(query, (user.nick, user.ident, user.host, rank))
             try:
                 self._users[rank].append(user)
             except KeyError:
                 self._users[rank] = [user]
+            self._build_index()
         return user
 
     def _del_rank(self, user, rank):
@@ -88,10 +169,11 @@ class PermissionsDB(object):
             try:
                 for rule in self._users[rank]:
                     if user in rule:
-                        with sqlite.connect(self._dbfile) as conn:
+                        with self._db.connect() as conn:
                             args = (user.nick, user.ident, user.host, rank)
                             conn.execute(query, args)
                         self._users[rank].remove(rule)
+                        self._build_index()
                         return rule
             except KeyError:
                 pass
@@ -112,7 +194,7 @@ class PermissionsDB(object):
         qry1 = "SELECT user_nick, user_ident, user_host, user_rank FROM users"
         qry2 = "SELECT attr_uid, attr_key, attr_value FROM attributes"
         self._users = {}
-        with sqlite.connect(self._dbfile) as conn, self._db_access_lock:
+        with self._db.connect() as conn, self._db_access_lock:
             try:
                 for nick, ident, host, rank in conn.execute(qry1):
                     try:
@@ -126,6 +208,8 @@ class PermissionsDB(object):
                         self._attributes[user] = {key: value}
             except sqlite.OperationalError:
                 self._create(conn)
+            self._create_records(conn)
+            self._build_index()
 
     def has_exact(self, rank, nick="*", ident="*", host="*"):
         """Return ``True`` if there is an exact match for this rule."""
@@ -182,7 +266,7 @@ class PermissionsDB(object):
         query2 = "INSERT INTO attributes VALUES (?, ?, ?)"
         query3 = """UPDATE attributes SET attr_value = ? WHERE attr_uid = ?
                     AND attr_key = ?"""
-        with self._db_access_lock, sqlite.connect(self._dbfile) as conn:
+        with self._db_access_lock, self._db.connect() as conn:
             if conn.execute(query1, (user, key)).fetchone():
                 conn.execute(query3, (value, user, key))
             else:
@@ -195,8 +279,42 @@ class PermissionsDB(object):
     def remove_attr(self, user, key):
         """Remove the attribute *key* of a given *user*."""
         query = "DELETE FROM attributes WHERE attr_uid = ? AND attr_key = ?"
-        with self._db_access_lock, sqlite.connect(self._dbfile) as conn:
+        with self._db_access_lock, self._db.connect() as conn:
             conn.execute(query, (user, key))
+        try:
+            del self._attributes[user][key]
+        except KeyError:
+            pass
+
+    def get_records(self, group):
+        """Return a dict of every record stored under the given *group*.
+
+        Records are a simple key/value store for commands and tasks that keep
+        many small items, like stalks or reminders. Unlike attributes, each
+        record is its own row, so changing one does not rewrite the others.
+        Keys and values should be ASCII strings.
+        """
+        query = "SELECT rec_key, rec_value FROM records WHERE rec_group = ?"
+        with self._db.connect() as conn:
+            return dict(conn.execute(query, (group,)))
+
+    def set_record(self, group, key, value):
+        """Insert or replace the record *key* in the given *group*."""
+        self.set_records(group, [(key, value)])
+
+    def set_records(self, group, items):
+        """Insert or replace many ``(key, value)`` records in one transaction.
+        """
+        query = "INSERT OR REPLACE INTO records VALUES (?, ?, ?)"
+        args = [(group, key, value) for key, value in items]
+        with self._db_access_lock, self._db.connect() as conn:
+            conn.executemany(query, args)
+
+    def remove_record(self, group, key):
+        """Remove the record *key* from the given *group*, if it exists."""
+        query = "DELETE FROM records WHERE rec_group = ? AND rec_key = ?"
+        with self._db_access_lock, self._db.connect() as conn:
+            conn.execute(query, (group, key))
 
 class _User(object):
     """A class that represents an IRC user for the purpose of testing rules."""
@@ -204,6 +322,7 @@ class _User(object):
         self.nick = nick
         self.ident = ident
         self.host = host
+        self._patterns = None
 
     def __repr__(self):
         """Return the canonical string representation of the User."""
@@ -214,6 +333,33 @@ class _User(object):
         """Return a nice string representation of the User."""
         return "{0}!{1}@{2}".format(self.nick, self.ident, self.host)
 
+    def compile(self):
+        """Return compiled patterns for this rule's nick, ident, and host.
+
+        Fields without wildcards are given as ``None`` and are compared
+        directly. The result is cached on the rule.
+        """
+        if self._patterns is None:
+            self._patterns = tuple(
+                re.compile(translate(field)) if _WILDCARDS.search(field)
+                else None for field in (self.nick, self.ident, self.host))
+        return self._patterns
+
+    def matches(self, user):
+        """Return whether the given user matches this rule.
+
+        This is equivalent to ``user in rule``, but uses compiled patterns.
+        """
+        fields = zip(self.compile(), (self.nick, self.ident, self.host),
+                     (user.nick, user.ident, user.host))
+        for pattern, field, value in fields:
+            if pattern:
+                if not pattern.match(value):
+                    return False
+            elif field != value:
+                return False
+        return True
+
     def __contains__(self, user):
         if fnmatch(user.nick, self.nick):
             if fnmatch(user.ident, self.ident):
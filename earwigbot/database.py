@@ -0,0 +1,99 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Provides long-lived SQLite connections for the bot's databases, like
+:file:`permissions.db`, :file:`sites.db`, and :file:`notes.db`.
+"""
+
+from os import getpid
+import sqlite3 as sqlite
+from threading import local
+
+__all__ = ["Database"]
+
+class Database(object):
+    """
+    **EarwigBot: SQLite Database Access**
+
+    Wraps a single SQLite database file. :py:meth:`connect` returns a
+    connection that is kept open for the calling thread, so repeated queries
+    don't pay for opening the file again. Prepared statements are cached per
+    connection by :py:mod:`sqlite3` itself (up to :py:attr:`CACHED_STATEMENTS`
+    of them).
+
+    Connections are put in WAL mode with ``synchronous=NORMAL``. This lets
+    readers in other threads continue while a writer commits, and only syncs
+    to disk at checkpoints. Writers wait up to :py:attr:`TIMEOUT` seconds for
+    each other rather than failing right away.
+
+    The connection can be used as a context manager just like one returned by
+    :py:func:`sqlite3.connect`, committing on success and rolling back on
+    error; it is not closed afterwards. A thread's connection is closed when
+    the thread exits or calls :py:meth:`close`.
+    """
+    CACHED_STATEMENTS = 200
+    TIMEOUT = 30
+
+    def __init__(self, dbfile):
+        self._dbfile = dbfile
+        self._local = local()
+
+    def __repr__(self):
+        """Return the canonical string representation of the Database."""
+        return "Database(dbfile={0!r})".format(self._dbfile)
+
+    def __str__(self):
+        """Return a nice string representation of the Database."""
+        return "<Database at {0}>".format(self._dbfile)
+
+    def _open(self):
+        """Open and configure a new connection to the database."""
+        conn = sqlite.connect(self._dbfile, timeout=self.TIMEOUT,
+                              cached_statements=self.CACHED_STATEMENTS)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @property
+    def dbfile(self):
+        """The path to the database file."""
+        return self._dbfile
+
+    def connect(self):
+        """Return the calling thread's connection, opening it if needed.
+
+        Connections made before a fork are not reused by the child process.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != getpid():
+            conn = self._local.conn = self._open()
+            self._local.pid = getpid()
+        return conn
+
+    def close(self):
+        """Close the calling thread's connection, if it has one."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            if self._local.pid == getpid():
+                conn.close()
@@ -27,6 +27,7 @@ This module contains all exceptions used by EarwigBot::
 
     EarwigBotError
      +-- NoConfigError
+     +-- CancelledError
      +-- IRCError
      |    +-- BrokenSocketError
      +-- WikiToolsetError
@@ -65,6 +66,15 @@ class NoConfigError(EarwigBotError):
     one to be created.
     """
 
+class CancelledError(EarwigBotError):
+    """A task or command was asked to stop, so we won't carry on with it.
+
+    Raised by :py:meth:`CancelToken.check
+    <earwigbot.cancellation.CancelToken.check>`, and by
+    :py:meth:`Site.api_query <earwigbot.wiki.site.Site.api_query>` if the
+    current token is cancelled.
+    """
+
 class IRCError(EarwigBotError):
     """Base exception class for errors in IRC-relation sections of the bot."""
 
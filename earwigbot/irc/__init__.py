@@ -24,4 +24,5 @@ from earwigbot.irc.connection import *
 from earwigbot.irc.data import *
 from earwigbot.irc.frontend import *
 from earwigbot.irc.rc import *
+from earwigbot.irc.reactor import *
 from earwigbot.irc.watcher import *
@@ -20,30 +20,67 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import deque
+import errno
+from os import strerror
 import socket
 from threading import Lock
-from time import sleep, time
+from time import time
 
 from earwigbot.exceptions import BrokenSocketError
 
 __all__ = ["IRCConnection"]
 
 class IRCConnection(object):
-    """Interface with an IRC server."""
+    """Interface with an IRC server.
+
+    Connections don't run by themselves; they must be added to a
+    :py:class:`~earwigbot.irc.reactor.Reactor`, which connects them and
+    processes incoming lines.
+
+    Outgoing messages are queued and sent by the reactor, so sending never
+    blocks. The socket itself is non-blocking: whatever it won't take right
+    away is buffered and sent once the reactor sees it is writable again, so
+    a slow server can't hold up other connections. Flood control is a token
+    bucket: up to :py:attr:`SEND_BURST` messages can be sent at once, and one
+    more every :py:attr:`SEND_INTERVAL` seconds. Messages are sent in order
+    of priority: protocol messages (like ``PONG``) first, then replies and
+    other messages, then reports of recent changes (:py:attr:`PRIORITY_RC`).
+    When backlogged, duplicate RC reports are dropped, as are reports older
+    than :py:attr:`RC_MAX_AGE` seconds or beyond the most recent
+    :py:attr:`RC_MAX_QUEUE`.
+    """
+    PRIORITY_PROTOCOL = 0
+    PRIORITY_REPLY = 1
+    PRIORITY_RC = 2
+
+    SEND_BURST = 5
+    SEND_INTERVAL = 0.75
+    RC_MAX_AGE = 60
+    RC_MAX_QUEUE = 30
 
     def __init__(self, host, port, nick, ident, realname, logger):
         self._host = host
         self._port = port
-        self._nick = nick
+        self._nick = self._default_nick = nick
         self._ident = ident
         self._realname = realname
         self.logger = logger
 
         self._is_running = False
+        self._stop_requested = False
+        self._reactor = None
+        self._sock = None
+        self._read_buffer = bytearray()
+        self._write_buffer = bytearray()
         self._send_lock = Lock()
+        self._queue_lock = Lock()
+        self._queues = (deque(), deque(), deque())  # One for each priority
+        self._flush_scheduled = False
+        self._tokens = self.SEND_BURST
+        self._last_refill = time()
 
         self._last_recv = time()
-        self._last_send = 0
         self._last_ping = 0
         self._myhost = "." * 63  # default: longest possible hostname
 
@@ -59,25 +96,101 @@ class IRCConnection(object):
         return res.format(self.nick, self.ident, self.host, self.port)
 
     def _connect(self):
-        """Connect to our IRC server."""
+        """Start connecting to our IRC server without blocking.
+
+        The reactor calls :py:meth:`_finish_connect` once the socket is ready.
+        Raises :py:exc:`socket.error` if the connection fails immediately.
+        """
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self._sock.connect((self.host, self.port))
-        except socket.error:
-            self.logger.exception("Couldn't connect to IRC server; retrying")
-            sleep(8)
-            self._connect()
-        self._send("NICK {0}".format(self.nick))
-        self._send("USER {0} {1} * :{2}".format(self.ident, self.host, self.realname))
+        self._sock.setblocking(False)
+        err = self._sock.connect_ex((self.host, self.port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self._sock.close()
+            raise socket.error(err, strerror(err))
+
+    def _finish_connect(self):
+        """Finish connecting to our IRC server and register with it.
+
+        Raises :py:exc:`socket.error` if the connection failed.
+        """
+        err = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise socket.error(err, strerror(err))
+        self._nick = self._default_nick
+        self._myhost = "." * 63
+        self._read_buffer = bytearray()
+        with self._send_lock:
+            self._write_buffer = bytearray()
+        self._last_recv = time()
+        self._last_ping = 0
+        with self._queue_lock:
+            for queue in self._queues:
+                queue.clear()
+            self._tokens = self.SEND_BURST
+            self._last_refill = time()
+        self._is_running = True
+        user = "USER {0} {1} * :{2}".format(self.ident, self.host,
+                                            self.realname)
+        self._send("NICK {0}".format(self.nick),
+                   priority=self.PRIORITY_PROTOCOL)
+        self._send(user, priority=self.PRIORITY_PROTOCOL)
 
     def _close(self):
-        """Completely close our connection with the IRC server."""
+        """Completely close our connection with the IRC server.
+
+        We try once more to send anything left in our write buffer (like a
+        ``QUIT``), but don't wait for the socket to take it.
+        """
+        self._is_running = False
+        self._handle_write()
         try:
             self._sock.shutdown(socket.SHUT_RDWR)  # Shut down connection first
         except socket.error:
             pass  # Ignore if the socket is already down
         self._sock.close()
 
+    def _handle_read(self):
+        """Read and process lines from the server once our socket is ready.
+
+        Return ``True`` if we received anything, or ``False`` otherwise. If
+        the socket is broken, we are stopped.
+
+        Data is appended to a :py:class:`bytearray` and complete lines are
+        sliced out of it in place, so a burst of input isn't copied over and
+        over. Each line is wrapped in a :py:class:`_Line`, which is only split
+        into words as far as our handlers look at it.
+        """
+        try:
+            data = self._get()
+        except socket.error as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._is_running = False
+            return False
+        except BrokenSocketError:
+            self._is_running = False
+            return False
+
+        buf = self._read_buffer
+        buf.extend(data)
+        start = 0
+        while True:
+            end = buf.find("\n", start)
+            if end < 0:
+                break
+            raw = str(buf[start:end])
+            start = end + 1
+            if not raw or raw.isspace():
+                continue
+            line = _Line(raw)
+            try:
+                self._process_defaults(line)
+                self._process_message(line)
+            except Exception:
+                log = "Error processing line: {0}".format(raw.strip())
+                self.logger.exception(log)
+        del buf[:start]
+        return True
+
     def _get(self, size=4096):
         """Receive (i.e. get) data from the server."""
         data = self._sock.recv(size)
@@ -86,20 +199,113 @@ class IRCConnection(object):
             raise BrokenSocketError()
         return data
 
-    def _send(self, msg, hidelog=False):
-        """Send data to the server."""
+    def _write(self, msg, hidelog=False):
+        """Write a message to the server without waiting for it to be sent.
+
+        As much as the socket will take is sent right away, and the rest is
+        left in our write buffer for the reactor to send when it can.
+        """
         with self._send_lock:
-            time_since_last = time() - self._last_send
-            if time_since_last < 0.75:
-                sleep(0.75 - time_since_last)
+            pending = bool(self._write_buffer)
+            self._write_buffer.extend(msg + "\r\n")
+            if not pending:
+                self._send_buffered()
+            pending = bool(self._write_buffer)
+        if not hidelog:
+            self.logger.debug(msg)
+        if pending and self._reactor:
+            self._reactor._wake()  # So it starts watching for writability
+
+    def _send_buffered(self):
+        """Send as much of our write buffer as possible without blocking.
+
+        The send lock must be held. If the socket is broken, we are stopped
+        and the buffer is discarded.
+        """
+        buf = self._write_buffer
+        while buf:
             try:
-                self._sock.sendall(msg + "\r\n")
-            except socket.error:
+                sent = self._sock.send(buf)
+            except socket.error as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                if exc.errno == errno.EINTR:
+                    continue
                 self._is_running = False
-            else:
-                if not hidelog:
-                    self.logger.debug(msg)
-                self._last_send = time()
+                del buf[:]
+                return
+            del buf[:sent]
+
+    def _handle_write(self):
+        """Send buffered data once the reactor sees our socket is writable."""
+        with self._send_lock:
+            if self._write_buffer:
+                self._send_buffered()
+
+    def _wants_write(self):
+        """Return whether we have buffered data waiting to be sent."""
+        return bool(self._write_buffer)
+
+    def _send(self, msg, hidelog=False, priority=PRIORITY_REPLY):
+        """Queue data to be sent to the server without blocking."""
+        with self._queue_lock:
+            queue = self._queues[priority]
+            if priority == self.PRIORITY_RC:
+                if any(entry[1] == msg for entry in queue):
+                    return  # Coalesce with an identical queued report
+                if len(queue) >= self.RC_MAX_QUEUE:
+                    queue.popleft()
+            queue.append((time(), msg, hidelog))
+            self._schedule_flush(0)
+
+    def _schedule_flush(self, delay):
+        """Have the reactor flush our queue. The queue lock must be held."""
+        if not self._flush_scheduled and self._reactor:
+            self._flush_scheduled = True
+            self._reactor.call_later(delay, self._flush)
+
+    def _next_message(self):
+        """Pop the next message to send. The queue lock must be held."""
+        for queue in self._queues[:self.PRIORITY_RC]:
+            if queue:
+                return queue.popleft()
+        queue = self._queues[self.PRIORITY_RC]
+        stale = 0
+        while queue and time() - queue[0][0] > self.RC_MAX_AGE:
+            queue.popleft()
+            stale += 1
+        if stale:
+            log = "Dropped {0} stale RC messages from the send queue"
+            self.logger.debug(log.format(stale))
+        if queue:
+            return queue.popleft()
+
+    def _flush(self):
+        """Send as many queued messages as flood control allows.
+
+        This is called from the reactor, and schedules itself again if
+        messages are still waiting for the token bucket to refill.
+        """
+        while True:
+            with self._queue_lock:
+                self._flush_scheduled = False
+                if not self._is_running:
+                    return
+                now = time()
+                refill = (now - self._last_refill) / self.SEND_INTERVAL
+                self._tokens = min(self.SEND_BURST, self._tokens + refill)
+                self._last_refill = now
+                if not any(self._queues):
+                    return
+                if self._tokens < 1:
+                    delay = (1 - self._tokens) * self.SEND_INTERVAL
+                    self._schedule_flush(delay)
+                    return
+                entry = self._next_message()
+                if not entry:
+                    return
+                self._tokens -= 1
+            self._write(entry[1], entry[2])
 
     def _get_maxlen(self, extra):
         """Return our best guess of the maximum length of a standard message.
@@ -131,9 +337,9 @@ class IRCConnection(object):
     def _quit(self, msg=None):
         """Issue a quit message to the server. Doesn't close the connection."""
         if msg:
-            self._send("QUIT :{0}".format(msg))
+            self._write("QUIT :{0}".format(msg))
         else:
-            self._send("QUIT")
+            self._write("QUIT")
 
     def _process_defaults(self, line):
         """Default process hooks for lines received on IRC."""
@@ -146,7 +352,8 @@ class IRCConnection(object):
                     self.nick, line[2]))
                 self._nick = line[2]
         elif line[1] == "376":  # After sign-on, get our userhost
-            self._send("WHOIS {0}".format(self.nick))
+            self._send("WHOIS {0}".format(self.nick),
+                       priority=self.PRIORITY_PROTOCOL)
         elif line[1] == "311":  # Receiving WHOIS result
             if line[2] == self.nick:
                 self._ident = line[4]
@@ -186,11 +393,15 @@ class IRCConnection(object):
         """Our realname (gecos field) on the server."""
         return self._realname
 
-    def say(self, target, msg, hidelog=False):
-        """Send a private message to a target on the server."""
+    def say(self, target, msg, hidelog=False, priority=PRIORITY_REPLY):
+        """Send a private message to a target on the server.
+
+        Reports of recent changes should use a *priority* of
+        :py:attr:`PRIORITY_RC` so they don't hold up other messages.
+        """
         for msg in self._split(msg, len(target) + 10):
             msg = "PRIVMSG {0} :{1}".format(target, msg)
-            self._send(msg, hidelog)
+            self._send(msg, hidelog, priority)
 
     def reply(self, data, msg, hidelog=False):
         """Send a private message as a reply to a user on the server."""
@@ -231,37 +442,19 @@ class IRCConnection(object):
     def ping(self, target, hidelog=False):
         """Ping another entity on the server."""
         msg = "PING {0}".format(target)
-        self._send(msg, hidelog)
+        self._send(msg, hidelog, self.PRIORITY_PROTOCOL)
 
     def pong(self, target, hidelog=False):
         """Pong another entity on the server."""
         msg = "PONG {0}".format(target)
-        self._send(msg, hidelog)
-
-    def loop(self):
-        """Main loop for the IRC connection."""
-        self._is_running = True
-        read_buffer = ""
-        while 1:
-            try:
-                read_buffer += self._get()
-            except BrokenSocketError:
-                self._is_running = False
-                break
-
-            lines = read_buffer.split("\n")
-            read_buffer = lines.pop()
-            for line in lines:
-                line = line.strip().split()
-                self._process_defaults(line)
-                self._process_message(line)
-            if self.is_stopped():
-                break
-
-        self._close()
+        self._send(msg, hidelog, self.PRIORITY_PROTOCOL)
 
     def keep_alive(self):
-        """Ensure that we stay connected, stopping if the connection breaks."""
+        """Ensure that we stay connected, stopping if the connection breaks.
+
+        This is called periodically by the reactor, which will reconnect us if
+        we stop here.
+        """
         now = time()
         if now - self._last_recv > 120:
             if self._last_ping < self._last_recv:
@@ -270,11 +463,16 @@ class IRCConnection(object):
                 self.ping(self.host)
                 self._last_ping = now
             elif now - self._last_ping > 60:
-                self.logger.debug("No ping response in 60 seconds. Stopping.")
-                self.stop()
+                log = "No ping response in 60 seconds. Reconnecting."
+                self.logger.debug(log)
+                self._is_running = False
 
     def stop(self, msg=None):
-        """Request the IRC connection to close at earliest convenience."""
+        """Request the IRC connection to close at earliest convenience.
+
+        Unlike a broken connection, a stopped connection is not reconnected.
+        """
+        self._stop_requested = True
         if self._is_running:
             self._quit(msg)
             self._is_running = False
@@ -282,3 +480,49 @@ class IRCConnection(object):
     def is_stopped(self):
         """Return whether the IRC connection has been (or is to be) closed."""
         return not self._is_running
+
+
+class _Line(object):
+    """A line received from IRC, split into words only when needed.
+
+    This behaves like the list of whitespace-separated words in the line.
+    Looking at the first two words (the prefix and command, which are usually
+    all that's needed to decide whether to handle a line) only splits those
+    off; the rest of the line is split the first time anything else is used.
+    """
+    __slots__ = ("raw", "_head", "_words")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._head = None
+        self._words = None
+
+    def __repr__(self):
+        """Return the canonical string representation of the line."""
+        return repr(self.words)
+
+    def __getstate__(self):
+        return (self.raw,)
+
+    def __setstate__(self, state):
+        self.__init__(state[0])
+
+    def __getitem__(self, index):
+        if self._words is None and index in (0, 1):
+            if self._head is None:
+                self._head = self.raw.split(None, 2)[:2]
+            return self._head[index]
+        return self.words[index]
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    @property
+    def words(self):
+        """The list of all words in the line."""
+        if self._words is None:
+            self._words = self.raw.split()
+        return self._words
@@ -235,7 +235,7 @@ class Data(object):
 
     def serialize(self):
         """Serialize this object into a tuple and return it."""
-        return (self._my_nick, self._line, self._msgtype)
+        return (self._my_nick, list(self._line), self._msgtype)
 
     @classmethod
     def unserialize(cls, data):
@@ -20,8 +20,6 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from time import sleep
-
 from earwigbot.irc import IRCConnection, Data
 
 __all__ = ["Frontend"]
@@ -48,7 +46,6 @@ class Frontend(IRCConnection):
                       cf["realname"], bot.logger.getChild("frontend"))
 
         self._auth_wait = False
-        self._connect()
 
     def __repr__(self):
         """Return the canonical string representation of the Frontend."""
@@ -90,8 +87,8 @@ class Frontend(IRCConnection):
                 if data.msg.startswith("This nickname is registered."):
                     return
                 self._auth_wait = False
-                sleep(2)  # Wait for hostname change to propagate
-                self._join_channels()
+                # Wait for hostname change to propagate:
+                self._reactor.call_later(2, self._join_channels)
 
         elif line[1] == "376":  # On successful connection to the server
             # If we're supposed to auth to NickServ, do that:
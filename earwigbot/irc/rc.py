@@ -25,7 +25,12 @@ import re
 __all__ = ["RC"]
 
 class RC(object):
-    """Store data from an event received from our IRC watcher."""
+    """Store data from an event received from our IRC watcher.
+
+    The IRC watcher calls :py:meth:`parse` before handing an event to
+    anything else, so malformed ones are dropped early and threads sharing an
+    event never see it half-parsed.
+    """
     re_color = re.compile("\x03([0-9]{1,2}(,[0-9]{1,2})?)?")
     re_edit = re.compile("\A\[\[(.*?)\]\]\s(.*?)\s(https?://.*?)\s\*\s(.*?)\s\*\s(.*?)\Z")
     re_log = re.compile("\A\[\[(.*?)\]\]\s(.*?)\s\s\*\s(.*?)\s\*\s(.*?)\Z")
@@ -46,28 +51,35 @@ class RC(object):
         return "<RC of {0!r} on {1}>".format(self.msg, self.chan)
 
     def parse(self):
-        """Parse a recent change event into some variables."""
+        """Parse a recent change event into some variables.
+
+        Raises :py:exc:`ValueError` if the event isn't in a format we know.
+        Nothing is changed until parsing has succeeded.
+        """
         # Strip IRC color codes; we don't want or need 'em:
-        self.msg = self.re_color.sub("", self.msg).strip()
-        msg = self.msg
-        self.is_edit = True
+        msg = self.re_color.sub("", self.msg).strip()
+        is_edit = True
 
         # Flags: 'M' for minor edit, 'B' for bot edit, 'create' for a user
         # creation log entry, etc:
         try:
-            page, self.flags, url, user, comment = self.re_edit.findall(msg)[0]
+            page, flags, url, user, comment = self.re_edit.findall(msg)[0]
         except IndexError:
             # We're probably missing the http:// part, because it's a log
             # entry, which lacks a URL:
-            page, flags, user, comment = self.re_log.findall(msg)[0]
+            try:
+                page, flags, user, comment = self.re_log.findall(msg)[0]
+            except IndexError:
+                raise ValueError("Malformed RC event: {0!r}".format(msg))
             url = "https://{0}.org/wiki/{1}".format(self.chan[1:], page)
 
-            self.is_edit = False  # This is a log entry, not edit
+            is_edit = False  # This is a log entry, not edit
 
             # Flags tends to have extra whitespace at the end when they're
             # log entries:
-            self.flags = flags.strip()
+            flags = flags.strip()
 
+        self.msg, self.is_edit, self.flags = msg, is_edit, flags
         self.page, self.url, self.user, self.comment = page, url, user, comment
 
     def prettify(self):
@@ -0,0 +1,325 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import errno
+from fcntl import F_GETFL, F_SETFL, fcntl
+from heapq import heappop, heappush
+from itertools import count
+from os import O_NONBLOCK, close, pipe, read, write
+import select
+import socket
+from threading import Lock
+from time import time
+
+__all__ = ["Reactor"]
+
+class Reactor(object):
+    """
+    **EarwigBot: IRC Reactor**
+
+    Runs any number of :py:class:`~earwigbot.irc.connection.IRCConnection`\ s
+    in a single thread. Sockets are multiplexed with :py:func:`select.epoll`
+    where available (falling back to :py:func:`select.select`), and timers
+    scheduled with :py:meth:`call_later` run in the same loop.
+
+    Connections added with :py:meth:`add` are connected without blocking.
+    If a connection fails or is lost (including when the server stops
+    answering pings, as checked every :py:attr:`KEEP_ALIVE_INTERVAL`
+    seconds), we reconnect after a delay that starts at zero and doubles up to
+    :py:attr:`MAX_BACKOFF` seconds while attempts keep failing. Connections
+    that are stopped with :py:meth:`IRCConnection.stop()
+    <earwigbot.irc.connection.IRCConnection.stop>` are closed and forgotten.
+
+    Sockets are never allowed to block the loop: connections buffer what
+    their sockets won't take, and we watch a socket for writability only
+    while it has something buffered.
+
+    :py:meth:`add`, :py:meth:`call_later`, and :py:meth:`stop` are
+    thread-safe; everything else happens in the thread running :py:meth:`run`.
+    """
+    KEEP_ALIVE_INTERVAL = 10
+    MIN_BACKOFF = 8
+    MAX_BACKOFF = 300
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._running = False
+        self._conns = {}  # fileno -> [connection, is_connecting]
+        self._fds = {}  # connection -> fileno
+        self._backoffs = {}  # connection -> delay before next reconnect
+        self._writing = set()  # filenos watched for writability
+
+        self._timers = []
+        self._counter = count()
+        self._lock = Lock()
+        self._wake_r, self._wake_w = pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | O_NONBLOCK)
+
+        if hasattr(select, "epoll"):
+            self._epoll = select.epoll()
+            self._epoll.register(self._wake_r, select.EPOLLIN)
+        else:
+            self._epoll = None
+        self.call_later(self.KEEP_ALIVE_INTERVAL, self._keep_alive)
+
+    def __repr__(self):
+        """Return the canonical string representation of the Reactor."""
+        return "Reactor(logger={0!r})".format(self.logger)
+
+    def __str__(self):
+        """Return a nice string representation of the Reactor."""
+        return "<Reactor with {0} connections>".format(len(self._conns))
+
+    def _wake(self):
+        """Interrupt the poll in :py:meth:`run` so it notices new work.
+
+        This never blocks: if the pipe is full, the reactor has plenty of
+        wake-ups waiting already.
+        """
+        if self._wake_w is None:  # Already closed
+            return
+        try:
+            write(self._wake_w, "x")
+        except OSError:  # Full (EAGAIN) or closed
+            pass
+
+    def _after_fork(self):
+        """Forget our timers and replace our lock in a forked child process.
+
+        Nothing runs the reactor in the child, so timers would never fire.
+        """
+        self._timers = []
+        self._lock = Lock()
+
+    def _run_timers(self):
+        """Call any due timers; return the seconds until the next, or None."""
+        while True:
+            with self._lock:
+                if not self._timers:
+                    return None
+                when, _, func, args = self._timers[0]
+                delay = when - time()
+                if delay > 0:
+                    return delay
+                heappop(self._timers)
+            try:
+                func(*args)
+            except Exception:
+                self.logger.exception("Error in reactor timer {0}".format(
+                    getattr(func, "__name__", func)))
+
+    def _poll(self, timeout):
+        """Wait for socket events.
+
+        Return a list of ``(fd, readable, writable)`` tuples. Errors count as
+        both, so whoever handles them notices.
+        """
+        try:
+            if self._epoll:
+                if timeout is None:
+                    timeout = -1
+                errors = select.EPOLLERR | select.EPOLLHUP
+                return [(fd, bool(mask & (select.EPOLLIN | errors)),
+                         bool(mask & (select.EPOLLOUT | errors)))
+                        for fd, mask in self._epoll.poll(timeout)]
+
+            reads = [self._wake_r]
+            writes = list(self._writing)
+            for fd, (_, connecting) in self._conns.iteritems():
+                (writes if connecting else reads).append(fd)
+            ready = select.select(reads, writes, reads + writes, timeout)
+            readable = set(ready[0] + ready[2])
+            writable = set(ready[1] + ready[2])
+            return [(fd, fd in readable, fd in writable)
+                    for fd in readable | writable]
+        except (IOError, OSError, select.error) as exc:
+            if exc.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def _watch(self, conn, connecting):
+        """Start watching a connection's socket for readiness."""
+        fd = conn._sock.fileno()
+        self._conns[fd] = [conn, connecting]
+        self._fds[conn] = fd
+        if self._epoll:
+            self._epoll.register(fd, select.EPOLLOUT if connecting else
+                                 select.EPOLLIN)
+
+    def _set_connected(self, conn):
+        """Switch a connection's socket from connecting to reading."""
+        fd = self._fds[conn]
+        self._conns[fd][1] = False
+        if self._epoll:
+            self._epoll.modify(fd, select.EPOLLIN)
+        self._update_writing(conn)
+
+    def _update_writing(self, conn):
+        """Watch a connection for writability only if it has data buffered."""
+        fd = self._fds.get(conn)
+        if fd is None or self._conns[fd][1]:
+            return
+        wants = conn._wants_write()
+        if wants == (fd in self._writing):
+            return
+        if wants:
+            self._writing.add(fd)
+        else:
+            self._writing.discard(fd)
+        if self._epoll:
+            mask = select.EPOLLIN | (select.EPOLLOUT if wants else 0)
+            self._epoll.modify(fd, mask)
+
+    def _unwatch(self, conn):
+        """Stop watching a connection's socket, if we are."""
+        fd = self._fds.pop(conn, None)
+        if fd is not None:
+            del self._conns[fd]
+            self._writing.discard(fd)
+            if self._epoll:
+                self._epoll.unregister(fd)
+
+    def _start(self, conn):
+        """Start connecting a connection, retrying later if that fails."""
+        if conn._stop_requested:
+            self._backoffs.pop(conn, None)
+            return
+        try:
+            conn._connect()
+        except socket.error:
+            conn.logger.exception("Couldn't connect to IRC server")
+            self._retry(conn)
+        else:
+            self._watch(conn, connecting=True)
+
+    def _retry(self, conn):
+        """Schedule a reconnection attempt after the connection's backoff."""
+        delay = self._backoffs.get(conn, 0)
+        self._backoffs[conn] = min(max(delay * 2, self.MIN_BACKOFF),
+                                   self.MAX_BACKOFF)
+        if delay:
+            log = "Reconnecting to IRC server in {0} seconds"
+            conn.logger.info(log.format(delay))
+        self.call_later(delay, self._start, conn)
+
+    def _drop(self, conn):
+        """Close a connection; reconnect it unless it was stopped for good."""
+        self._unwatch(conn)
+        conn._close()
+        if conn._stop_requested:
+            self._backoffs.pop(conn, None)
+        else:
+            conn.logger.warn("Lost connection to IRC server")
+            self._retry(conn)
+
+    def _handle(self, fd, readable, writable):
+        """Handle readiness of a given file descriptor."""
+        if fd == self._wake_r:
+            try:
+                while read(self._wake_r, 4096):
+                    pass
+            except OSError:  # Drained (EAGAIN)
+                pass
+            return
+        if fd not in self._conns:
+            return
+        conn, connecting = self._conns[fd]
+        if connecting:
+            try:
+                conn._finish_connect()
+            except socket.error as exc:
+                conn.logger.error("Couldn't connect to IRC server: {0}".format(
+                    exc))
+                self._unwatch(conn)
+                conn._close()
+                self._retry(conn)
+            else:
+                self._set_connected(conn)
+            return
+
+        if writable:
+            conn._handle_write()
+        if readable and conn._handle_read():
+            self._backoffs.pop(conn, None)
+        if conn.is_stopped():
+            self._drop(conn)
+
+    def _keep_alive(self):
+        """Check that all connections are alive, dropping any that aren't."""
+        for conn, connecting in self._conns.values():
+            if not connecting:
+                conn.keep_alive()
+                if conn.is_stopped():
+                    self._drop(conn)
+        self.call_later(self.KEEP_ALIVE_INTERVAL, self._keep_alive)
+
+    def _close_all(self):
+        """Close all connections and release our own resources."""
+        for conn, _ in self._conns.values():
+            self._unwatch(conn)
+            conn._close()
+        if self._epoll:
+            self._epoll.close()
+        wake_w, self._wake_w = self._wake_w, None
+        close(wake_w)
+        close(self._wake_r)
+
+    def add(self, conn):
+        """Add a new connection to the reactor and start connecting it."""
+        conn._reactor = self
+        self.call_later(0, self._start, conn)
+
+    def call_later(self, delay, func, *args):
+        """Call *func* with *args* from the reactor after *delay* seconds."""
+        with self._lock:
+            entry = (time() + delay, next(self._counter), func, args)
+            heappush(self._timers, entry)
+        self._wake()
+
+    def run(self):
+        """Run the reactor until :py:meth:`stop` is called.
+
+        This blocks, so it is usually run from its own thread (or, in
+        :py:meth:`Bot.run() <earwigbot.bot.Bot.run>`, from the main thread).
+        """
+        self._running = True
+        while self._running:
+            timeout = self._run_timers()
+            for conn in self._fds.keys():
+                self._update_writing(conn)
+            for fd, readable, writable in self._poll(timeout):
+                try:
+                    self._handle(fd, readable, writable)
+                except Exception:
+                    self.logger.exception("Error handling socket event")
+        self._close_all()
+
+    def stop(self):
+        """Stop the reactor, closing all of its connections."""
+        self._running = False
+        self._wake()
+
+    @property
+    def is_running(self):
+        """Whether or not the reactor is currently running."""
+        return self._running
@@ -21,6 +21,8 @@
 # SOFTWARE.
 
 import imp
+from Queue import Queue
+from threading import Thread
 
 from earwigbot.irc import IRCConnection, RC
 
@@ -35,6 +37,10 @@ class Watcher(IRCConnection):
     occurs, we run it through some rules stored in our working directory under
     :file:`rules.py`, which can result in wiki bot tasks being started or
     messages being sent to channels on the IRC frontend.
+
+    Events are handled in order by a thread of their own, not by the reactor
+    thread, since rules and other handlers may be slow or wait for the bot's
+    :py:attr:`~earwigbot.bot.Bot.component_lock` (held while it restarts).
     """
 
     def __init__(self, bot):
@@ -43,8 +49,9 @@ class Watcher(IRCConnection):
         base = super(Watcher, self)
         base.__init__(cf["host"], cf["port"], cf["nick"], cf["ident"],
                       cf["realname"], bot.logger.getChild("watcher"))
+        self._events = Queue()
+        self._event_thread = None
         self._prepare_process_hook()
-        self._connect()
 
     def __repr__(self):
         """Return the canonical string representation of the Watcher."""
@@ -68,16 +75,46 @@ class Watcher(IRCConnection):
                 return
 
             msg = " ".join(line[3:])[1:]
-            rc = RC(chan, msg)  # New RC object to store this event's data
-            rc.parse()  # Parse a message into pagenames, usernames, etc.
-            self._process_rc_event(rc)
-            self.bot.commands.call("rc", rc)
+            self._queue_event(RC(chan, msg))
 
         # When we've finished starting up, join all watcher channels:
         elif line[1] == "376":
             for chan in self.bot.config.irc["watcher"]["channels"]:
                 self.join(chan)
 
+    def _queue_event(self, rc):
+        """Queue an RC event for our event thread, starting it if needed."""
+        if not self._event_thread:
+            self._event_thread = Thread(target=self._event_loop,
+                                        name="irc:watcher")
+            self._event_thread.daemon = True
+            self._event_thread.start()
+        self._events.put(rc)
+
+    def _event_loop(self):
+        """Handle queued RC events until we are stopped."""
+        while True:
+            rc = self._events.get()
+            if rc is None:
+                return
+            try:
+                self._handle_event(rc)
+            except Exception:
+                self.logger.exception("Error handling RC event: " + rc.msg)
+
+    def _handle_event(self, rc):
+        """Parse an RC event and pass it to everything interested in it."""
+        try:
+            # Parse now, before the event is shared with other threads:
+            rc.parse()
+        except ValueError:
+            self.logger.debug("Ignoring malformed RC event: " + rc.msg)
+            return
+        self.bot.wiki.process_rc(rc)
+        self.bot.tasks.process_rc(rc)
+        self._process_rc_event(rc)
+        self.bot.commands.call("rc", rc)
+
     def _prepare_process_hook(self):
         """Create our RC event process hook from information in rules.py.
 
@@ -126,4 +163,13 @@ class Watcher(IRCConnection):
                 else:
                     msg = pretty[:400]
                 for chan in chans:
-                    frontend.say(chan, msg)
+                    frontend.say(chan, msg, priority=frontend.PRIORITY_RC)
+
+    def stop(self, msg=None):
+        """Request the watcher to stop, along with its event thread.
+
+        Events already queued are still handled.
+        """
+        super(Watcher, self).stop(msg)
+        if self._event_thread:
+            self._events.put(None)
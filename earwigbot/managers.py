@@ -21,13 +21,28 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import deque
+from functools import partial
+from heapq import heapify, heappop, heappush
 import imp
-from os import listdir, path
+from itertools import count
+from json import dump, load
+import logging
+from multiprocessing import Pipe, Process
+from operator import itemgetter
+from os import kill, listdir, name as os_name, path
+from Queue import Queue
+from random import randrange
+from signal import SIG_DFL, SIGKILL, SIGTERM, signal
 from re import sub
-from threading import RLock, Thread
-from time import gmtime, strftime
+from threading import Condition, Event, Lock, RLock, Thread, current_thread
+from time import gmtime, localtime, strftime, time
+from urlparse import urlparse
 
+from earwigbot import __version__
+from earwigbot.cancellation import CancelToken, set_token
 from earwigbot.commands import Command
+from earwigbot.exceptions import CancelledError
 from earwigbot.tasks import Task
 
 __all__ = ["CommandManager", "TaskManager"]
@@ -47,12 +62,31 @@ class _ResourceManager(object):
     This class handles the low-level tasks of (re)loading resources via
     :py:meth:`load`, retrieving specific resources via :py:meth:`get`, and
     iterating over all resources via :py:meth:`__iter__`.
+
+    If :py:attr:`config.commands["lazy"]
+    <earwigbot.config.BotConfig.commands>` (or ``config.tasks["lazy"]``) is
+    set, loading doesn't import anything: resources are found through a
+    manifest cached in the bot's working directory, and each module is only
+    imported, and its resources created, when one of them is first used.
+    Modules that are new or have changed since the manifest was written are
+    still imported to describe them, but not set up; the imported classes are
+    kept so the module isn't imported again when it is first used.
+
+    A module counts as changed only if its own source file is newer, so one
+    whose resources take their names or hooks from another module must be
+    touched (or the manifest deleted) when that module changes. The whole
+    manifest is rebuilt if it was written by another version of EarwigBot or
+    in another format (see :py:attr:`MANIFEST_VERSION`).
     """
+    MANIFEST_VERSION = 1
+
     def __init__(self, bot, name, base):
         self.bot = bot
         self.logger = bot.logger.getChild(name)
 
         self._resources = {}
+        self._manifest = {}
+        self._described = {}  # (module, dir) -> classes imported to describe
         self._resource_name = name  # e.g. "commands" or "tasks"
         self._resource_base = base  # e.g. Command or Task
         self._resource_access_lock = RLock()
@@ -69,8 +103,10 @@ class _ResourceManager(object):
 
     def __iter__(self):
         with self.lock:
-            for resource in self._resources.itervalues():
-                yield resource
+            for resource in self._resources.values():
+                resource = self._resolve(resource)
+                if resource:
+                    yield resource
 
     def _is_disabled(self, name):
         """Check whether a resource should be disabled."""
@@ -97,15 +133,11 @@ class _ResourceManager(object):
             self._resources[resource.name] = resource
             self.logger.debug("Loaded {0} {1}".format(res_type, resource.name))
 
-    def _load_module(self, name, path):
-        """Load a specific resource from a module, identified by name and path.
+    def _import_module(self, name, path):
+        """Import a module by name and path, returning its resource classes.
 
-        We'll first try to import it using imp magic, and if that works, make
-        instances of any classes inside that are subclasses of the base
-        (:py:attr:`self._resource_base <_resource_base>`), add them to the
-        resources dictionary with :py:meth:`self._load_resource()
-        <_load_resource>`, and finally log the addition. Any problems along
-        the way will either be ignored or logged.
+        Returns ``None`` if the module couldn't be imported; the problem is
+        logged.
         """
         f, path, desc = imp.find_module(name, [path])
         try:
@@ -113,18 +145,152 @@ class _ResourceManager(object):
         except Exception:
             e = "Couldn't load module '{0}' (from {1})"
             self.logger.exception(e.format(name, path))
-            return
+            return None
         finally:
             f.close()
 
+        classes = []
         for obj in vars(module).values():
             if type(obj) is type:
                 isresource = issubclass(obj, self._resource_base)
                 if isresource and not obj is self._resource_base:
-                    self._load_resource(name, path, obj)
+                    classes.append(obj)
+        return classes
+
+    def _load_module(self, name, path):
+        """Load a specific resource from a module, identified by name and path.
+
+        We'll first try to import it using imp magic, and if that works, make
+        instances of any classes inside that are subclasses of the base
+        (:py:attr:`self._resource_base <_resource_base>`), add them to the
+        resources dictionary with :py:meth:`self._load_resource()
+        <_load_resource>`, and finally log the addition. Any problems along
+        the way will either be ignored or logged.
+        """
+        for klass in self._import_module(name, path) or []:
+            self._load_resource(name, path, klass)
+
+    def _describe_resource(self, klass):
+        """Return a manifest entry for a resource class.
+
+        This should include everything needed to index the resource without
+        creating it; subclasses can add to it.
+        """
+        return {"name": klass.name}
+
+    def _get_manifest_path(self):
+        """Return the path to the cached manifest for lazy loading."""
+        filename = ".{0}.manifest".format(self._resource_name)
+        return path.join(self.bot.config.root_dir, filename)
 
-    def _load_directory(self, dir):
-        """Load all valid resources in a given directory."""
+    def _get_manifest_version(self):
+        """Return the version key stored with (and required of) manifests."""
+        return [self.MANIFEST_VERSION, __version__]
+
+    def _read_manifest(self):
+        """Return the cached manifest, or an empty one if it's unusable.
+
+        A manifest with a different version key (see
+        :py:meth:`_get_manifest_version`) is unusable.
+        """
+        try:
+            with open(self._get_manifest_path()) as fp:
+                data = load(fp)
+        except (IOError, ValueError):
+            return {}
+        try:
+            if data["version"] == self._get_manifest_version():
+                return data["modules"]
+        except (KeyError, TypeError):
+            pass
+        return {}
+
+    def _write_manifest(self, manifest):
+        """Save the manifest, logging (but ignoring) any errors."""
+        data = {"version": self._get_manifest_version(), "modules": manifest}
+        try:
+            with open(self._get_manifest_path(), "w") as fp:
+                dump(data, fp)
+        except IOError:
+            log = "Couldn't save {0} manifest".format(self._resource_name)
+            self.logger.exception(log)
+
+    def _get_module_mtime(self, name, dir):
+        """Return the newest modification time of a module's source files."""
+        mtimes = [path.getmtime(path.join(dir, name + ext))
+                  for ext in (".py", ".pyc")
+                  if path.exists(path.join(dir, name + ext))]
+        return max(mtimes) if mtimes else 0
+
+    def _add_lazy_module(self, name, dir, cached):
+        """Add placeholders for the resources in a module without loading it.
+
+        The module's entry in *cached* (the previous manifest) is used if the
+        module hasn't changed since; otherwise the module is imported and
+        described again. The module's new entry is saved in
+        :py:attr:`_manifest`.
+        """
+        key = path.join(dir, name)
+        mtime = self._get_module_mtime(name, dir)
+        entry = cached.get(key)
+        if not entry or entry["mtime"] != mtime:
+            classes = self._import_module(name, dir)
+            if classes is None:
+                return
+            self._described[(name, dir)] = classes
+            # Importing the module may have written a new .pyc file:
+            mtime = self._get_module_mtime(name, dir)
+            entry = {"mtime": mtime, "resources": [
+                self._describe_resource(klass) for klass in classes]}
+        self._manifest[key] = entry
+
+        res_type = self._resource_name[:-1]  # e.g. "command" or "task"
+        for info in entry["resources"]:
+            if self._is_disabled(name) and self._is_disabled(info["name"]):
+                log = "Skipping disabled {0} {1}"
+                self.logger.debug(log.format(res_type, info["name"]))
+                continue
+            self._resources[info["name"]] = _LazyResource(name, dir, info)
+
+    def _resolve(self, resource):
+        """Return the real resource for a placeholder, loading its module.
+
+        Anything that isn't a placeholder is returned as-is. If the resource
+        couldn't be created, it is removed and ``None`` is returned.
+        """
+        if not isinstance(resource, _LazyResource):
+            return resource
+        with self.lock:
+            current = self._resources.get(resource.name)
+            if current is not resource:  # Already resolved by someone else
+                return current
+            name, dir = resource.module
+            log = "Loading {0} module {1} on first use"
+            self.logger.debug(log.format(self._resource_name[:-1], name))
+            classes = self._described.pop((name, dir), None)
+            if classes is None:
+                self._load_module(name, dir)
+            else:  # Already imported when the manifest was rebuilt
+                for klass in classes:
+                    self._load_resource(name, dir, klass)
+            for key, value in self._resources.items():
+                if isinstance(value, _LazyResource) and value.module == (
+                        name, dir):
+                    del self._resources[key]  # Failed to load
+            self._on_resolve()
+            return self._resources.get(resource.name)
+
+    def _on_resolve(self):
+        """Hook called (with the lock held) after placeholders are replaced.
+        """
+        pass
+
+    def _load_directory(self, dir, cached=None):
+        """Load all valid resources in a given directory.
+
+        If *cached* is given, resources are loaded lazily, using it as the
+        previous manifest.
+        """
         self.logger.debug("Loading directory {0}".format(dir))
         processed = []
         for name in listdir(dir):
@@ -140,12 +306,17 @@ class _ResourceManager(object):
                 log = "Skipping disabled module {0}".format(modname)
                 self.logger.debug(log)
                 continue
-            self._load_module(modname, dir)
+            if cached is None:
+                self._load_module(modname, dir)
+            else:
+                self._add_lazy_module(modname, dir, cached)
 
     def _unload_resources(self):
         """Unload all resources, calling their unload hooks in the process."""
         res_type = self._resource_name[:-1]  # e.g. "command" or "task"
-        for resource in self:
+        for resource in self._resources.values():
+            if isinstance(resource, _LazyResource):
+                continue  # Never loaded, so there's nothing to unload
             if not hasattr(resource, "unload"):
                 continue
             try:
@@ -155,6 +326,13 @@ class _ResourceManager(object):
                 self.logger.exception(e.format(res_type, resource.name))
         self._resources.clear()
 
+    def _after_fork(self):
+        """Replace our lock in a newly forked child process.
+
+        Another thread of the parent process may have held it when it forked.
+        """
+        self._resource_access_lock = RLock()
+
     @property
     def lock(self):
         """The resource access/modify lock."""
@@ -168,16 +346,22 @@ class _ResourceManager(object):
             builtin_dir = path.join(path.dirname(__file__), name)
             plugins_dir = path.join(self.bot.config.root_dir, name)
             conf = getattr(self.bot.config, name)
+            cached = self._read_manifest() if conf.get("lazy") else None
+            self._manifest = {}
+            self._described = {}
             if conf.get("disable") is True and not conf.get("enable"):
                 log = "Skipping disabled builtins directory: {0}"
                 self.logger.debug(log.format(builtin_dir))
-            else:
-                self._load_directory(builtin_dir)  # Built-in resources
+            else:  # Built-in resources
+                self._load_directory(builtin_dir, cached)
             if path.exists(plugins_dir) and path.isdir(plugins_dir):
-                self._load_directory(plugins_dir)  # Custom resources, plugins
+                # Custom resources, plugins
+                self._load_directory(plugins_dir, cached)
             else:
                 log = "Skipping nonexistent plugins directory: {0}"
                 self.logger.debug(log.format(plugins_dir))
+            if cached is not None and self._manifest != cached:
+                self._write_manifest(self._manifest)
 
         if self._resources:
             msg = "Loaded {0} {1}: {2}"
@@ -193,15 +377,153 @@ class _ResourceManager(object):
         not found.
         """
         with self.lock:
-            return self._resources[key]
+            resource = self._resolve(self._resources[key])
+            if not resource:
+                raise KeyError(key)
+            return resource
+
+
+class _LazyResource(object):
+    """Stands in for a resource whose module hasn't been loaded yet.
+
+    It is built from an entry in the manager's manifest, and holds just what
+    is needed to index the resource; the manager replaces it with the real
+    resource the first time it is used.
+    """
+    def __init__(self, module, dir, info):
+        self.module = (module, dir)
+        self.name = info["name"]
+        self.commands = info.get("commands", [])
+        self.hooks = info.get("hooks", [])
+        self.custom_check = info.get("check", False)
+
+    def __repr__(self):
+        """Return the canonical string representation of the placeholder."""
+        res = "_LazyResource(module={0!r}, dir={1!r}, name={2!r})"
+        return res.format(self.module[0], self.module[1], self.name)
 
 
 class CommandManager(_ResourceManager):
     """
     Manages (i.e., loads, reloads, and calls) IRC commands.
+
+    When commands are loaded, we build a dispatch table indexing them by hook
+    and by the names that trigger them, so :py:meth:`call` only needs to run
+    :py:meth:`~earwigbot.commands.Command.check` for commands that override
+    it. Matched commands are run by a fixed pool of worker threads, whose size
+    is given by :py:attr:`config.commands["workers"]
+    <earwigbot.config.BotConfig.commands>` (:py:attr:`DEFAULT_WORKERS` by
+    default).
+
+    The ``rc`` hook, which fires for every event the IRC watcher sees, has its
+    own :py:class:`_HookExecutor` so a flood of events can't hold up other
+    commands; it is configured by :py:attr:`config.commands["rcWorkers"]`,
+    :py:attr:`config.commands["rcQueueSize"]`, and
+    :py:attr:`config.commands["rcOverflow"]`.
     """
+    DEFAULT_WORKERS = 8
+    IDLE_WORKER = "irc:worker"
+
     def __init__(self, bot):
         super(CommandManager, self).__init__(bot, "commands", Command)
+        self._dispatch = ({}, {})
+        self._jobs = Queue()
+        self._workers = []
+        self._workers_lock = Lock()
+        self._rc_executor = None
+
+    def _build_dispatch(self):
+        """Index loaded commands by hook and name, for :py:meth:`call`.
+
+        Commands using the default :py:meth:`~earwigbot.commands.Command.check`
+        are indexed under each name in their
+        :py:attr:`~earwigbot.commands.Command.commands` (or just their
+        :py:attr:`~earwigbot.commands.Command.name`); the rest are listed by
+        hook, to be checked one by one. Each entry remembers the command's
+        load order, so ties are broken the same way as a linear scan.
+        Commands that haven't been loaded yet are indexed the same way, using
+        the information in the manifest. The ``rc`` hook passes events with no
+        command name, so its commands are always checked.
+        """
+        by_name = {}
+        by_hook = {}
+        for order, command in enumerate(self._resources.itervalues()):
+            if isinstance(command, _LazyResource):
+                custom = command.custom_check
+            else:
+                custom = self._has_custom_check(type(command))
+            for hook in command.hooks:
+                if custom or hook == "rc":
+                    by_hook.setdefault(hook, []).append((order, command))
+                    continue
+                table = by_name.setdefault(hook, {})
+                for name in command.commands or [command.name]:
+                    table.setdefault(name, []).append((order, command))
+        self._dispatch = (by_name, by_hook)
+
+    @staticmethod
+    def _has_custom_check(klass):
+        """Return whether a command class overrides the default check()."""
+        return klass.check.__func__ is not Command.check.__func__
+
+    def _describe_resource(self, klass):
+        """Return a manifest entry for a command class."""
+        info = super(CommandManager, self)._describe_resource(klass)
+        info["commands"] = list(klass.commands)
+        info["hooks"] = list(klass.hooks)
+        info["check"] = self._has_custom_check(klass)
+        return info
+
+    def _on_resolve(self):
+        """Rebuild the dispatch table once commands have been loaded."""
+        self._build_dispatch()
+
+    def _after_fork(self):
+        """Forget the parent process's worker threads in a forked child."""
+        super(CommandManager, self)._after_fork()
+        self._jobs = Queue()
+        self._workers = []
+        self._workers_lock = Lock()
+        self._rc_executor = None
+
+    def _start_workers(self):
+        """Start our worker threads if they aren't running yet."""
+        with self._workers_lock:
+            if self._workers:
+                return
+            count = self.bot.config.commands.get("workers",
+                                                 self.DEFAULT_WORKERS)
+            for i in xrange(count):
+                thread = Thread(target=self._worker, name=self.IDLE_WORKER)
+                thread.daemon = True
+                thread.start()
+                self._workers.append(thread)
+
+    def _worker(self):
+        """Run queued jobs forever, naming the thread after each one."""
+        thread = current_thread()
+        while True:
+            name, func, args = self._jobs.get()
+            start_time = strftime("%b %d %H:%M:%S")
+            thread.name = "{0} ({1})".format(name, start_time)
+            try:
+                func(*args)
+            finally:
+                thread.name = self.IDLE_WORKER
+
+    def _run_command(self, command, data):
+        """Load a matched command if needed, then process the message."""
+        command = self._resolve(command)
+        if command:
+            self._wrap_process(command, data)
+
+    def _wrap_call(self, name, func, args):
+        """Call a function from :py:meth:`run_in_worker`, logging errors."""
+        try:
+            func(*args)
+        except Exception:
+            e = "Error in worker job '{0}':"
+            self.logger.exception(e.format(name))
 
     def _wrap_check(self, command, data):
         """Check whether a command should be called, catching errors."""
@@ -212,12 +534,22 @@ class CommandManager(_ResourceManager):
             self.logger.exception(e.format(command.name, data))
 
     def _wrap_process(self, command, data):
-        """process() the message, catching and reporting any errors."""
+        """process() the message, catching and reporting any errors.
+
+        The command runs with the bot's cancellation token as the current
+        token, so it is told to stop when the bot stops or restarts.
+        """
+        old_token = set_token(self.bot.cancel_token)
         try:
             command.process(data)
+        except CancelledError:
+            log = "Command '{0}' was cancelled"
+            self.logger.info(log.format(command.name))
         except Exception:
             e = "Error executing command '{0}':"
             self.logger.exception(e.format(command.name))
+        finally:
+            set_token(old_token)
 
     def call(self, hook, data):
         """Respond to a hook type and a :py:class:`~.Data` object.
@@ -232,47 +564,455 @@ class CommandManager(_ResourceManager):
         except KeyError:
             pass
 
-        for command in self:
-            if hook in command.hooks and self._wrap_check(command, data):
-                thread = Thread(target=self._wrap_process,
-                                args=(command, data))
-                start_time = strftime("%b %d %H:%M:%S")
-                thread.name = "irc:{0} ({1})".format(command.name, start_time)
-                thread.daemon = True
-                thread.start()
+        by_name, by_hook = self._dispatch
+        candidates = [(order, command, True)
+                      for order, command in by_hook.get(hook, ())]
+        if hook in by_name and getattr(data, "is_command", False):
+            candidates += [(order, command, False)
+                           for order, command in by_name[hook].get(
+                               data.command, ())]
+            candidates.sort(key=itemgetter(0))
+
+        for _, command, needs_check in candidates:
+            if needs_check:
+                command = self._resolve(command)
+                if not command:
+                    continue
+            if not needs_check or self._wrap_check(command, data):
+                if hook == "rc":
+                    self._get_rc_executor().submit(command, data)
+                else:
+                    self._start_workers()
+                    self._jobs.put(("irc:" + command.name, self._run_command,
+                                    (command, data)))
                 return
 
+    def run_in_worker(self, name, func, *args):
+        """Call *func* with *args* in one of our worker threads.
+
+        This is for reactor timers (see :py:meth:`Reactor.call_later()
+        <earwigbot.irc.reactor.Reactor.call_later>`), which must not block the
+        reactor thread with I/O. The worker thread is named after *name*
+        while it runs, and any exception is logged.
+        """
+        self._start_workers()
+        self._jobs.put((name, self._wrap_call, (name, func, args)))
+
+    def _get_rc_executor(self):
+        """Return the executor for the ``rc`` hook, creating it if needed."""
+        with self._workers_lock:
+            if not self._rc_executor:
+                conf = self.bot.config.commands
+                self._rc_executor = _HookExecutor(
+                    self, "rc", conf.get("rcWorkers", 2),
+                    conf.get("rcQueueSize", 500),
+                    conf.get("rcOverflow", "drop-oldest"))
+            return self._rc_executor
+
+    def get_hook_stats(self):
+        """Return queue statistics for commands on the ``rc`` hook.
+
+        The result is a dictionary mapping command names to dictionaries of
+        ``depth`` (events currently queued), ``peak`` (the highest depth
+        seen), ``processed``, and ``dropped`` event counts.
+        """
+        if not self._rc_executor:
+            return {}
+        return self._rc_executor.stats()
+
+    def load(self):
+        """Load (or reload) all commands and rebuild the dispatch table."""
+        super(CommandManager, self).load()
+        with self.lock:
+            self._build_dispatch()
+
+
+class _HookExecutor(object):
+    """Runs commands for a busy hook on a fixed number of threads.
+
+    Each command gets its own queue holding at most *maxsize* events, and
+    workers take events from the queues in turn, never running more than one
+    event for the same command at once. A slow command can therefore only
+    occupy one worker and fill its own queue; it can't starve other commands
+    or spawn more threads.
+
+    When a command's queue is full, the *policy* decides what to keep:
+    ``"drop-oldest"`` discards the oldest queued event to make room, and
+    ``"sample"`` keeps a uniform random sample of the events seen while the
+    queue has been full.
+    """
+    POLICIES = ("drop-oldest", "sample")
+
+    def __init__(self, manager, hook, workers, maxsize, policy):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown overflow policy: {0}".format(policy))
+        self._manager = manager
+        self._hook = hook
+        self._maxsize = maxsize
+        self._policy = policy
+        self._idle_name = "{0} ({1})".format(manager.IDLE_WORKER, hook)
+
+        self._queues = {}  # command name -> queue state
+        self._order = []  # command names, in the order workers visit them
+        self._cond = Condition()
+        for i in xrange(workers):
+            thread = Thread(target=self._worker, name=self._idle_name)
+            thread.daemon = True
+            thread.start()
+
+    def _get_queue(self, name):
+        """Return the queue state for a command. The lock must be held."""
+        if name not in self._queues:
+            self._queues[name] = {
+                "events": deque(), "busy": False, "overflow": 0, "peak": 0,
+                "processed": 0, "dropped": 0
+            }
+            self._order.append(name)
+        return self._queues[name]
+
+    def _next(self):
+        """Pop the next event to run, in turn. The lock must be held."""
+        for i, name in enumerate(self._order):
+            queue = self._queues[name]
+            if queue["events"] and not queue["busy"]:
+                self._order.append(self._order.pop(i))  # Move to the back
+                queue["busy"] = True
+                return queue, queue["events"].popleft()
+        return None
+
+    def _worker(self):
+        """Run events from the queues forever."""
+        thread = current_thread()
+        while True:
+            with self._cond:
+                job = self._next()
+                while not job:
+                    self._cond.wait()
+                    job = self._next()
+            queue, (command, data) = job
+
+            start_time = strftime("%b %d %H:%M:%S")
+            thread.name = "irc:{0} ({1})".format(command.name, start_time)
+            try:
+                command = self._manager._resolve(command)
+                if command:
+                    self._manager._wrap_process(command, data)
+            finally:
+                thread.name = self._idle_name
+                with self._cond:
+                    queue["busy"] = False
+                    queue["processed"] += 1
+                    self._cond.notify()
+
+    def submit(self, command, data):
+        """Queue an event for a command, applying the overflow policy."""
+        with self._cond:
+            queue = self._get_queue(command.name)
+            events = queue["events"]
+            if len(events) < self._maxsize:
+                queue["overflow"] = 0
+                events.append((command, data))
+                queue["peak"] = max(queue["peak"], len(events))
+                self._cond.notify()
+                return
+
+            queue["dropped"] += 1
+            if queue["dropped"] in (1, 10, 100) or not queue["dropped"] % 1000:
+                log = "Queue for {0} ({1} hook) is full; {2} events dropped"
+                self._manager.logger.warn(log.format(
+                    command.name, self._hook, queue["dropped"]))
+            if self._policy == "drop-oldest":
+                events.popleft()
+                events.append((command, data))
+            else:
+                queue["overflow"] += 1
+                index = randrange(self._maxsize + queue["overflow"])
+                if index < self._maxsize:
+                    events[index] = (command, data)
+            self._cond.notify()
+
+    def stats(self):
+        """Return a dictionary of queue statistics for each command."""
+        with self._cond:
+            return {name: {
+                "depth": len(queue["events"]), "peak": queue["peak"],
+                "processed": queue["processed"], "dropped": queue["dropped"]
+            } for name, queue in self._queues.iteritems()}
+
 
 class TaskManager(_ResourceManager):
     """
     Manages (i.e., loads, reloads, schedules, and runs) wiki bot tasks.
+
+    Tasks started with :py:meth:`start` are run by a bounded executor: at most
+    :py:attr:`config.tasks["maxWorkers"]` tasks (:py:attr:`MAX_WORKERS` by
+    default; ``0`` for no limit) run at once, and at most
+    :py:attr:`config.tasks[task_name]["maxRunning"]` copies of any one task
+    (no limit by default, or if ``0``). Tasks that can't start yet wait in a
+    queue ordered by priority, then by when they were started. Starting a
+    task with the same arguments as one that is still queued or running
+    doesn't start it again.
+
+    CPU-heavy tasks can be run in a child process instead of a thread, so they
+    don't compete with IRC for the GIL, by setting
+    :py:attr:`config.tasks[task_name]["subprocess"]` (on systems with
+    :py:func:`os.fork`). The child starts as a copy of the bot, config and
+    all, but makes new site connections; its log records are passed back to
+    our loggers, and messages it sends through :py:attr:`bot.frontend
+    <earwigbot.bot.Bot.frontend>` or :py:attr:`bot.watcher
+    <earwigbot.bot.Bot.watcher>` are sent by our IRC connections. The child
+    process can start processes of its own.
+
+    Each task run is given a :py:class:`~earwigbot.cancellation.CancelToken`
+    as its ``_cancel`` keyword argument, which :py:meth:`cancel` (or stopping
+    or restarting the bot) cancels. In a child process, the token is
+    cancelled when the process gets a SIGTERM; if it is still running
+    :py:attr:`KILL_TIMEOUT` seconds later, it is killed.
     """
+    MAX_WORKERS = 8
+    KILL_TIMEOUT = 10
+    PRIORITY_HIGH = -10
+    PRIORITY_NORMAL = 0
+    PRIORITY_LOW = 10
+
     def __init__(self, bot):
         super(TaskManager, self).__init__(bot, "tasks", Task)
+        self._queue = []  # Heap of (priority, counter, job)
+        self._queued = {}  # Dedup key -> queued job
+        self._running = {}  # Task name -> number of running copies
+        self._active = set()  # Running jobs
+        self._counter = count()
+        self._exec_lock = Lock()
+        self._shutoff_states = {}
+        self._shutoff_fetches = 0  # Shutoff pages being loaded right now
+        self._shutoff_edits = {}  # (domain, title) -> time seen while loading
+        self._shutoff_lock = Lock()
 
-    def _wrapper(self, task, **kwargs):
-        """Wrapper for task classes: run the task and catch any errors."""
+    def _run_task(self, task, kwargs, token):
+        """Run a task with a cancellation token and catch any errors."""
+        old_token = set_token(token)
         try:
-            task.run(**kwargs)
+            task.run(_cancel=token, **kwargs)
+        except CancelledError:
+            msg = "Task '{0}' was cancelled"
+            self.logger.info(msg.format(task.name))
         except Exception:
             msg = "Task '{0}' raised an exception and had to stop:"
             self.logger.exception(msg.format(task.name))
         else:
             msg = "Task '{0}' finished successfully"
             self.logger.info(msg.format(task.name))
+        finally:
+            set_token(old_token)
+
+    def _wrapper(self, job):
+        """Wrapper for task jobs: run the task, then start any queued ones."""
+        kwargs = job.kwargs
+        try:
+            if job.subprocess:
+                self._run_subprocess(job)
+            else:
+                self._run_task(job.task, kwargs, job.token)
+        finally:
+            with self._exec_lock:
+                self._running[job.name] -= 1
+                self._active.remove(job)
+                ready = self._dispatch()
+            self._launch(ready)
+            job._finished.set()
         if kwargs.get("fromIRC"):
             kwargs.get("_IRCCallback")()
 
-    def start(self, task_name, **kwargs):
-        """Start a given task in a new daemon thread, and return the thread.
+    def _run_subprocess(self, job):
+        """Run a task in a child process, relaying its messages to us.
 
-        kwargs are passed to :py:meth:`task.run() <earwigbot.tasks.Task.run>`.
-        If the task is not found, ``None`` will be returned and an error will
-        be logged.
+        The process isn't a daemon, since daemonic processes can't start
+        processes of their own; :py:meth:`cancel` and stopping the bot
+        terminate it instead.
         """
-        msg = "Starting task '{0}' in a new thread"
-        self.logger.info(msg.format(task_name))
+        reader, writer = Pipe(duplex=False)
+        process = Process(target=self._subprocess_main, args=(job, writer),
+                          name="task:" + job.name)
+        # Fork while holding logging's lock, so the child can't inherit it
+        # locked by another thread that is in the middle of logging:
+        logging._acquireLock()
+        try:
+            process.start()
+        finally:
+            logging._releaseLock()
+        writer.close()
+        job.process = process
+        if job.token.cancelled:
+            self._terminate(job)
 
+        while process.is_alive() or reader.poll(0):
+            if not reader.poll(1):
+                continue
+            try:
+                message = reader.recv()
+            except EOFError:
+                break
+            self._handle_child_message(message)
+        process.join()
+        reader.close()
+
+        if process.exitcode < 0:
+            if job.token.cancelled:
+                msg = "Task '{0}' was cancelled"
+                self.logger.info(msg.format(job.name))
+            else:
+                msg = "Task '{0}' was killed by signal {1}"
+                self.logger.error(msg.format(job.name, -process.exitcode))
+        elif process.exitcode:
+            msg = "Task '{0}' exited with status {1}"
+            self.logger.error(msg.format(job.name, process.exitcode))
+
+    def _handle_child_message(self, message):
+        """Handle a log record or IRC message sent by a task's process."""
+        kind, data = message
+        if kind == "log":
+            record = logging.makeLogRecord(data)
+            logging.getLogger(record.name).handle(record)
+        elif kind == "irc":
+            name, msg, hidelog, priority = data
+            connection = getattr(self.bot, name)
+            if connection:
+                connection._send(msg, hidelog, priority)
+
+    def _subprocess_main(self, job, writer):
+        """Run a task in a newly forked child process.
+
+        The bot we forked from comes with us, including its (decrypted)
+        config. We forget the parent's loaded sites, so they are made again
+        with new connections, and replace locks another thread may have held
+        while forking (see :py:meth:`Bot._after_fork()
+        <earwigbot.bot.Bot._after_fork>`). All log records and IRC messages
+        are sent to the parent, since we have no reactor to send the latter.
+        The first SIGTERM cancels the task's token; a second one kills us.
+        """
+        logging._releaseLock()  # Held by our parent while forking
+        token = CancelToken()
+        if job.token.cancelled:
+            token.cancel()
+        def on_sigterm(signum, frame):
+            # Cancel from another thread, since callbacks may need locks held
+            # by the code we interrupted:
+            signal(SIGTERM, SIG_DFL)
+            Thread(target=token.cancel, name="task:cancel").start()
+
+        signal(SIGTERM, on_sigterm)
+        handler = _PipeHandler(writer)
+        logging.getLogger("earwigbot").handlers = []
+        logging.getLogger().handlers = [handler]
+        self.bot._after_fork()
+        for name in ("frontend", "watcher"):
+            connection = getattr(self.bot, name)
+            if connection:
+                connection._send = handler.relay(name, connection)
+        self._run_task(job.task, job.kwargs, token)
+        writer.close()
+
+    def _after_fork(self):
+        """Forget the parent process's jobs in a newly forked child."""
+        super(TaskManager, self)._after_fork()
+        self._queue = []
+        self._queued = {}
+        self._running = {}
+        self._active = set()
+        self._exec_lock = Lock()
+        self._shutoff_fetches = 0
+        self._shutoff_edits = {}
+        self._shutoff_lock = Lock()
+
+    @staticmethod
+    def _terminate(job):
+        """Ask a job's child process to stop, if it has started."""
+        if job.process and job.process.is_alive():
+            job.process.terminate()
+
+    def _stop_process(self, job):
+        """Terminate a job's child process and wait for it to exit.
+
+        If it hasn't exited :py:attr:`KILL_TIMEOUT` seconds after being
+        asked to stop, it is killed.
+        """
+        process = job.process
+        self._terminate(job)
+        process.join(self.KILL_TIMEOUT)
+        if process.is_alive():
+            msg = "Killing task '{0}', which didn't stop after {1} seconds"
+            self.logger.warn(msg.format(job.name, self.KILL_TIMEOUT))
+            try:
+                kill(process.pid, SIGKILL)
+            except OSError:
+                pass  # It exited in the meantime
+            process.join()
+
+    def _get_limits(self, task_name):
+        """Return the global and per-task concurrency limits for a task."""
+        total = self.bot.config.tasks.get("maxWorkers", self.MAX_WORKERS)
+        conf = self.bot.config.tasks.get(task_name) or {}
+        return total, conf.get("maxRunning", 0)
+
+    def _dispatch(self):
+        """Take jobs off the queue until our limits are reached.
+
+        Must be called with the executor lock held. The jobs are marked as
+        running and returned; they should be passed to :py:meth:`_launch`
+        once the lock is released.
+        """
+        ready, waiting = [], []
+        running = sum(self._running.itervalues())
+        while self._queue:
+            item = heappop(self._queue)
+            job = item[2]
+            total, per_task = self._get_limits(job.name)
+            if total and running >= total:
+                waiting.append(item)
+                break
+            if per_task and self._running.get(job.name, 0) >= per_task:
+                waiting.append(item)
+                continue
+            del self._queued[job.key]
+            self._active.add(job)
+            job.token = CancelToken(self.bot.cancel_token)
+            if job.subprocess:
+                job.token.add_callback(partial(self._terminate, job))
+            self._running[job.name] = self._running.get(job.name, 0) + 1
+            running += 1
+            job.started = time()
+            ready.append(job)
+        for item in waiting:
+            heappush(self._queue, item)
+        return ready
+
+    def _launch(self, jobs):
+        """Start threads for jobs that :py:meth:`_dispatch` took."""
+        for job in jobs:
+            where = "child process" if job.subprocess else "thread"
+            msg = "Starting task '{0}' in a new {1}"
+            self.logger.info(msg.format(job.name, where))
+            start_time = strftime("%b %d %H:%M:%S", localtime(job.started))
+            job.thread = Thread(target=self._wrapper, args=(job,))
+            job.thread.name = "{0} ({1})".format(job.name, start_time)
+            job.thread.daemon = True
+            job.thread.start()
+
+    def start(self, task_name, _priority=PRIORITY_NORMAL, **kwargs):
+        """Start a given task in a new daemon thread, and return its job.
+
+        kwargs are passed to :py:meth:`task.run() <earwigbot.tasks.Task.run>`.
+        If the task can't run yet because of our concurrency limits, it is
+        queued with the given priority (lower runs first; see
+        :py:attr:`PRIORITY_HIGH`, etc.), and the job's :py:attr:`thread` is
+        ``None`` until it starts. If the same task is already queued or
+        running with the same arguments (ignoring those starting with an
+        underscore), that job is returned instead. If the task is not found,
+        ``None`` will be returned and an error will be logged.
+
+        The returned job has an :py:meth:`is_alive` method, like a thread's,
+        which is ``True`` while the task is queued or running.
+        """
         try:
             task = self.get(task_name)
         except KeyError:
@@ -280,15 +1020,105 @@ class TaskManager(_ResourceManager):
             self.logger.error(e.format(task_name))
             return
 
-        task_thread = Thread(target=self._wrapper, args=(task,), kwargs=kwargs)
-        start_time = strftime("%b %d %H:%M:%S")
-        task_thread.name = "{0} ({1})".format(task_name, start_time)
-        task_thread.daemon = True
-        task_thread.start()
-        return task_thread
+        job = _TaskJob(task, kwargs, _priority)
+        if (self.bot.config.tasks.get(task_name) or {}).get("subprocess"):
+            if os_name == "posix":
+                job.subprocess = True
+            else:
+                msg = "Can't run task '{0}' in a child process on this system"
+                self.logger.warn(msg.format(task_name))
+        with self._exec_lock:
+            if job.key in self._queued:
+                msg = "Task '{0}' is already queued with these arguments"
+                self.logger.info(msg.format(task_name))
+                return self._queued[job.key]
+            for other in self._active:
+                if other.key == job.key and not other.cancelled:
+                    msg = "Task '{0}' is already running with these arguments"
+                    self.logger.info(msg.format(task_name))
+                    return other
+            self._queued[job.key] = job
+            heappush(self._queue, (_priority, next(self._counter), job))
+            ready = self._dispatch()
+        self._launch(ready)
+        if not job.thread:
+            msg = "Task '{0}' queued until it can run"
+            self.logger.info(msg.format(task_name))
+        return job
+
+    def get_running(self, task_name):
+        """Return how many copies of the given task are currently running."""
+        with self._exec_lock:
+            return self._running.get(task_name, 0)
+
+    def get_queued(self):
+        """Return a list of queued task jobs, in the order they will run."""
+        with self._exec_lock:
+            return [item[2] for item in sorted(self._queue)]
+
+    def get_jobs(self):
+        """Return a list of running task jobs, followed by queued ones."""
+        with self._exec_lock:
+            queued = [item[2] for item in sorted(self._queue)]
+            return sorted(self._active, key=lambda job: job.started) + queued
+
+    def cancel(self, job):
+        """Cancel a task job, if it is queued or running.
+
+        Queued jobs are taken off the queue. Running jobs have their
+        cancellation token cancelled, which asks them to stop; we don't wait
+        for threads to do so, but a child process is terminated and waited
+        for (and killed if it takes longer than :py:attr:`KILL_TIMEOUT`
+        seconds). Returns ``True`` if the job was queued or running.
+        """
+        with self._exec_lock:
+            if self._queued.get(job.key) is job:
+                del self._queued[job.key]
+                self._queue = [item for item in self._queue
+                               if item[2] is not job]
+                heapify(self._queue)
+                job.cancelled = True
+                job._finished.set()
+                return True
+            if job not in self._active:
+                return False
+            job.cancelled = True
+        job.token.cancel()
+        if job.process:
+            self._stop_process(job)
+        return True
+
+    def wait(self, timeout=None):
+        """Wait for running task jobs to finish, for up to *timeout* seconds.
+
+        This includes jobs that have been taken off the queue but whose
+        threads are still starting up. Returns a list of the jobs that are
+        still running. The calling thread's own job, if any, is not waited
+        for.
+        """
+        deadline = None if timeout is None else time() + timeout
+        me = current_thread()
+        with self._exec_lock:
+            jobs = sorted(self._active, key=lambda job: job.started)
+        left = []
+        for job in jobs:
+            if job.thread is me:
+                continue
+            if deadline is None:
+                job.join()
+            else:
+                job.join(max(deadline - time(), 0))
+            if job.is_alive():
+                left.append(job)
+        return left
 
     def schedule(self, now=None):
-        """Start all tasks that are supposed to be run at a given time."""
+        """Start all tasks that are supposed to be run at a given time.
+
+        The wiki scheduler (:py:attr:`bot.scheduler
+        <earwigbot.bot.Bot.scheduler>`) starts tasks on its own; this is for
+        running the schedule for a particular minute by hand.
+        """
         if not now:
             now = gmtime()
         # Get list of tasks to run this turn:
@@ -300,3 +1130,162 @@ class TaskManager(_ResourceManager):
                 self.start(task[0], **task[1])  # so pass those to start
             else:  # Otherwise, just pass task_name
                 self.start(task)
+
+    def get_shutoff_state(self, task, site):
+        """Return whether on-wiki shutoff is enabled for a task on a site.
+
+        This is shared by all tasks: the shutoff page for a given site and
+        task number is only checked (through
+        :py:meth:`task.load_shutoff_state()
+        <earwigbot.tasks.Task.load_shutoff_state>`) if we haven't done so in
+        the last :py:attr:`config.wiki["shutoff"]["interval"]` seconds, or if
+        :py:meth:`process_rc` has seen an edit to it since then. Use
+        :py:meth:`task.shutoff_enabled()
+        <earwigbot.tasks.Task.shutoff_enabled>` within tasks.
+
+        If the page is edited while we are loading it, the result is returned
+        but not remembered, since it may predate the edit.
+        """
+        interval = self.bot.config.wiki["shutoff"].get("interval", 60)
+        key = (site.name, task.number)
+        with self._shutoff_lock:
+            state = self._shutoff_states.get(key)
+            if state and time() - state["checked"] < interval:
+                return state["enabled"]
+            self._shutoff_fetches += 1
+        started = time()
+
+        try:
+            title, enabled = task.load_shutoff_state(site)
+        finally:
+            with self._shutoff_lock:
+                self._shutoff_fetches -= 1
+                edits = self._shutoff_edits
+                if not self._shutoff_fetches:
+                    self._shutoff_edits = {}
+
+        edited = edits.get((site.domain, title))
+        if edited is None or edited < started:
+            with self._shutoff_lock:
+                self._shutoff_states[key] = {
+                    "domain": site.domain, "title": title,
+                    "enabled": enabled, "checked": started
+                }
+        return enabled
+
+    def process_rc(self, rc):
+        """Forget the shutoff state of any task whose shutoff page was edited.
+
+        This is called by the IRC watcher for every :py:class:`~.RC` event it
+        receives, so that tasks notice shutoff immediately. While shutoff pages
+        are being loaded, every edit is also noted, so a result loaded before
+        an edit to its page isn't remembered.
+        """
+        if not self._shutoff_states and not self._shutoff_fetches:
+            return
+        domain = urlparse(rc.url).netloc
+        with self._shutoff_lock:
+            if self._shutoff_fetches:
+                self._shutoff_edits[(domain, rc.page)] = time()
+            for key, state in self._shutoff_states.items():
+                if state["title"] == rc.page and state["domain"] == domain:
+                    del self._shutoff_states[key]
+
+
+class _TaskJob(object):
+    """A request to run a task, as returned by :py:meth:`TaskManager.start`.
+
+    :py:attr:`started` is the time the task started running, and
+    :py:attr:`thread` the thread running it; both are ``None`` while it is
+    queued. Use :py:meth:`join` to wait for the task to finish.
+    If the task runs in a child process, :py:attr:`process` is the
+    :py:class:`multiprocessing.Process` (and :py:attr:`thread` waits for it).
+    :py:attr:`token` is the :py:class:`~earwigbot.cancellation.CancelToken`
+    given to the task once it starts.
+    """
+
+    def __init__(self, task, kwargs, priority):
+        self.task = task
+        self.kwargs = kwargs
+        self.priority = priority
+        self.queued = time()
+        self.started = None
+        self.thread = None
+        self.subprocess = False
+        self.process = None
+        self.token = None
+        self.cancelled = False
+        self._finished = Event()
+
+        args = sorted((key, val) for key, val in kwargs.iteritems()
+                      if not key.startswith("_"))
+        self.key = (task.name, repr(args))
+
+    def __repr__(self):
+        """Return the canonical string representation of the _TaskJob."""
+        res = "_TaskJob(task={0!r}, kwargs={1!r}, priority={2!r})"
+        return res.format(self.task, self.kwargs, self.priority)
+
+    def __str__(self):
+        """Return a nice string representation of the _TaskJob."""
+        state = "running" if self.started else "queued"
+        return "<_TaskJob for {0} ({1})>".format(self.name, state)
+
+    @property
+    def name(self):
+        """The name of the task being run."""
+        return self.task.name
+
+    def is_alive(self):
+        """Return whether the task is still queued or running."""
+        return not self._finished.is_set()
+
+    def join(self, timeout=None):
+        """Wait until the task finishes (or is cancelled while queued).
+
+        If *timeout* is given, wait for at most that many seconds; use
+        :py:meth:`is_alive` to see whether the task finished.
+        """
+        self._finished.wait(timeout)
+
+
+class _PipeHandler(logging.Handler):
+    """Sends log records and IRC messages from a task's process to its parent.
+    """
+
+    def __init__(self, conn):
+        logging.Handler.__init__(self)
+        self._conn = conn
+        self._formatter = logging.Formatter()
+
+    def send(self, kind, data):
+        """Send a message to the parent; this is thread-safe."""
+        self.acquire()
+        try:
+            self._conn.send((kind, data))
+        finally:
+            self.release()
+
+    def relay(self, name, connection):
+        """Return a replacement for an IRC connection's ``_send()`` method.
+
+        Messages are sent to the parent, which sends them through its own
+        connection with the same *name* (``"frontend"`` or ``"watcher"``).
+        """
+        def _send(msg, hidelog=False, priority=connection.PRIORITY_REPLY):
+            self.send("irc", (name, msg, hidelog, priority))
+        return _send
+
+    def emit(self, record):
+        """Send a picklable copy of a record through our connection."""
+        try:
+            data = dict(record.__dict__)
+            data["msg"] = record.getMessage()
+            data["args"] = None
+            if record.exc_info:
+                exc_text = self._formatter.formatException(record.exc_info)
+                data["exc_text"] = exc_text
+                data["exc_info"] = None
+            self.send("log", data)
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,385 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Runs bot tasks at the times given in the ``schedule`` section of
+:file:`config.yml`.
+
+Each entry in the schedule has a list of ``tasks`` (task names, or
+``[name, kwargs]`` pairs) and some time quantifiers, all in UTC: ``minute``
+(0-59), ``hour`` (0-23), ``month_day`` (1-31), ``month`` (1-12), and
+``week_day`` (0-6, where 0 is Monday). A quantifier that is left out matches
+anything. Each can be a number, a list of numbers, or a cron-style string
+like ``"*/15"``, ``"1-5"``, ``"9-17/2"``, or ``"0,30"``. Alternatively, an
+entry can give a standard five-field ``cron`` expression (``"30 5 * * 1"``),
+where the week day counts from Sunday as 0 (or 7) and, as in cron, an entry
+restricting both the day of the month and the day of the week runs when
+either matches.
+
+An entry can also have a ``catchup`` policy for runs that were missed, e.g.
+because the bot was overloaded or the machine was suspended: ``"skip"`` drops
+them, ``"once"`` (the default) runs the task once for any number of missed
+runs, and ``"all"`` runs it once per missed run (up to
+:py:attr:`Scheduler.MAX_CATCHUP` times).
+"""
+
+from calendar import timegm
+from datetime import datetime, timedelta
+from heapq import heapify, heappop, heappush
+from itertools import count
+from threading import Lock
+from time import time
+
+__all__ = ["ScheduleEntry", "Scheduler"]
+
+class ScheduleEntry(object):
+    """
+    **EarwigBot: Schedule Entry**
+
+    A compiled entry from the ``schedule`` section of :file:`config.yml`. Each
+    time quantifier is turned into a set of allowed values (or ``None`` for
+    "any") once, so finding the next time the entry is due is cheap.
+
+    Raises :py:exc:`ValueError` if the entry is invalid.
+    """
+    FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("month_day", 1, 31),
+              ("month", 1, 12), ("week_day", 0, 6)]
+    POLICIES = ("skip", "once", "all")
+
+    # A schedule that can't be satisfied (like February 31) is given up on
+    # after searching this far ahead:
+    MAX_SEARCH = timedelta(days=366 * 8)
+
+    def __init__(self, event):
+        self._tasks = event.get("tasks") or []
+        self._catchup = event.get("catchup", "once")
+        if self._catchup not in self.POLICIES:
+            err = "Unknown catchup policy: {0!r}".format(self._catchup)
+            raise ValueError(err)
+
+        self._either_day = False
+        if "cron" in event:
+            self._parse_cron(event["cron"])
+        else:
+            for name, low, high in self.FIELDS:
+                value = self._parse_field(event.get(name), low, high)
+                setattr(self, "_" + name, value)
+
+    def __repr__(self):
+        """Return the canonical string representation of the ScheduleEntry."""
+        res = "ScheduleEntry(tasks={0!r}, catchup={1!r})"
+        return res.format(self._tasks, self._catchup)
+
+    def __str__(self):
+        """Return a nice string representation of the ScheduleEntry."""
+        return "<ScheduleEntry for {0} tasks>".format(len(self._tasks))
+
+    @staticmethod
+    def _parse_field(value, low, high):
+        """Return the set of values a time quantifier allows, or ``None``."""
+        if value is None:
+            return None
+        if isinstance(value, (int, long)):
+            parts = [value]
+        elif isinstance(value, basestring):
+            parts = value.split(",")
+        else:
+            parts = list(value)
+
+        allowed = set()
+        for part in parts:
+            if isinstance(part, (int, long)):
+                start = stop = part
+                step = 1
+            else:
+                part = str(part).strip()
+                rng, _, step = part.partition("/")
+                step = int(step) if step else 1
+                if rng == "*":
+                    start, stop = low, high
+                elif "-" in rng:
+                    start, stop = [int(num) for num in rng.split("-", 1)]
+                else:
+                    start = int(rng)
+                    stop = high if step > 1 else start
+            if start < low or stop > high or start > stop or step < 1:
+                err = "Bad value {0!r} for range {1}-{2}"
+                raise ValueError(err.format(part, low, high))
+            allowed.update(range(start, stop + 1, step))
+        if allowed == set(range(low, high + 1)):
+            return None
+        return frozenset(allowed)
+
+    def _parse_cron(self, expr):
+        """Set our quantifiers from a standard five-field cron expression."""
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError("Bad cron expression: {0!r}".format(expr))
+        minute, hour, mday, month, wday = fields
+        self._minute = self._parse_field(minute, 0, 59)
+        self._hour = self._parse_field(hour, 0, 23)
+        self._month_day = self._parse_field(mday, 1, 31)
+        self._month = self._parse_field(month, 1, 12)
+        days = self._parse_field(wday, 0, 7)
+        if days is not None:
+            # Cron counts from Sunday (0 or 7), but we use Monday as 0:
+            days = frozenset((day - 1) % 7 for day in days)
+            if len(days) == 7:
+                days = None
+        self._week_day = days
+        self._either_day = (self._month_day is not None and
+                            self._week_day is not None)
+
+    def _day_matches(self, month_day, week_day):
+        """Return whether the given day of the month and week is allowed."""
+        mday_ok = self._month_day is None or month_day in self._month_day
+        wday_ok = self._week_day is None or week_day in self._week_day
+        if self._either_day:
+            return mday_ok or wday_ok
+        return mday_ok and wday_ok
+
+    @property
+    def tasks(self):
+        """The tasks to start, as task names or ``[name, kwargs]`` pairs."""
+        return self._tasks
+
+    @property
+    def catchup(self):
+        """The policy for missed runs: ``"skip"``, ``"once"``, or ``"all"``."""
+        return self._catchup
+
+    def matches(self, now):
+        """Return whether the entry is due at the given :py:func:`gmtime`."""
+        return ((self._minute is None or now.tm_min in self._minute) and
+                (self._hour is None or now.tm_hour in self._hour) and
+                (self._month is None or now.tm_mon in self._month) and
+                self._day_matches(now.tm_mday, now.tm_wday))
+
+    def next_after(self, when):
+        """Return the first timestamp after *when* that the entry is due.
+
+        Returns ``None`` if the entry will never be due.
+        """
+        stamp = datetime.utcfromtimestamp(int(when) // 60 * 60)
+        stamp += timedelta(minutes=1)
+        limit = stamp + self.MAX_SEARCH
+        while stamp < limit:
+            if self._month is not None and stamp.month not in self._month:
+                stamp = stamp.replace(day=1, hour=0, minute=0)
+                stamp = (stamp + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(stamp.day, stamp.weekday()):
+                stamp = stamp.replace(hour=0, minute=0)
+                stamp += timedelta(days=1)
+            elif self._hour is not None and stamp.hour not in self._hour:
+                stamp = stamp.replace(minute=0) + timedelta(hours=1)
+            elif self._minute is not None and stamp.minute not in self._minute:
+                stamp += timedelta(minutes=1)
+            else:
+                return timegm(stamp.utctimetuple())
+        return None
+
+
+class Scheduler(object):
+    """
+    **EarwigBot: Wiki Scheduler**
+
+    Starts bot tasks according to the ``schedule`` section of
+    :file:`config.yml` (see :py:class:`ScheduleEntry` for its format).
+
+    Entries are compiled when the scheduler is started, and the next time each
+    one is due is kept in a heap. Rather than waking up every minute, we
+    schedule a single :py:meth:`reactor.call_later()
+    <earwigbot.irc.reactor.Reactor.call_later>` timer for the earliest entry;
+    when it fires, all due entries are pushed back with their following run
+    time, and their tasks are started from a command worker thread (see
+    :py:meth:`commands.run_in_worker()
+    <earwigbot.managers.CommandManager.run_in_worker>`) rather than the
+    reactor's, since starting a task may load its module.
+
+    If the timer fires more than :py:attr:`GRACE` seconds late, the runs in
+    between are considered missed, and each entry's ``catchup`` policy decides
+    what to do about them. A task isn't started by the scheduler while
+    :py:attr:`config.tasks[name]["maxRunning"]` copies of it (if set) are
+    still running, or while it is running with the same arguments.
+    """
+    GRACE = 60
+    MAX_CATCHUP = 10
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.logger = bot.logger.getChild("scheduler")
+        self._entries = []
+        self._heap = []  # (next run, entry index)
+        self._armed = None  # Time our reactor timer is set for
+        self._generation = count()
+        self._current = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        """Return the canonical string representation of the Scheduler."""
+        return "Scheduler(bot={0!r})".format(self.bot)
+
+    def __str__(self):
+        """Return a nice string representation of the Scheduler."""
+        return "<Scheduler of {0} entries>".format(len(self._entries))
+
+    def _after_fork(self):
+        """Stop scheduling in a newly forked child process.
+
+        The child has no running reactor, and its tasks shouldn't start more.
+        """
+        self._heap = []
+        self._armed = None
+        self._current = None
+        self._lock = Lock()
+
+    def _compile(self):
+        """Compile the schedule entries in our config file."""
+        entries = []
+        for i, event in enumerate(self.bot.config.data.get("schedule", [])):
+            try:
+                entries.append(ScheduleEntry(event))
+            except (ValueError, TypeError, AttributeError) as exc:
+                err = "Ignoring invalid schedule entry #{0}: {1}"
+                self.logger.error(err.format(i + 1, exc))
+        return entries
+
+    def _arm(self):
+        """Make sure our reactor timer is set for the earliest entry.
+
+        Must be called with our lock held.
+        """
+        if not self._heap or self._current is None:
+            return
+        when = self._heap[0][0]
+        if self._armed is not None and self._armed <= when:
+            return
+        self._armed = when
+        self.bot.reactor.call_later(max(when - time(), 0), self._fire,
+                                    self._current, when)
+
+    def _fire(self, generation, when):
+        """Hand the entries that are due off to be started, and rearm."""
+        with self._lock:
+            if generation != self._current or when != self._armed:
+                return  # Superseded by a reload or an earlier timer
+            self._armed = None
+            now = time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                first, index = heappop(self._heap)
+                entry = self._entries[index]
+                due.append((entry, first))
+                upcoming = entry.next_after(now)
+                if upcoming is not None:
+                    heappush(self._heap, (upcoming, index))
+            self._arm()
+        if due:
+            self.bot.commands.run_in_worker("scheduler", self._start_due, due,
+                                            now)
+
+    def _start_due(self, due, now):
+        """Start the tasks of entries that were due at the given times."""
+        for entry, first in due:
+            for _ in xrange(self._get_runs(entry, first, now)):
+                for task in entry.tasks:
+                    self._start(task)
+
+    def _get_runs(self, entry, first, now):
+        """Return how many times to run an entry that was due at *first*."""
+        runs, last = 1, first
+        while runs <= self.MAX_CATCHUP:
+            upcoming = entry.next_after(last)
+            if upcoming is None or upcoming > now:
+                break
+            runs, last = runs + 1, upcoming
+
+        on_time = now - last <= self.GRACE
+        missed = runs - 1 if on_time else runs
+        if missed:
+            msg = "Missed {0} run(s) of {1} ({2} policy)"
+            self.logger.warn(msg.format(missed, entry, entry.catchup))
+        if entry.catchup == "all":
+            return min(runs, self.MAX_CATCHUP)
+        if entry.catchup == "once":
+            return 1
+        return 1 if on_time else 0
+
+    def _start(self, task):
+        """Start a scheduled task, unless too many copies are running."""
+        if isinstance(task, list):  # They've specified kwargs
+            name, kwargs = task[0], task[1]
+        else:
+            name, kwargs = task, {}
+        limit = self.bot.config.tasks.get(name, {}).get("maxRunning", 0)
+        running = self.bot.tasks.get_running(name)
+        if limit and running >= limit:
+            msg = "Not starting task '{0}': {1} already running"
+            self.logger.warn(msg.format(name, running))
+            return
+        self.bot.tasks.start(name, **kwargs)
+
+    def start(self):
+        """Start, or restart, the scheduler with the current schedule.
+
+        This can be called again after the config file is reloaded to pick up
+        changes. Entries are next run at their next due time after now.
+        """
+        entries = self._compile()
+        now = time()
+        heap = []
+        for index, entry in enumerate(entries):
+            upcoming = entry.next_after(now)
+            if upcoming is not None:
+                heap.append((upcoming, index))
+        heapify(heap)
+
+        with self._lock:
+            self._entries = entries
+            self._heap = heap
+            self._armed = None
+            self._current = next(self._generation)
+            self._arm()
+        msg = "Loaded {0} schedule entries"
+        self.logger.debug(msg.format(len(entries)))
+
+    def stop(self):
+        """Stop the scheduler; no more tasks will be started by it."""
+        with self._lock:
+            self._current = None
+            self._armed = None
+            self._heap = []
+
+    @property
+    def is_running(self):
+        """Whether or not the scheduler is currently running."""
+        return self._current is not None
+
+    @property
+    def entries(self):
+        """A list of the compiled :py:class:`ScheduleEntry`\ s."""
+        return list(self._entries)
+
+    def next_run(self):
+        """Return the timestamp of the next scheduled run, or ``None``."""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
@@ -20,10 +20,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from earwigbot import exceptions
+from hashlib import sha1
+from json import dumps, loads
+from os import fsync, mkdir, path, remove
+import stat
+from threading import Lock
+from time import time
+
+from earwigbot import cancellation, exceptions
 from earwigbot import wiki
 
-__all__ = ["Task"]
+__all__ = ["Task", "Checkpoint"]
 
 class Task(object):
     """
@@ -85,6 +92,14 @@ class Task(object):
         task do stuff. *kwargs* will be any keyword arguments passed to
         :py:meth:`~earwigbot.managers.TaskManager.start`, which are entirely
         optional.
+
+        *kwargs* also includes ``_cancel``, a
+        :py:class:`~earwigbot.cancellation.CancelToken` that is cancelled when
+        the task should stop (because it was cancelled from IRC, or the bot is
+        stopping or restarting). Long loops should call its
+        :py:meth:`~earwigbot.cancellation.CancelToken.check` method, which
+        raises :py:exc:`~earwigbot.exceptions.CancelledError`; API queries
+        made from the task's thread check it automatically.
         """
         pass
 
@@ -110,6 +125,32 @@ class Task(object):
             return comment
         return summary.replace("$1", str(self.number)).replace("$2", comment)
 
+    def get_checkpoint(self, kwargs):
+        """Return a :py:class:`Checkpoint` for a run of this task.
+
+        The checkpoint is stored in the bot's :file:`checkpoints/` directory
+        under a name based on the task and *kwargs*, so a run that is
+        interrupted (by a crash, a restart, or shutoff) can be resumed by
+        running the task again with the same arguments (ignoring those
+        starting with an underscore, like ``_IRCCallback``). Call
+        :py:meth:`Checkpoint.close` when done. If the run is cancelled, the
+        checkpoint is flushed right away, and every change after that is
+        written immediately.
+        """
+        root = path.join(self.config.root_dir, "checkpoints")
+        if not path.exists(root):
+            mkdir(root, stat.S_IWUSR|stat.S_IRUSR|stat.S_IXUSR)
+        kwargs = {key: val for key, val in kwargs.iteritems()
+                  if not key.startswith("_")}
+        key = sha1(dumps(kwargs, sort_keys=True, default=repr))
+        key = key.hexdigest()[:16]
+        filename = "{0}-{1}.log".format(self.name, key)
+        checkpoint = Checkpoint(path.join(root, filename), self.logger)
+        token = cancellation.get_token()
+        if token:
+            token.add_callback(checkpoint.flush)
+        return checkpoint
+
     def shutoff_enabled(self, site=None):
         """Return whether on-wiki shutoff is enabled for this task.
 
@@ -127,6 +168,12 @@ class Task(object):
 
         If a site is not provided, we'll try to use :py:attr:`self.site <site>`
         if it's set. Otherwise, we'll use our default site.
+
+        The result is remembered by :py:meth:`tasks.get_shutoff_state()
+        <earwigbot.managers.TaskManager.get_shutoff_state>`, which only checks
+        the page again after :py:attr:`config.wiki["shutoff"]["interval"]
+        <earwigbot.config.BotConfig.wiki>` seconds (60 by default) or as soon
+        as the IRC watcher sees an edit to it, so this is cheap to call often.
         """
         if not site:
             if hasattr(self, "site"):
@@ -134,10 +181,21 @@ class Task(object):
             else:
                 site = self.bot.wiki.get_site()
 
-        try:
-            cfg = self.config.wiki["shutoff"]
-        except KeyError:
+        if "shutoff" not in self.config.wiki:
+            return False
+        if not self.bot.tasks.get_shutoff_state(self, site):
             return False
+
+        self.logger.warn("Emergency task shutoff has been enabled!")
+        return True
+
+    def load_shutoff_state(self, site):
+        """Check this task's shutoff page on the given *site*.
+
+        Return a tuple of the page's title and whether shutoff is enabled.
+        This always checks the page; use :py:meth:`shutoff_enabled` instead.
+        """
+        cfg = self.config.wiki["shutoff"]
         title = cfg.get("page", "User:$1/Shutoff/Task $2")
         username = site.get_user().name
         title = title.replace("$1", username).replace("$2", str(self.number))
@@ -146,9 +204,147 @@ class Task(object):
         try:
             content = page.get()
         except exceptions.PageNotFoundError:
-            return False
-        if content == cfg.get("disabled", "run"):
-            return False
+            return page.title, False
+        return page.title, content != cfg.get("disabled", "run")
 
-        self.logger.warn("Emergency task shutoff has been enabled!")
-        return True
+
+class Checkpoint(object):
+    """
+    **EarwigBot: Task Checkpoint**
+
+    Remembers the progress of a long-running task on disk. This is an
+    append-only log of processed keys (sorted into named groups, like
+    ``"pages"``) and continuation tokens (any JSON value, like an offset into
+    a list of pages), which is read back when a checkpoint with the same path
+    is opened again.
+
+    Use :py:meth:`task.get_checkpoint() <Task.get_checkpoint>` to make one.
+    Changes are buffered and written to disk every :py:attr:`FLUSH_SIZE`
+    changes or :py:attr:`FLUSH_INTERVAL` seconds, whichever is first, and when
+    the checkpoint is closed. It is safe to use from multiple threads.
+    """
+    FLUSH_SIZE = 100
+    FLUSH_INTERVAL = 30
+
+    def __init__(self, filename, logger=None):
+        self._filename = filename
+        self._logger = logger
+        self._done = {}
+        self._tokens = {}
+        self._buffer = []
+        self._last_flush = time()
+        self._lock = Lock()
+        self._load()
+
+    def __repr__(self):
+        """Return the canonical string representation of the Checkpoint."""
+        return "Checkpoint({0!r})".format(self._filename)
+
+    def __str__(self):
+        """Return a nice string representation of the Checkpoint."""
+        return "<Checkpoint at {0}>".format(self._filename)
+
+    def _load(self):
+        """Load the checkpoint's previous state from disk, if any.
+
+        A partial last line, left by a crash in the middle of a write, is
+        truncated, so the records we append later start on a line of their
+        own.
+        """
+        if not path.exists(self._filename):
+            return
+        with open(self._filename, "r+b") as fp:
+            data = fp.read()
+            end = data.rfind("\n") + 1
+            if end < len(data):
+                fp.truncate(end)
+                if self._logger:
+                    log = "Discarded a partial record in checkpoint {0}"
+                    self._logger.warn(log.format(self._filename))
+        for line in data[:end].splitlines():
+            try:
+                kind, name, value = loads(line)
+            except ValueError:  # Corrupted somehow; skip it
+                continue
+            if kind == "done":
+                self._done.setdefault(name, set()).add(value)
+            elif kind == "token":
+                self._tokens[name] = value
+        if self._logger:
+            count = sum(len(keys) for keys in self._done.itervalues())
+            log = "Resuming from checkpoint {0} ({1} keys done)"
+            self._logger.info(log.format(self._filename, count))
+
+    def _append(self, record):
+        """Add a record to the write buffer, flushing it if needed."""
+        self._buffer.append(dumps(record))
+        token = cancellation.get_token()
+        if (len(self._buffer) >= self.FLUSH_SIZE or
+                time() - self._last_flush >= self.FLUSH_INTERVAL or
+                (token and token.cancelled)):
+            self._flush()
+
+    def _flush(self):
+        """Write buffered records to disk. The lock must be held."""
+        self._last_flush = time()
+        if not self._buffer:
+            return
+        with open(self._filename, "a") as fp:
+            fp.write("\n".join(self._buffer) + "\n")
+            fp.flush()
+            fsync(fp.fileno())
+        self._buffer = []
+
+    @property
+    def filename(self):
+        """The path to the checkpoint's log on disk."""
+        return self._filename
+
+    def is_done(self, group, key):
+        """Return whether *key* in the given *group* was marked done."""
+        with self._lock:
+            return key in self._done.get(group, ())
+
+    def get_done(self, group):
+        """Return a set of all keys in the given *group* marked done."""
+        with self._lock:
+            return set(self._done.get(group, ()))
+
+    def mark_done(self, group, key):
+        """Mark *key* in the given *group* as done."""
+        with self._lock:
+            keys = self._done.setdefault(group, set())
+            if key not in keys:
+                keys.add(key)
+                self._append(["done", group, key])
+
+    def get_token(self, name, default=None):
+        """Return the continuation token called *name*, or *default*."""
+        with self._lock:
+            return self._tokens.get(name, default)
+
+    def set_token(self, name, value):
+        """Set the continuation token called *name* to *value*."""
+        with self._lock:
+            if self._tokens.get(name) != value:
+                self._tokens[name] = value
+                self._append(["token", name, value])
+
+    def flush(self):
+        """Write any buffered changes to disk immediately."""
+        with self._lock:
+            self._flush()
+
+    def close(self, complete=False):
+        """Flush the checkpoint, or delete it if the run is *complete*.
+
+        A completed run's checkpoint is removed so the next run with the same
+        arguments starts from scratch.
+        """
+        with self._lock:
+            if complete:
+                self._buffer = []
+                if path.exists(self._filename):
+                    remove(self._filename)
+            else:
+                self._flush()
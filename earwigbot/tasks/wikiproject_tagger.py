@@ -20,9 +20,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from functools import partial
+import logging
+from multiprocessing import Pool, cpu_count
+from Queue import Queue
 import re
+from threading import Event, Thread
+from time import time
 
-from earwigbot import exceptions
+import mwparserfromhell
+
+from earwigbot import cancellation, exceptions
 from earwigbot.tasks import Task
 from earwigbot.wiki import constants
 
@@ -32,7 +40,8 @@ class WikiProjectTagger(Task):
     Usage: :command:`earwigbot -t wikiproject_tagger PATH
     --banner BANNER (--category CAT | --file FILE) [--summary SUM] [--update]
     [--append PARAMS] [--autoassess [CLASSES]] [--only-with BANNER]
-    [--nocreate] [--recursive [NUM]] [--site SITE] [--dry-run]`
+    [--nocreate] [--recursive [NUM]] [--site SITE] [--workers [NUM]]
+    [--edit-delay SECS] [--dry-run]`
 
     .. glossary::
 
@@ -71,10 +80,19 @@ class WikiProjectTagger(Task):
         also tag category pages
     ``--site SITE``
         the ID of the site to tag pages on, defaulting to the default site
+    ``--workers [NUM]``
+        tag pages in a pipeline: talk pages are loaded in batches by one
+        thread, parsed and tagged by ``NUM`` worker processes (or one per CPU
+        if ``NUM`` isn't provided), and saved in order by another thread
+    ``--edit-delay SECS``
+        when using ``--workers``, wait at least ``SECS`` seconds between edits
     ``--dry-run``
         don't actually make any edits, just log the pages that would have been
         edited
 
+    Progress is saved in a :py:class:`~earwigbot.tasks.Checkpoint`, so if the
+    task is interrupted, running it again with the same arguments will skip
+    the pages and categories that were already done.
     """
     name = "wikiproject_tagger"
 
@@ -134,6 +152,10 @@ class WikiProjectTagger(Task):
         recursive = kwargs.get("recursive", 0)
         tag_categories = kwargs.get("tag-categories", False)
         dry_run = kwargs.get("dry-run", False)
+        workers = kwargs.get("workers", 0)
+        edit_delay = float(kwargs.get("edit-delay", 0))
+        if workers is True:
+            workers = cpu_count()
         banner, names = self.get_names(site, banner)
         if not names:
             return
@@ -147,12 +169,25 @@ class WikiProjectTagger(Task):
         job = _Job(banner=banner, names=names, summary=summary, update=update,
                    append=append, autoassess=autoassess, only_with=only_with,
                    nocreate=nocreate, tag_categories=tag_categories,
-                   dry_run=dry_run)
+                   dry_run=dry_run, workers=int(workers),
+                   edit_delay=edit_delay,
+                   checkpoint=self.get_checkpoint(kwargs))
 
+        complete = False
         try:
-            self.run_job(kwargs, site, job, recursive)
+            if job.workers:
+                job.pipeline = _Pipeline(self, site, job)
+                try:
+                    self.run_job(kwargs, site, job, recursive)
+                finally:
+                    job.pipeline.finish()
+            else:
+                self.run_job(kwargs, site, job, recursive)
+            complete = True
         except _ShutoffEnabled:
             return
+        finally:
+            job.checkpoint.close(complete)
 
     def run_job(self, kwargs, site, job, recursive):
         """Run a tagging *job* on a given *site*."""
@@ -162,8 +197,12 @@ class WikiProjectTagger(Task):
             self.process_category(site.get_page(title), job, recursive)
 
         if "file" in kwargs:
+            start = job.checkpoint.get_token("file", 0)
+            pages = []
             with open(kwargs["file"], "r") as fileobj:
-                for line in fileobj:
+                for lineno, line in enumerate(fileobj):
+                    if lineno < start:
+                        continue
                     if line.strip():
                         line = line.decode("utf8")
                         if line.startswith("[[") and line.endswith("]]"):
@@ -172,7 +211,24 @@ class WikiProjectTagger(Task):
                         if page.namespace == constants.NS_CATEGORY:
                             self.process_category(page, job, recursive)
                         else:
-                            self.process_page(page, job)
+                            pages.append(page)
+                    if len(pages) >= site.PAGE_BATCH_SIZE:
+                        self.process_pages(site, pages, job)
+                        self.when_saved(job, partial(job.checkpoint.set_token,
+                                                     "file", lineno + 1))
+                        pages = []
+            self.process_pages(site, pages, job)
+
+    def when_saved(self, job, callback):
+        """Call *callback* once all pages given to the job so far are done.
+
+        This is used to update the job's checkpoint. Without a pipeline, that
+        has already happened, so the callback is called immediately.
+        """
+        if job.pipeline:
+            job.pipeline.submit([], callback)
+        else:
+            callback()
 
     def guess_namespace(self, site, title, assumed):
         """If the given *title* does not have an explicit namespace, guess it.
@@ -221,8 +277,8 @@ class WikiProjectTagger(Task):
         self.logger.info(u"Processing category: [[%s]]", page.title)
         job.processed_cats.add(page.title)
 
-        if job.tag_categories:
-            self.process_page(page, job)
+        site = page.site
+        pages = [page] if job.tag_categories else []
         for member in page.get_members():
             nspace = member.namespace
             if nspace == constants.NS_CATEGORY:
@@ -231,11 +287,41 @@ class WikiProjectTagger(Task):
                 elif recursive > 0:
                     self.process_category(member, job, recursive - 1)
                 elif job.tag_categories:
-                    self.process_page(member, job)
+                    pages.append(member)
             elif nspace in (constants.NS_USER, constants.NS_USER_TALK):
                 continue
             else:
-                self.process_page(member, job)
+                pages.append(member)
+            if len(pages) >= site.PAGE_BATCH_SIZE:
+                self.process_pages(site, pages, job)
+                pages = []
+        self.process_pages(site, pages, job)
+        self.when_saved(job, partial(job.checkpoint.mark_done, "categories",
+                                     page.title))
+
+    def process_pages(self, site, pages, job):
+        """Try to tag a list of *pages*, loading their talk pages in bulk.
+
+        The talk pages are loaded with :py:meth:`site.get_pages()
+        <earwigbot.wiki.site.Site.get_pages>`, so tagging them doesn't need
+        another query per page before the edit. If the job has a pipeline, the
+        pages are handed off to it instead.
+        """
+        titles = []
+        for page in pages:
+            if not page.is_talkpage:
+                page = page.toggle_talk()
+            if page.title in job.processed_pages:
+                self.logger.debug(u"Skipping page, already processed: [[%s]]",
+                                  page.title)
+            else:
+                titles.append(page.title)
+        if job.pipeline:
+            job.processed_pages.update(titles)
+            job.pipeline.submit(titles)
+            return
+        for page in site.get_pages(titles):
+            self.process_page(page, job)
 
     def process_page(self, page, job):
         """Try to tag a specific *page* using the *job* description."""
@@ -248,20 +334,37 @@ class WikiProjectTagger(Task):
             return
         job.processed_pages.add(page.title)
 
-        if job.counter % 10 == 0:  # Do a shutoff check every ten pages
-            if self.shutoff_enabled(page.site):
-                raise _ShutoffEnabled()
+        if self.shutoff_enabled(page.site):  # Cached, so check every page
+            raise _ShutoffEnabled()
         job.counter += 1
 
         try:
-            code = page.parse()
+            text = page.get()
         except exceptions.PageNotFoundError:
-            self.process_new_page(page, job)
-            return
+            text = None
         except exceptions.InvalidPageError:
             self.logger.error(u"Skipping invalid page: [[%s]]", page.title)
+            job.checkpoint.mark_done("pages", page.title)
             return
 
+        result = self.tag_text(page.title, text, job)
+        if result:
+            self.save_page(page, job, *result)
+        job.checkpoint.mark_done("pages", page.title)
+
+    def tag_text(self, title, text, job):
+        """Tag the content of a page using the *job* description.
+
+        *text* is the current content of the page called *title*, or ``None``
+        if it doesn't exist yet. Return a tuple of the new content and the
+        banner that was added or updated, or ``None`` if the page should be
+        skipped. This doesn't touch the wiki, so it is safe to call from a
+        worker process.
+        """
+        if text is None:
+            return self.tag_new_page(title, job)
+        code = mwparserfromhell.parse(text)
+
         is_update = False
         for template in code.ifilter_templates(recursive=True):
             if template.name.matches(job.names):
@@ -271,14 +374,14 @@ class WikiProjectTagger(Task):
                     break
                 else:
                     log = u"Skipping page: [[%s]]; already tagged with '%s'"
-                    self.logger.info(log, page.title, template.name)
+                    self.logger.info(log, title, template.name)
                     return
 
         if job.only_with:
             if not any(template.name.matches(job.only_with)
                        for template in code.ifilter_templates(recursive=True)):
                 log = u"Skipping page: [[%s]]; fails only-with condition"
-                self.logger.info(log, page.title)
+                self.logger.info(log, title)
                 return
 
         if is_update:
@@ -286,12 +389,12 @@ class WikiProjectTagger(Task):
             self.update_banner(banner, job, code)
             if banner == old_banner:
                 log = u"Skipping page: [[%s]]; already tagged and no updates"
-                self.logger.info(log, page.title)
+                self.logger.info(log, title)
                 return
-            self.logger.info(u"Updating banner on page: [[%s]]", page.title)
+            self.logger.info(u"Updating banner on page: [[%s]]", title)
             banner = banner.encode("utf8")
         else:
-            self.logger.info(u"Tagging page: [[%s]]", page.title)
+            self.logger.info(u"Tagging page: [[%s]]", title)
             banner = self.make_banner(job, code)
             shell = self.get_banner_shell(code)
             if shell:
@@ -299,17 +402,20 @@ class WikiProjectTagger(Task):
             else:
                 self.add_banner(code, banner)
 
-        self.save_page(page, job, unicode(code), banner)
+        return unicode(code), banner
+
+    def tag_new_page(self, title, job):
+        """Tag a page that doesn't exist yet using the *job* description.
 
-    def process_new_page(self, page, job):
-        """Try to tag a *page* that doesn't exist yet using the *job*."""
+        Return a tuple like :py:meth:`tag_text`, or ``None``.
+        """
         if job.nocreate or job.only_with:
             log = u"Skipping nonexistent page: [[%s]]"
-            self.logger.info(log, page.title)
+            self.logger.info(log, title)
         else:
-            self.logger.info(u"Tagging new page: [[%s]]", page.title)
+            self.logger.info(u"Tagging new page: [[%s]]", title)
             banner = self.make_banner(job)
-            self.save_page(page, job, banner, banner)
+            return banner, banner
 
     def save_page(self, page, job, text, banner):
         """Save a page with an updated banner."""
@@ -433,8 +539,8 @@ class _Job(object):
     """Represents a single wikiproject-tagging task.
 
     Stores information on the banner to add, the edit summary to use, whether
-    or not to autoassess and create new pages from scratch, and a counter of
-    the number of pages edited.
+    or not to autoassess and create new pages from scratch, a counter of the
+    number of pages edited, and the checkpoint of pages and categories done.
     """
     def __init__(self, **kwargs):
         self.banner = kwargs["banner"]
@@ -447,10 +553,203 @@ class _Job(object):
         self.nocreate = kwargs["nocreate"]
         self.tag_categories = kwargs["tag_categories"]
         self.dry_run = kwargs["dry_run"]
+        self.workers = kwargs["workers"]
+        self.edit_delay = kwargs["edit_delay"]
+        self.checkpoint = kwargs["checkpoint"]
 
         self.counter = 0
-        self.processed_cats = set()
-        self.processed_pages = set()
+        self.processed_cats = self.checkpoint.get_done("categories")
+        self.processed_pages = self.checkpoint.get_done("pages")
+        self.pipeline = None
+
+
+class _Pipeline(object):
+    """Tags pages for a job in three concurrent stages.
+
+    Batches of talk page titles passed to :py:meth:`submit` are loaded by a
+    fetcher thread, tagged by a pool of worker processes (which is where the
+    parsing happens), and saved by an editor thread in the order they were
+    submitted, with at least ``job.edit_delay`` seconds between edits. The
+    queues between stages are bounded, so a slow stage holds back the ones
+    before it instead of letting pages pile up in memory.
+
+    The editor checks for shutoff before each page like :py:meth:`process_page
+    <WikiProjectTagger.process_page>` does, and marks pages done in the job's
+    checkpoint once they are saved. Both threads share the task's cancellation
+    token. If shutoff is enabled, the task is cancelled, or a stage fails, the
+    pipeline stops and the exception is raised by the next call to
+    :py:meth:`submit` or :py:meth:`finish`.
+    """
+    MAX_BATCHES = 2
+
+    def __init__(self, task, site, job):
+        self._task = task
+        self._site = site
+        self._job = job
+        self._logger = task.logger
+
+        self._batches = Queue(self.MAX_BATCHES)
+        self._results = Queue(job.workers * site.PAGE_BATCH_SIZE)
+        self._stopped = Event()
+        self._token = cancellation.get_token()
+        self._error = None
+        self._finished = False
+        self._fetched = set()
+
+        self._pool = Pool(job.workers, _init_worker, (task, job))
+        self._threads = []
+        for stage in (self._fetch, self._edit):
+            thread = Thread(target=stage)
+            thread.name = "{0}:{1}".format(task.name, stage.__name__[1:])
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _stop(self, error):
+        """Stop the pipeline, to be re-raised by the task as *error*."""
+        if not self._stopped.is_set():
+            self._error = error
+            self._stopped.set()
+
+    def _fetch(self):
+        """Load batches of talk pages and queue them to be tagged."""
+        cancellation.set_token(self._token)
+        while True:
+            batch = self._batches.get()
+            if batch is None:
+                break
+            if self._stopped.is_set():
+                continue
+            titles, callback = batch
+            try:
+                for page in self._site.get_pages(titles):
+                    if page.title in self._fetched:
+                        continue
+                    self._fetched.add(page.title)
+                    try:
+                        text = page.get()
+                    except exceptions.PageNotFoundError:
+                        text = None
+                    except exceptions.InvalidPageError:
+                        log = u"Skipping invalid page: [[%s]]"
+                        self._logger.error(log, page.title)
+                        self._results.put((page, None))
+                        continue
+                    args = (page.title, text)
+                    result = self._pool.apply_async(_tag_text, args)
+                    self._results.put((page, result))
+                if callback:
+                    self._results.put((None, callback))
+            except exceptions.CancelledError as exc:
+                self._stop(exc)
+            except Exception as exc:
+                self._logger.exception("Error while loading pages")
+                self._stop(exc)
+        self._results.put(None)
+
+    def _edit(self):
+        """Save tagged pages in order, waiting between edits if needed."""
+        cancellation.set_token(self._token)
+        last_edit = 0
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            if self._stopped.is_set():
+                continue
+            page, result = item
+            try:
+                if page is None:
+                    result()  # Callback from submit()
+                    continue
+                if result is None:  # Invalid page
+                    self._job.checkpoint.mark_done("pages", page.title)
+                    continue
+                if self._task.shutoff_enabled(page.site):
+                    self._stop(_ShutoffEnabled())
+                    continue
+                self._job.counter += 1
+
+                tagged, records = result.get()
+                for level, message in records:
+                    self._logger.log(level, message)
+                if tagged:
+                    if not self._job.dry_run:
+                        delay = last_edit + self._job.edit_delay - time()
+                        if delay > 0:
+                            cancellation.sleep(delay)
+                        last_edit = time()
+                    self._task.save_page(page, self._job, *tagged)
+                self._job.checkpoint.mark_done("pages", page.title)
+            except exceptions.CancelledError as exc:
+                self._stop(exc)
+            except Exception as exc:
+                self._logger.exception("Error while saving pages")
+                self._stop(exc)
+
+    def submit(self, titles, callback=None):
+        """Queue a batch of talk page titles, blocking if the queue is full.
+
+        If given, *callback* is called by the editor thread after the pages
+        are saved.
+        """
+        if self._stopped.is_set():
+            raise self._error
+        if titles or callback:
+            self._batches.put((titles, callback))
+
+    def finish(self):
+        """Wait for queued pages to be saved and shut down the pipeline."""
+        if not self._finished:
+            self._finished = True
+            self._batches.put(None)
+            for thread in self._threads:
+                thread.join()
+            if self._stopped.is_set():
+                self._pool.terminate()
+            else:
+                self._pool.close()
+            self._pool.join()
+        if self._stopped.is_set():
+            raise self._error
+
+
+class _LogBuffer(object):
+    """Stands in for a task's logger inside a worker process.
+
+    Records are formatted and kept so the parent can log them itself; the
+    bot's log handlers aren't safe to use from a forked process.
+    """
+    def __init__(self):
+        self.records = []
+
+    def log(self, level, msg, *args):
+        self.records.append((level, msg % args if args else msg))
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
+
+
+_worker = {}
+
+def _init_worker(task, job):
+    """Set up a pipeline worker process with the task and job to use."""
+    task.logger = _LogBuffer()
+    _worker["task"] = task
+    _worker["job"] = job
+
+def _tag_text(title, text):
+    """Tag a page in a worker process; return the result and log records."""
+    task = _worker["task"]
+    task.logger.records = []
+    result = task.tag_text(title, text, _worker["job"])
+    return result, task.logger.records
 
 
 class _ShutoffEnabled(Exception):
@@ -22,7 +22,8 @@
 # SOFTWARE.
 
 """
-usage: :command:`earwigbot [-h] [-v] [-d | -q] [-t NAME] [PATH] ...`
+usage: :command:`earwigbot [-h] [-v] [-d | -q] [-t NAME] [--profile-startup]
+[--profile-trace FILE] [PATH] ...`
 
 This is EarwigBot's command-line utility, enabling you to easily start the bot
 or run specific tasks.
@@ -43,6 +44,13 @@ or run specific tasks.
 ``-t NAME``, ``--task NAME``
     given the name of a task, the bot will run it instead of the main bot and
     then exit
+``--profile-startup``
+    time module imports and the main startup phases (loading the config,
+    permissions, commands, and tasks, and connecting to IRC), then print a
+    report once the bot is up
+``--profile-trace FILE``
+    like ``--profile-startup``, but also write the timings to ``FILE`` in
+    Chrome's trace event format (viewable in ``chrome://tracing``)
 ``TASK_ARGS``
     with --task, will pass any remaining arguments to the task's
     :py:meth:`.Task.run` method
@@ -50,12 +58,15 @@ or run specific tasks.
 """
 
 from argparse import Action, ArgumentParser, REMAINDER
+import __builtin__
+import json
 import logging
 from os import path
-from time import sleep
+import sys
+from threading import Lock, current_thread
+from time import sleep, time
 
 from earwigbot import __version__
-from earwigbot.bot import Bot
 
 __all__ = ["main"]
 
@@ -94,6 +105,218 @@ class _StoreTaskArg(Action):
             kwargs[key] = value
 
 
+class _StartupProfiler(object):
+    """Records where the bot's startup time goes, for ``--profile-startup``.
+
+    Module imports are timed by wrapping :py:func:`__import__` (and
+    :py:func:`reload`, which :py:mod:`earwigbot.lazy` uses to load modules on
+    first use); only imports made by the main thread that actually load
+    something new are recorded. Startup phases are timed by wrapping the
+    methods that run them. Everything is put back by :py:meth:`finish`.
+    """
+    REPORT_IMPORTS = 25
+
+    def __init__(self, trace_file=None):
+        self._trace_file = trace_file
+        self._start = time()
+        self._thread = current_thread()
+        self._lock = Lock()
+        self._imports = []  # (name, start, total, self) per import
+        self._phases = []  # (label, start, duration) per phase
+        self._stack = []  # [name, time spent in children] per import
+        self._patches = []
+        self._connecting = {}
+        self._pending = 0
+        self._finished = False
+        self._real_import = __builtin__.__import__
+        self._real_reload = __builtin__.reload
+
+    @staticmethod
+    def _resolve_name(name, globals_, fromlist, level):
+        """Return the full name of a module imported relatively."""
+        if not globals_ or level == 0 or (level < 0 and name in sys.modules):
+            return name
+        package = globals_.get("__package__")
+        if not package:
+            package = globals_.get("__name__", "")
+            if "__path__" not in globals_:
+                package = package.rpartition(".")[0]
+        if level > 0:
+            package = package.rsplit(".", level - 1)[0]
+            if name:
+                return package + "." + name
+            return ", ".join(package + "." + item for item in fromlist or [])
+        if package and sys.modules.get(package + "." + name) is not None:
+            return package + "." + name
+        return name
+
+    def _timed_import(self, loader, name, *args, **kwargs):
+        """Run an import through *loader*, recording it if it loads code."""
+        if current_thread() is not self._thread:
+            return loader(name, *args, **kwargs)
+        label = name
+        if not isinstance(label, basestring):
+            label = getattr(name, "__name__", repr(name))
+        parent = self._stack[-1] if self._stack else None
+        if parent and parent[0] == label:
+            # A lazy module being loaded by the import that asked for it;
+            # count it as part of that import rather than separately:
+            return loader(name, *args, **kwargs)
+        modules = len(sys.modules)
+        self._stack.append([label, 0])
+        start = time()
+        try:
+            return loader(name, *args, **kwargs)
+        finally:
+            total = time() - start
+            children = self._stack.pop()[1]
+            if parent:
+                parent[1] += total
+            if len(sys.modules) > modules or loader is self._real_reload:
+                globals_ = args[0] if args else kwargs.get("globals")
+                fromlist = args[2] if len(args) > 2 else kwargs.get("fromlist")
+                level = args[3] if len(args) > 3 else kwargs.get("level", -1)
+                label = self._resolve_name(label, globals_, fromlist, level)
+                item = (label, start - self._start, total, total - children)
+                self._imports.append(item)
+
+    def _import(self, name, *args, **kwargs):
+        """Replacement for :py:func:`__import__` that times new imports."""
+        return self._timed_import(self._real_import, name, *args, **kwargs)
+
+    def _reload(self, module):
+        """Replacement for :py:func:`reload` that times lazy module loads."""
+        return self._timed_import(self._real_reload, module)
+
+    def _record_phase(self, label, start):
+        """Record a startup phase that began at *start* and just ended."""
+        with self._lock:
+            item = (label, start - self._start, time() - start)
+            self._phases.append(item)
+
+    def _patch(self, owner, attr, label):
+        """Time calls to *owner.attr*, labelling them with *label(self)*."""
+        original = owner.__dict__[attr]
+        def wrapper(inst, *args, **kwargs):
+            start = time()
+            try:
+                return original(inst, *args, **kwargs)
+            finally:
+                self._record_phase(label(inst), start)
+
+        setattr(owner, attr, wrapper)
+        self._patches.append((owner, attr, original))
+
+    def _patch_irc(self, connection):
+        """Time how long each IRC component takes to connect, until ready."""
+        original_connect = connection.__dict__["_connect"]
+        original_finish = connection.__dict__["_finish_connect"]
+        def connect(inst, *args, **kwargs):
+            self._connecting.setdefault(id(inst), time())
+            return original_connect(inst, *args, **kwargs)
+
+        def finish_connect(inst, *args, **kwargs):
+            try:
+                return original_finish(inst, *args, **kwargs)
+            finally:
+                start = self._connecting.pop(id(inst), None)
+                if start is not None:
+                    label = "irc.connect({0})".format(type(inst).__name__)
+                    self._record_phase(label, start)
+                    self._connected()
+
+        connection._connect = connect
+        connection._finish_connect = finish_connect
+        self._patches.append((connection, "_connect", original_connect))
+        self._patches.append((connection, "_finish_connect", original_finish))
+
+    def _connected(self):
+        """Note that an IRC component connected; finish if it was the last."""
+        with self._lock:
+            self._pending -= 1
+            done = self._pending <= 0
+        if done:
+            self.finish()
+
+    def install_import_hooks(self):
+        """Start timing module imports."""
+        __builtin__.__import__ = self._import
+        __builtin__.reload = self._reload
+
+    def install_phase_hooks(self):
+        """Start timing the startup phases; the bot must be imported first."""
+        from earwigbot.config import BotConfig
+        from earwigbot.config.permissions import PermissionsDB
+        from earwigbot.irc import IRCConnection
+        from earwigbot.managers import _ResourceManager
+
+        self._patch(BotConfig, "load", lambda inst: "config.load()")
+        self._patch(PermissionsDB, "load", lambda inst: "permissions.load()")
+        self._patch(_ResourceManager, "load",
+                    lambda inst: "{0}.load()".format(inst._resource_name))
+        self._patch_irc(IRCConnection)
+
+    def wait_for_irc(self, bot):
+        """Finish once all of *bot*'s enabled IRC components have connected.
+
+        If none are enabled, we finish right away.
+        """
+        names = ("irc_frontend", "irc_watcher")
+        components = bot.config.components
+        with self._lock:
+            self._pending = len([name for name in names
+                                 if components.get(name)])
+            done = self._pending <= 0
+        if done:
+            self.finish()
+
+    def finish(self):
+        """Stop profiling and report the results, if we haven't already."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            elapsed = time() - self._start
+            if __builtin__.__import__ == self._import:
+                __builtin__.__import__ = self._real_import
+                __builtin__.reload = self._real_reload
+            for owner, attr, original in reversed(self._patches):
+                setattr(owner, attr, original)
+        self._report(elapsed)
+        if self._trace_file:
+            self._write_trace()
+
+    def _report(self, elapsed):
+        """Print the phase and import timings, slowest first."""
+        print "Startup profile ({0:.3f} seconds):".format(elapsed)
+        print "  phases:"
+        for label, start, duration in sorted(self._phases,
+                                             key=lambda item: -item[2]):
+            print "    {0:8.3f}s  {1}".format(duration, label)
+        imports = sorted(self._imports, key=lambda item: -item[2])
+        print "  imports (cumulative, self; {0} of {1}):".format(
+            min(self.REPORT_IMPORTS, len(imports)), len(imports))
+        for name, start, total, own in imports[:self.REPORT_IMPORTS]:
+            print "    {0:8.3f}s {1:8.3f}s  {2}".format(total, own, name)
+        print
+
+    def _write_trace(self):
+        """Write the timings to our trace file as Chrome trace events."""
+        events = []
+        for name, start, total, own in self._imports:
+            events.append({"name": name, "cat": "import", "ph": "X",
+                           "ts": int(start * 1e6), "dur": int(total * 1e6),
+                           "pid": 0, "tid": 0, "args": {"self": own}})
+        for label, start, duration in self._phases:
+            events.append({"name": label, "cat": "phase", "ph": "X",
+                           "ts": int(start * 1e6), "dur": int(duration * 1e6),
+                           "pid": 0, "tid": 1})
+        with open(self._trace_file, "w") as fp:
+            json.dump({"traceEvents": events}, fp)
+        print "Startup trace written to {0}".format(self._trace_file)
+        print
+
+
 def main():
     """Main entry point for the command-line utility."""
     version = "EarwigBot v{0}".format(__version__)
@@ -117,6 +340,12 @@ def main():
                         metavar="TASK_ARGS",
                         help="""with --task, will pass these arguments to the
                                 task's run() method""")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="""time module imports and startup phases, and
+                                print a report once the bot is up""")
+    parser.add_argument("--profile-trace", metavar="FILE",
+                        help="""like --profile-startup, but also write the
+                                timings to FILE as a Chrome trace""")
     args = parser.parse_args()
 
     if not args.task and args.task_args:
@@ -131,18 +360,37 @@ def main():
     print version
     print
 
-    bot = Bot(path.abspath(args.path), level=level)
+    profiler = None
+    if args.profile_startup or args.profile_trace:
+        profiler = _StartupProfiler(args.profile_trace)
+        profiler.install_import_hooks()
+    from earwigbot.bot import Bot
+    if profiler:
+        profiler.install_phase_hooks()
+
+    try:
+        bot = Bot(path.abspath(args.path), level=level)
+    except BaseException:
+        if profiler:
+            profiler.finish()
+        raise
+    if profiler:
+        if args.task:
+            profiler.finish()
+        else:
+            profiler.wait_for_irc(bot)
+
     if args.task:
-        thread = bot.tasks.start(args.task, **args.task_args)
-        if not thread:
+        job = bot.tasks.start(args.task, **args.task_args)
+        if not job:
             return
         try:
-            while thread.is_alive():  # Keep it alive; it's a daemon
+            while job.is_alive():  # Keep it alive; it's a daemon
                 sleep(1)
         except KeyboardInterrupt:
             pass
         finally:
-            if thread.is_alive():
+            if job.is_alive():
                 bot.tasks.logger.warn("The task will be killed")
     else:
         try:
@@ -152,6 +400,8 @@ def main():
         finally:
             if bot.is_running:
                 bot.stop()
+            if profiler:
+                profiler.finish()
 
 if __name__ == "__main__":
     main()
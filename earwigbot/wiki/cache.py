@@ -0,0 +1,179 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2017 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from collections import OrderedDict
+from json import dumps, loads
+from threading import Lock
+from time import time
+
+__all__ = ["APICache"]
+
+class APICache(object):
+    """
+    **EarwigBot: Wiki Toolset: API Response Cache**
+
+    Stores the results of read-only API queries made by a
+    :py:class:`~earwigbot.wiki.site.Site`, so that identical queries made
+    within a short period of time (like several IRC commands asking about the
+    same page) don't hit the API again.
+
+    Each action (``"query"``, ``"parse"``, ...) is cached only if it has a
+    time-to-live in *ttls*, in seconds, and only if it is read-only; by
+    default, only ``"query"`` is cached, for 30 seconds. The cache holds at
+    most *max_size* bytes of serialized results, dropping the least recently
+    used entries first. Entries are also dropped when a page or user they
+    refer to is changed, either by our own write queries or by edits and log
+    actions seen on the IRC watcher (see :py:meth:`SitesDB.process_rc
+    <earwigbot.wiki.sitesdb.SitesDB.process_rc>`).
+    """
+    READ_ACTIONS = ["query", "parse", "expandtemplates", "opensearch",
+                    "compare", "paraminfo"]
+    NAME_PARAMS = ["title", "titles", "page", "from", "to", "cmtitle",
+                   "bltitle", "eititle", "ususers", "ucuser", "user"]
+
+    DEFAULT_TTLS = {"query": 30}
+    DEFAULT_MAX_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, ttls=None, max_size=None):
+        self._ttls = self.DEFAULT_TTLS if ttls is None else ttls
+        self._max_size = max_size or self.DEFAULT_MAX_SIZE
+        self._size = 0
+        self._entries = OrderedDict()  # key -> (expiry, result, names)
+        self._keys_by_name = {}
+        self._lock = Lock()
+
+    def __repr__(self):
+        """Return the canonical string representation of the APICache."""
+        res = "APICache(ttls={0!r}, max_size={1!r})"
+        return res.format(self._ttls, self._max_size)
+
+    def __str__(self):
+        """Return a nice string representation of the APICache."""
+        res = "<APICache of {0} entries ({1} bytes)>"
+        return res.format(len(self._entries), self._size)
+
+    @staticmethod
+    def _make_key(params):
+        """Return a hashable key representing a set of query parameters."""
+        return tuple(sorted(params.iteritems()))
+
+    @staticmethod
+    def _normalize(name):
+        """Normalize a page title or username for invalidation purposes."""
+        name = name.replace("_", " ").strip()
+        return name[:1].upper() + name[1:]
+
+    def _get_names(self, params, result=None):
+        """Return the set of page titles and usernames used by a query."""
+        names = set()
+        for key in self.NAME_PARAMS:
+            value = params.get(key)
+            if isinstance(value, basestring):
+                names.update(self._normalize(name)
+                             for name in value.split("|"))
+        if result:
+            try:
+                for page in result["query"]["pages"].itervalues():
+                    names.add(page["title"])
+            except (KeyError, TypeError, AttributeError):
+                pass
+        return names
+
+    def _remove(self, key):
+        """Remove the entry with the given key. Must hold the lock."""
+        _, data, names = self._entries.pop(key)
+        self._size -= len(data)
+        for name in names:
+            keys = self._keys_by_name.get(name)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_name[name]
+
+    def is_cacheable(self, params):
+        """Return whether the given query parameters can be cached."""
+        action = params.get("action")
+        if action not in self.READ_ACTIONS or action not in self._ttls:
+            return False
+        if "tokens" in params.get("meta", "").split("|"):
+            return False
+        return True
+
+    def get(self, params):
+        """Return the cached result of a query, or ``None`` if not cached."""
+        try:
+            key = self._make_key(params)
+        except TypeError:  # Unhashable parameter values
+            return None
+        with self._lock:
+            try:
+                expiry, data, _ = self._entries[key]
+            except KeyError:
+                return None
+            if expiry < time():
+                self._remove(key)
+                return None
+            self._entries[key] = self._entries.pop(key)  # Mark as recent
+        return loads(data)
+
+    def store(self, params, result):
+        """Store the result of a query made with the given parameters."""
+        try:
+            key = self._make_key(params)
+        except TypeError:
+            return
+        data = dumps(result)
+        if len(data) > self._max_size:
+            return
+        expiry = time() + self._ttls[params["action"]]
+        names = self._get_names(params, result)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._size + len(data) > self._max_size:
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = (expiry, data, names)
+            self._size += len(data)
+            for name in names:
+                self._keys_by_name.setdefault(name, set()).add(key)
+
+    def invalidate(self, *names):
+        """Remove all entries referring to any of the given titles or users."""
+        with self._lock:
+            for name in names:
+                keys = self._keys_by_name.get(self._normalize(name))
+                if keys:
+                    for key in list(keys):
+                        self._remove(key)
+
+    def invalidate_query(self, params):
+        """Remove all entries made stale by a (possibly) writing query."""
+        if params.get("action") not in self.READ_ACTIONS:
+            self.invalidate(*self._get_names(params))
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_name.clear()
+            self._size = 0
@@ -105,6 +105,21 @@ class Category(Page):
             yield self.site.get_page(title, follow_redirects=follow,
                                      pageid=row[2])
 
+    def _get_members_with_content(self, limit, follow):
+        """Iterate over Pages in the category, loaded with their content."""
+        params = {"generator": "categorymembers", "gcmtitle": self.title,
+                  "gcmlimit": self.site.PAGE_BATCH_SIZE}
+        if limit:
+            params["gcmlimit"] = min(limit, self.site.PAGE_BATCH_SIZE)
+
+        for results, _ in self.site._get_page_batches(params):
+            for result in results:
+                yield self.site._make_loaded_page(result, follow)
+                if limit:
+                    limit -= 1
+                    if not limit:
+                        return
+
     def _get_size_via_api(self, member_type):
         """Return the size of the category using the API."""
         result = self.site.api_query(action="query", prop="categoryinfo",
@@ -173,7 +188,7 @@ class Category(Page):
         """
         return self._get_size("subcats")
 
-    def get_members(self, limit=None, follow_redirects=None):
+    def get_members(self, limit=None, follow_redirects=None, content=False):
         """Iterate over Pages in the category.
 
         If *limit* is given, we will provide this many pages, or less if the
@@ -187,6 +202,12 @@ class Category(Page):
         the amount of lag on each. This is handled by :py:meth:`site.delegate()
         <earwigbot.wiki.site.Site.delegate>`.
 
+        If *content* is ``True``, we'll always use the API, and each Page will
+        be loaded with its content and attributes like in
+        :py:meth:`site.get_pages() <earwigbot.wiki.site.Site.get_pages>`, with
+        one query for every
+        :py:const:`~earwigbot.wiki.site.Site.PAGE_BATCH_SIZE` members.
+
         .. note::
            Be careful when iterating over very large categories with no limit.
            If using the API, at best, you will make one query per 5000 pages,
@@ -199,10 +220,13 @@ class Category(Page):
            thousand, in which case the sheer number of titles in memory becomes
            problematic.
         """
+        if follow_redirects is None:
+            follow_redirects = self._follow_redirects
+        if content:
+            return self._get_members_with_content(limit, follow_redirects)
+
         services = {
             self.site.SERVICE_API: self._get_members_via_api,
             self.site.SERVICE_SQL: self._get_members_via_sql
         }
-        if follow_redirects is None:
-            follow_redirects = self._follow_redirects
         return self.site.delegate(services, (limit, follow_redirects))
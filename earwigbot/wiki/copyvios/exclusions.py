@@ -27,6 +27,7 @@ from time import time
 from urlparse import urlparse
 
 from earwigbot import exceptions
+from earwigbot.database import Database
 
 __all__ = ["ExclusionsDB"]
 
@@ -54,6 +55,7 @@ class ExclusionsDB(object):
     def __init__(self, sitesdb, dbfile, logger):
         self._sitesdb = sitesdb
         self._dbfile = dbfile
+        self._db = Database(dbfile)
         self._logger = logger
         self._db_access_lock = Lock()
 
@@ -66,6 +68,14 @@ class ExclusionsDB(object):
         """Return a nice string representation of the ExclusionsDB."""
         return "<ExclusionsDB at {0}>".format(self._dbfile)
 
+    def _after_fork(self):
+        """Replace our lock in a newly forked child process.
+
+        It is held while syncing with the wiki, so another thread of the
+        parent process could easily have held it when it forked.
+        """
+        self._db_access_lock = Lock()
+
     def _create(self):
         """Initialize the exclusions database with its necessary tables."""
         script = """
@@ -79,7 +89,7 @@ class ExclusionsDB(object):
             for page in pages:
                 sources.append((sitename, page))
 
-        with sqlite.connect(self._dbfile) as conn:
+        with self._db.connect() as conn:
             conn.executescript(script)
             conn.executemany(query, sources)
 
@@ -122,7 +132,7 @@ class ExclusionsDB(object):
             site = self._sitesdb.get_site("enwiki")
         else:
             site = self._sitesdb.get_site(sitename)
-        with self._db_access_lock, sqlite.connect(self._dbfile) as conn:
+        with self._db_access_lock, self._db.connect() as conn:
             urls = set()
             for (source,) in conn.execute(query1, (sitename,)):
                 urls |= self._load_source(site, source)
@@ -140,7 +150,7 @@ class ExclusionsDB(object):
     def _get_last_update(self, sitename):
         """Return the UNIX timestamp of the last time the db was updated."""
         query = "SELECT update_time FROM updates WHERE update_sitename = ?"
-        with self._db_access_lock, sqlite.connect(self._dbfile) as conn:
+        with self._db_access_lock, self._db.connect() as conn:
             try:
                 result = conn.execute(query, (sitename,)).fetchone()
             except sqlite.OperationalError:
@@ -176,7 +186,7 @@ class ExclusionsDB(object):
         normalized = re.sub(r"^https?://(www\.)?", "", url.lower())
         query = """SELECT exclusion_url FROM exclusions
                    WHERE exclusion_sitename = ? OR exclusion_sitename = ?"""
-        with self._db_access_lock, sqlite.connect(self._dbfile) as conn:
+        with self._db.connect() as conn:
             for (excl,) in conn.execute(query, (sitename, "all")):
                 if excl.startswith("*."):
                     parsed = urlparse(url.lower())
@@ -20,20 +20,23 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import OrderedDict
 from cookielib import CookieJar
 from gzip import GzipFile
+from itertools import islice
 from json import loads
 from logging import getLogger, NullHandler
 from os.path import expanduser
 from StringIO import StringIO
 from threading import RLock
-from time import sleep, time
+from time import time
 from urllib import quote_plus, unquote_plus
 from urllib2 import build_opener, HTTPCookieProcessor, URLError
 from urlparse import urlparse
 
-from earwigbot import exceptions, importer
+from earwigbot import cancellation, exceptions, importer
 from earwigbot.wiki import constants
+from earwigbot.wiki.cache import APICache
 from earwigbot.wiki.category import Category
 from earwigbot.wiki.page import Page
 from earwigbot.wiki.user import User
@@ -77,6 +80,7 @@ class Site(object):
     - :py:meth:`namespace_id_to_name`: returns names associated with an NS id
     - :py:meth:`namespace_name_to_id`: returns the ID associated with a NS name
     - :py:meth:`get_page`:             returns a Page for the given title
+    - :py:meth:`get_pages`:            iterates over Pages with their content
     - :py:meth:`get_category`:         returns a Category for the given title
     - :py:meth:`get_user`:             returns a User object for the given name
     - :py:meth:`delegate`:             controls when the API or SQL is used
@@ -85,13 +89,16 @@ class Site(object):
     SERVICE_SQL = 2
     SPECIAL_TOKENS = ["deleteglobalaccount", "patrol", "rollback",
                       "setglobalaccountstatus", "userrights", "watch"]
+    PAGE_BATCH_SIZE = 50  # Max number of pages with content per API query
+    MIN_LOGIN_BACKOFF = 15
+    MAX_LOGIN_BACKOFF = 900
 
     def __init__(self, name=None, project=None, lang=None, base_url=None,
                  article_path=None, script_path=None, sql=None,
                  namespaces=None, login=(None, None), cookiejar=None,
                  user_agent=None, use_https=True, assert_edit=None,
                  maxlag=None, wait_between_queries=2, logger=None,
-                 search_config=None):
+                 search_config=None, cache_config=None, lazy=False):
         """Constructor for new Site instances.
 
         This probably isn't necessary to call yourself unless you're building a
@@ -102,12 +109,18 @@ class Site(object):
         *script_path*; this is enough to figure out an API url. *login*, a
         tuple of (username, password), is highly recommended. *cookiejar* will
         be used to store cookies, and we'll use a normal CookieJar if none is
-        given.
+        given. If *cache_config* is given (as a dict, possibly empty, with
+        optional ``"ttl"`` and ``"maxSize"`` keys), the results of read-only
+        API queries will be cached; see
+        :py:class:`~earwigbot.wiki.cache.APICache`.
 
         First, we'll store the given arguments as attributes, then set up our
         URL opener. We'll load any of the attributes that weren't given from
         the API, and then log in if a username/pass was given and we aren't
-        already logged in.
+        already logged in. If *lazy* is ``True``, we won't touch the network
+        here at all: missing attributes are loaded the first time they are
+        used, and we log in just before the first call to :py:meth:`api_query`
+        (once, no matter how many threads are using the site).
         """
         # Attributes referring to site information, filled in by an API query
         # if they are missing (and an API url can be determined):
@@ -118,6 +131,7 @@ class Site(object):
         self._article_path = article_path
         self._script_path = script_path
         self._namespaces = namespaces
+        self._attributes_loaded = False
 
         # Attributes used for API queries:
         self._use_https = use_https
@@ -127,8 +141,14 @@ class Site(object):
         self._max_retries = 6
         self._last_query_time = 0
         self._tokens = {}
+        self._wanted_tokens = {"csrf"}  # Token types fetched together
         self._api_lock = RLock()
         self._api_info_cache = {"maxlag": 0, "lastcheck": 0}
+        if cache_config is not None:
+            self._api_cache = APICache(cache_config.get("ttl"),
+                                       cache_config.get("maxSize"))
+        else:
+            self._api_cache = None
 
         # Attributes used for SQL queries:
         if sql:
@@ -163,15 +183,14 @@ class Site(object):
             self._logger = getLogger("earwigbot.wiki")
             self._logger.addHandler(NullHandler())
 
-        # Get all of the above attributes that were not specified as arguments:
-        self._load_attributes()
-
-        # If we have a name/pass and the API says we're not logged in, log in:
-        self._login_info = name, password = login
-        if name and password:
-            logged_in_as = self._get_username_from_cookies()
-            if not logged_in_as or name.replace("_", " ") != logged_in_as:
-                self._login(login)
+        # Get all of the above attributes that were not specified as
+        # arguments, and log in if needed, unless we're told to wait:
+        self._login_info = login
+        self._login_checked = False
+        self._login_failure = None  # (error, time to retry after, backoff)
+        if not lazy:
+            with self._api_lock:
+                self._check_login()
 
     def __repr__(self):
         """Return the canonical string representation of the Site."""
@@ -220,13 +239,17 @@ class Site(object):
         See the documentation for :py:meth:`api_query` for full implementation
         details. *tries*, *wait*, and *ignore_maxlag* are for maxlag;
         *no_assert* and *ae_retry* are for AssertEdit.
+
+        If the calling thread's cancellation token is cancelled, we raise
+        :py:exc:`~earwigbot.exceptions.CancelledError` instead of querying.
         """
+        cancellation.check()
         since_last_query = time() - self._last_query_time  # Throttling support
         if since_last_query < self._wait_between_queries:
             wait_time = self._wait_between_queries - since_last_query
             log = "Throttled: waiting {0} seconds".format(round(wait_time, 2))
             self._logger.debug(log)
-            sleep(wait_time)
+            cancellation.sleep(wait_time)
         self._last_query_time = time()
 
         url, data = self._build_api_query(params, ignore_maxlag, no_assert)
@@ -257,8 +280,16 @@ class Site(object):
 
         return self._handle_api_result(result, params, tries, wait, ae_retry)
 
-    def _request_csrf_token(self, params):
-        """If possible, add a request for a CSRF token to an API query."""
+    def _get_token_types(self):
+        """Return the token types we want, joined for the API's *type*."""
+        return "|".join(sorted(self._wanted_tokens))
+
+    def _request_tokens(self, params):
+        """If possible, add a request for missing tokens to an API query.
+
+        Every token type we have needed before (see :py:meth:`get_token`) is
+        requested, not just the ones missing, so they are refreshed together.
+        """
         if params.get("action") == "query":
             if params.get("meta"):
                 if "tokens" not in params["meta"].split("|"):
@@ -266,8 +297,13 @@ class Site(object):
             else:
                 params["meta"] = "tokens"
             if params.get("type"):
-                if "csrf" not in params["type"].split("|"):
-                    params["type"] += "|csrf"
+                types = params["type"].split("|")
+            else:
+                types = ["csrf"]  # The API's default
+            for token_type in sorted(self._wanted_tokens):
+                if token_type not in types:
+                    types.append(token_type)
+            params["type"] = "|".join(types)
 
     def _build_api_query(self, params, ignore_maxlag, no_assert):
         """Given API query params, return the URL to query and POST data."""
@@ -283,9 +319,9 @@ class Site(object):
         if self._maxlag and not ignore_maxlag:
             # If requested, don't overload the servers:
             params["maxlag"] = self._maxlag
-        if "csrf" not in self._tokens:
-            # If we don't have a CSRF token, try to fetch one:
-            self._request_csrf_token(params)
+        if not self._wanted_tokens.issubset(self._tokens):
+            # If we are missing any tokens, try to fetch them:
+            self._request_tokens(params)
 
         data = self._urlencode_utf8(params)
         return url, data
@@ -314,7 +350,7 @@ class Site(object):
             tries += 1
             msg = 'Server says "{0}"; retrying in {1} seconds ({2}/{3})'
             self._logger.info(msg.format(info, wait, tries, self._max_retries))
-            sleep(wait)
+            cancellation.sleep(wait)
             return self._api_query(params, tries, wait * 2, ae_retry=ae_retry)
         elif code in ["assertuserfailed", "assertbotfailed"]:  # AssertEdit
             if ae_retry and all(self._login_info):
@@ -345,6 +381,9 @@ class Site(object):
 
         Additionally, you can call this with *force* set to True to forcibly
         reload all attributes.
+
+        For lazy sites, this is called instead when a missing attribute is
+        first needed, or before logging in.
         """
         # All attributes to be loaded, except _namespaces, which is a special
         # case because it requires additional params in the API query:
@@ -359,7 +398,9 @@ class Site(object):
                 result = self._api_query(params, no_assert=True)
             self._load_namespaces(result)
         elif all(attrs):  # Everything is already specified and we're not told
-            return        # to force a reload, so do nothing
+            # to force a reload, so there is nothing to do:
+            self._attributes_loaded = True
+            return
         else:  # We're only loading attributes other than _namespaces
             with self._api_lock:
                 result = self._api_query(params, no_assert=True)
@@ -371,6 +412,7 @@ class Site(object):
         self._base_url = res["server"]
         self._article_path = res["articlepath"]
         self._script_path = res["scriptpath"]
+        self._attributes_loaded = True
 
     def _load_namespaces(self, result):
         """Fill self._namespaces with a dict of namespace IDs and names.
@@ -491,10 +533,10 @@ class Site(object):
     def _login(self, login, token=None, attempt=0):
         """Safely login through the API.
 
-        Normally, this is called by __init__() if a username and password have
-        been provided and no valid login cookies were found. The only other
-        time it needs to be called is when those cookies expire, which is done
-        automatically by api_query() if a query fails.
+        Normally, this is called by _check_login() if a username and password
+        have been provided and no valid login cookies were found. The only
+        other time it needs to be called is when those cookies expire, which is
+        done automatically by api_query() if a query fails.
 
         Recent versions of MediaWiki's API have fixed a CSRF vulnerability,
         requiring login to be done in two separate requests. If the response
@@ -509,6 +551,8 @@ class Site(object):
         loop if MediaWiki isn't acting right.
         """
         self._tokens.clear()
+        if self._api_cache:  # Cached results may depend on who we are
+            self._api_cache.clear()
         name, password = login
 
         params = {"action": "login", "lgname": name, "lgpassword": password}
@@ -520,6 +564,11 @@ class Site(object):
         res = result["login"]["result"]
         if res == "Success":
             self._save_cookiejar()
+            # Our old tokens are now invalid, so get new ones right away:
+            params = {"action": "query", "meta": "tokens",
+                      "type": self._get_token_types()}
+            with self._api_lock:
+                self._api_query(params, no_assert=True)
         elif res == "NeedToken" and attempt == 0:
             token = result["login"]["token"]
             return self._login(login, token, attempt=1)
@@ -536,6 +585,48 @@ class Site(object):
                 e = "Couldn't login; server says '{0}'.".format(res)
             raise exceptions.LoginError(e)
 
+    def _check_login(self):
+        """Load missing attributes and log in, if we haven't done so already.
+
+        We log in only if we have a username and password and our cookies
+        don't say that we're already logged in as that user. This is called
+        by __init__(), or for lazy sites, by api_query() before its first
+        query. The caller must hold the API lock, so only one thread does
+        this.
+
+        If it fails, queries raise the same error without trying again for
+        :py:attr:`MIN_LOGIN_BACKOFF` seconds, a delay that doubles after each
+        failed attempt up to :py:attr:`MAX_LOGIN_BACKOFF`.
+        """
+        if self._login_checked:
+            return
+        if self._login_failure:
+            error, retry_after, backoff = self._login_failure
+            if time() < retry_after:
+                raise error
+        try:
+            self._load_attributes()
+            name, password = self._login_info
+            if name and password:
+                logged_in_as = self._get_username_from_cookies()
+                if not logged_in_as or name.replace("_", " ") != logged_in_as:
+                    self._login(self._login_info)
+        except exceptions.CancelledError:
+            raise
+        except exceptions.EarwigBotError as exc:
+            if self._login_failure:
+                backoff = min(self._login_failure[2] * 2,
+                              self.MAX_LOGIN_BACKOFF)
+            else:
+                backoff = self.MIN_LOGIN_BACKOFF
+            self._login_failure = (exc, time() + backoff, backoff)
+            log = ("Couldn't log in or load site info ({0}); not trying "
+                   "again for {1} seconds")
+            self._logger.warn(log.format(exc, backoff))
+            raise
+        self._login_checked = True
+        self._login_failure = None
+
     def _logout(self):
         """Safely logout through the API.
 
@@ -621,19 +712,97 @@ class Site(object):
 
         return [self.SERVICE_SQL, self.SERVICE_API]
 
+    def _get_page_batches(self, params):
+        """Iterate over batches of page data loaded with their content.
+
+        *params* should select pages with either ``titles`` or a
+        ``generator``; we add the props needed to load each page's attributes
+        and content in the same query. If the content of some pages in a batch
+        doesn't fit in a single response, we'll follow the ``rvcontinue``
+        continuation until the batch is complete before yielding it.
+
+        Each batch is a tuple of (list of results, dict of normalized titles).
+        Every result looks like the response to a single-page query, so it can
+        be given straight to :py:meth:`Page._load_attributes
+        <earwigbot.wiki.page.Page._load_attributes>` and
+        :py:meth:`Page._load_content
+        <earwigbot.wiki.page.Page._load_content>`.
+        """
+        params = dict(params, action="query", prop="info|revisions",
+                      inprop="protection|url", rvprop="content|timestamp")
+        params["continue"] = ""
+        last_continue = {}
+        pages, interwiki, normalized = OrderedDict(), [], {}
+
+        while True:
+            result = self.api_query(**params)
+            query = result.get("query", {})
+            for pageid, res in query.get("pages", {}).iteritems():
+                if pageid in pages:
+                    if "revisions" in res:
+                        pages[pageid]["revisions"] = res["revisions"]
+                else:
+                    pages[pageid] = res
+            interwiki += query.get("interwiki", [])
+            for norm in query.get("normalized", []):
+                normalized[norm["from"]] = norm["to"]
+
+            cont = result.get("continue", {})
+            if "rvcontinue" not in cont:
+                results = [{"query": {"pages": {pageid: res}}}
+                           for pageid, res in pages.iteritems()]
+                results += [{"query": {"interwiki": [iw]}} for iw in interwiki]
+                yield results, normalized
+                pages, interwiki, normalized = OrderedDict(), [], {}
+            if not cont:
+                break
+            for key in last_continue:
+                params.pop(key, None)
+            params.update(cont)
+            last_continue = cont
+
+    def _make_loaded_page(self, result, follow_redirects=False):
+        """Return a Page built from the result of a content query.
+
+        *result* is one of the results yielded by :py:meth:`_get_page_batches`.
+        If *follow_redirects* is ``True`` and the page is a redirect, we won't
+        keep its content, so the Page follows the redirect on its own when it
+        is first used.
+        """
+        query = result["query"]
+        if "interwiki" in query:
+            title = query["interwiki"][0]["title"]
+        else:
+            title = query["pages"].values()[0]["title"]
+
+        page = self.get_page(title, follow_redirects)
+        page._load_attributes(result=result)
+        if page._exists == page.PAGE_EXISTS:
+            if follow_redirects and page._is_redirect:
+                page._exists = page.PAGE_UNKNOWN
+            else:
+                page._load_content(result=result)
+        return page
+
     @property
     def name(self):
         """The Site's name (or "wikiid" in the API), like ``"enwiki"``."""
+        if not self._attributes_loaded:
+            self._load_attributes()
         return self._name
 
     @property
     def project(self):
         """The Site's project name in lowercase, like ``"wikipedia"``."""
+        if not self._attributes_loaded:
+            self._load_attributes()
         return self._project
 
     @property
     def lang(self):
         """The Site's language code, like ``"en"`` or ``"es"``."""
+        if not self._attributes_loaded:
+            self._load_attributes()
         return self._lang
 
     @property
@@ -681,11 +850,35 @@ class Site(object):
         reason was due to maxlag, we'll sleep for a bit and then repeat the
         query until we exceed :py:attr:`self._max_retries`.
 
+        Before each request (including retries), we check the calling thread's
+        :py:func:`cancellation token <earwigbot.cancellation.get_token>`, and
+        raise :py:exc:`~earwigbot.exceptions.CancelledError` if it has been
+        cancelled. A query that has already been sent is allowed to finish.
+
+        If this site was created with a *cache_config*, the results of
+        read-only queries may come from our
+        :py:class:`~earwigbot.wiki.cache.APICache` instead, and other queries
+        (like edits) will invalidate cached results for the pages they touch.
+
         There is helpful MediaWiki API documentation at `MediaWiki.org
         <https://www.mediawiki.org/wiki/API>`_.
         """
+        cache = self._api_cache
+        if cache and cache.is_cacheable(kwargs):
+            result = cache.get(kwargs)
+            if result is None:
+                with self._api_lock:
+                    self._check_login()
+                    result = self._api_query(kwargs.copy())
+                cache.store(kwargs, result)
+            return result
+
         with self._api_lock:
-            return self._api_query(kwargs)
+            self._check_login()
+            result = self._api_query(kwargs)
+        if cache:
+            cache.invalidate_query(kwargs)
+        return result
 
     def sql_query(self, query, params=(), plain_query=False, dict_cursor=False,
                   cursor_class=None, show_table=False, buffsize=1024):
@@ -796,14 +989,22 @@ class Site(object):
         :meth:`_login` is called again); set *force* to ``True`` to force a new
         token to be fetched.
 
+        Once a token type has been asked for, the site remembers it: whenever
+        tokens are fetched (here, after logging in, or tacked onto other
+        ``action=query`` requests while any are missing), all of these types
+        are requested in one query.
+
         Raises :exc:`.APIError` if there was an API issue.
         """
         if action not in self.SPECIAL_TOKENS:
             action = "csrf"
-        if action in self._tokens and not force:
-            return self._tokens[action]
+        with self._api_lock:  # Queries read the set while holding it
+            self._wanted_tokens.add(action)
+            if action in self._tokens and not force:
+                return self._tokens[action]
+            types = self._get_token_types()
 
-        res = self.api_query(action="query", meta="tokens", type=action)
+        res = self.api_query(action="query", meta="tokens", type=types)
         if action not in self._tokens:
             err = "Tried to fetch a {0} token, but API returned: {1}"
             raise exceptions.APIError(err.format(action, res))
@@ -822,6 +1023,8 @@ class Site(object):
         Raises :py:exc:`~earwigbot.exceptions.NamespaceNotFoundError` if the ID
         is not found.
         """
+        if not self._attributes_loaded:
+            self._load_attributes()
         try:
             if all:
                 return self._namespaces[ns_id]
@@ -840,6 +1043,8 @@ class Site(object):
         Raises :py:exc:`~earwigbot.exceptions.NamespaceNotFoundError` if the
         name is not found.
         """
+        if not self._attributes_loaded:
+            self._load_attributes()
         lname = name.lower()
         for ns_id, names in self._namespaces.items():
             lnames = [n.lower() for n in names]  # Be case-insensitive
@@ -872,6 +1077,46 @@ class Site(object):
                                 self._logger)
         return Page(self, title, follow_redirects, pageid, self._logger)
 
+    def get_pages(self, titles, follow_redirects=False):
+        """Iterate over :py:class:`Page` objects for the given titles.
+
+        Unlike :py:meth:`get_page`, the pages are loaded from the API before
+        they are returned, with their content and basic attributes filled in
+        by a single query for every :py:const:`PAGE_BATCH_SIZE` titles. This
+        means :py:meth:`Page.get() <earwigbot.wiki.page.Page.get>` and
+        :py:meth:`Page.edit() <earwigbot.wiki.page.Page.edit>` can be called
+        on them without any further queries.
+
+        *titles* can be any iterable of page titles. Pages are yielded in the
+        same order as their titles, and duplicate titles are only yielded
+        once. Missing and invalid pages are yielded as well, so check
+        :py:attr:`~earwigbot.wiki.page.Page.exists` or catch the usual
+        exceptions from :py:meth:`~earwigbot.wiki.page.Page.get`.
+        *follow_redirects* works like it does for :py:meth:`get_page`.
+        """
+        def unique_titles(seen):
+            for title in titles:
+                title = self._unicodeify(title).strip()
+                if title not in seen:
+                    seen.add(title)
+                    yield title
+
+        remaining = unique_titles(set())
+        while True:
+            chunk = list(islice(remaining, self.PAGE_BATCH_SIZE))
+            if not chunk:
+                break
+            params = {"titles": u"|".join(chunk)}
+            for results, normalized in self._get_page_batches(params):
+                pages = {}
+                for result in results:
+                    page = self._make_loaded_page(result, follow_redirects)
+                    pages[page.title] = page
+                for title in chunk:
+                    page = pages.pop(normalized.get(title, title), None)
+                    if page:
+                        yield page
+
     def get_category(self, catname, follow_redirects=False, pageid=None):
         """Return a :py:class:`Category` object for the given category name.
 
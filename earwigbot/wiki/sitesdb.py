@@ -25,16 +25,24 @@ from cookielib import LWPCookieJar, LoadError
 import errno
 from os import chmod, path
 from platform import python_version
+import re
 import stat
+from Queue import Empty, Queue
 import sqlite3 as sqlite
+from threading import Lock, Thread
+from time import time
+from urlparse import urlparse
 
 from earwigbot import __version__
+from earwigbot.database import Database
 from earwigbot.exceptions import SiteNotFoundError
 from earwigbot.wiki.copyvios.exclusions import ExclusionsDB
 from earwigbot.wiki.site import Site
 
 __all__ = ["SitesDB"]
 
+_LOG_TARGET = re.compile(r"\[\[([^\]|]+)")
+
 class SitesDB(object):
     """
     **EarwigBot: Wiki Toolset: Sites Database Manager**
@@ -48,6 +56,9 @@ class SitesDB(object):
     - :py:meth:`add_site`:    stores a site in the database
     - :py:meth:`remove_site`: removes a site from the database
 
+    :py:meth:`warm_up` can also be used to log in to several sites at once
+    ahead of time.
+
     There's usually no need to use this class directly. All public methods
     here are available as :py:meth:`bot.wiki.get_site`,
     :py:meth:`bot.wiki.add_site`, and :py:meth:`bot.wiki.remove_site`, which
@@ -56,13 +67,20 @@ class SitesDB(object):
     the manager class (``from earwigbot.wiki import SitesDB``).
     """
 
+    WARMUP_WORKERS = 4
+
     def __init__(self, bot):
         """Set up the manager with an attribute for the base Bot object."""
         self.config = bot.config
         self._logger = bot.logger.getChild("wiki")
 
         self._sites = {}  # Internal site cache
+        self._sites_lock = Lock()
         self._sitesdb = path.join(bot.config.root_dir, "sites.db")
+        self._db = Database(self._sitesdb)
+        self._snapshot = None  # Contents of the sitesdb; see preload()
+        self._site_names = {}  # (project, lang) -> name of first such site
+        self._snapshot_lock = Lock()
         self._cookie_file = path.join(bot.config.root_dir, ".cookies")
         self._cookiejar = None
 
@@ -120,46 +138,36 @@ class SitesDB(object):
         CREATE TABLE sql_data (sql_site, sql_data_key, sql_data_value);
         CREATE TABLE namespaces (ns_site, ns_id, ns_name, ns_is_primary_name);
         """
-        with sqlite.connect(self._sitesdb) as conn:
+        with self._db.connect() as conn:
             conn.executescript(script)
 
     def _get_site_object(self, name):
         """Return the site from our cache, or create it if it doesn't exist.
 
         This is essentially just a wrapper around _make_site_object that
-        returns the same object each time a specific site is asked for.
+        returns the same object each time a specific site is asked for, even
+        from different threads, so they share a single login.
         """
         try:
             return self._sites[name]
         except KeyError:
-            site = self._make_site_object(name)
-            self._sites[name] = site
-            return site
+            pass
+        with self._sites_lock:
+            try:
+                return self._sites[name]
+            except KeyError:
+                site = self._make_site_object(name)
+                self._sites[name] = site
+                return site
 
-    def _load_site_from_sitesdb(self, name):
-        """Return all information stored in the sitesdb relating to given site.
+    @staticmethod
+    def _make_snapshot_entry(site_data, sql_data, ns_data):
+        """Build a snapshot entry from rows of the sitesdb's three tables.
 
-        The information will be returned as a tuple, containing the site's
-        name, project, language, base URL, article path, script path, SQL
-        connection data, and namespaces, in that order. If the site is not
-        found in the database, SiteNotFoundError will be raised. An empty
-        database will be created before the exception is raised if none exists.
+        *site_data* is the site's row in the ``sites`` table, and *sql_data*
+        and *ns_data* are its rows in ``sql_data`` and ``namespaces`` without
+        the site name column, in database order.
         """
-        query1 = "SELECT * FROM sites WHERE site_name = ?"
-        query2 = "SELECT sql_data_key, sql_data_value FROM sql_data WHERE sql_site = ?"
-        query3 = "SELECT ns_id, ns_name, ns_is_primary_name FROM namespaces WHERE ns_site = ?"
-        error = "Site '{0}' not found in the sitesdb.".format(name)
-        with sqlite.connect(self._sitesdb) as conn:
-            try:
-                site_data = conn.execute(query1, (name,)).fetchone()
-            except sqlite.OperationalError:
-                self._create_sitesdb()
-                raise SiteNotFoundError(error)
-            if not site_data:
-                raise SiteNotFoundError(error)
-            sql_data = conn.execute(query2, (name,)).fetchall()
-            ns_data = conn.execute(query3, (name,)).fetchall()
-
         name, project, lang, base_url, article_path, script_path = site_data
         sql = dict(sql_data)
         namespaces = {}
@@ -175,11 +183,87 @@ class SitesDB(object):
         return (name, project, lang, base_url, article_path, script_path, sql,
                 namespaces)
 
+    def _index_snapshot(self):
+        """Rebuild the (project, lang) -> name map from the snapshot."""
+        site_names = {}
+        for name, entry in self._snapshot.iteritems():
+            site_names.setdefault((entry[1], entry[2]), name)
+        self._site_names = site_names
+
+    def _get_snapshot(self):
+        """Return the in-memory copy of the sitesdb, loading it if needed.
+
+        The snapshot is an OrderedDict mapping site names to entries in the
+        same format returned by _load_site_from_sitesdb(), in database order.
+        The whole database is read in three queries the first time this is
+        called; after that, site lookups never touch the disk. Changes made
+        by _add_site_to_sitesdb() and _remove_site_from_sitesdb() are applied
+        to both. An empty database will be created if none exists.
+        """
+        if self._snapshot is not None:
+            return self._snapshot
+
+        query1 = "SELECT * FROM sites ORDER BY rowid"
+        query2 = "SELECT sql_site, sql_data_key, sql_data_value FROM sql_data"
+        query3 = """SELECT ns_site, ns_id, ns_name, ns_is_primary_name
+                    FROM namespaces ORDER BY rowid"""
+        with self._snapshot_lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            with self._db.connect() as conn:
+                try:
+                    sites_data = conn.execute(query1).fetchall()
+                except sqlite.OperationalError:
+                    self._create_sitesdb()
+                    sites_data, sql_data, ns_data = [], [], []
+                else:
+                    sql_data = conn.execute(query2).fetchall()
+                    ns_data = conn.execute(query3).fetchall()
+
+            sql_by_site, ns_by_site = {}, {}
+            for row in sql_data:
+                sql_by_site.setdefault(row[0], []).append(row[1:])
+            for row in ns_data:
+                ns_by_site.setdefault(row[0], []).append(row[1:])
+
+            snapshot = OrderedDict()
+            for site_data in sites_data:
+                name = site_data[0]
+                snapshot[name] = self._make_snapshot_entry(
+                    site_data, sql_by_site.get(name, []),
+                    ns_by_site.get(name, []))
+            self._snapshot = snapshot
+            self._index_snapshot()
+        return snapshot
+
+    def _load_site_from_sitesdb(self, name):
+        """Return all information stored in the sitesdb relating to given site.
+
+        The information will be returned as a tuple, containing the site's
+        name, project, language, base URL, article path, script path, SQL
+        connection data, and namespaces, in that order. If the site is not
+        found in the database, SiteNotFoundError will be raised. An empty
+        database will be created before the exception is raised if none exists.
+
+        This reads from the in-memory snapshot of the database; the SQL data
+        and namespaces returned are copies, so they can be safely modified.
+        """
+        try:
+            entry = self._get_snapshot()[name]
+        except KeyError:
+            error = "Site '{0}' not found in the sitesdb.".format(name)
+            raise SiteNotFoundError(error)
+
+        namespaces = dict((ns_id, list(ns_names))
+                          for ns_id, ns_names in entry[7].iteritems())
+        return entry[:6] + (dict(entry[6]), namespaces)
+
     def _make_site_object(self, name):
         """Return a Site object associated with the site *name* in our sitesdb.
 
         This calls _load_site_from_sitesdb(), so SiteNotFoundError will be
-        raised if the site is not in our sitesdb.
+        raised if the site is not in our sitesdb. The Site is lazy: it won't
+        log in or talk to the API until it is first used.
         """
         cookiejar = self._get_cookiejar()
         (name, project, lang, base_url, article_path, script_path, sql,
@@ -194,6 +278,7 @@ class SitesDB(object):
         wait_between_queries = config.wiki.get("waitTime", 2)
         logger = self._logger.getChild(name)
         search_config = config.wiki.get("search", OrderedDict()).copy()
+        cache_config = config.wiki.get("apiCache")
 
         if user_agent:
             user_agent = user_agent.replace("$1", __version__)
@@ -204,6 +289,11 @@ class SitesDB(object):
             search_config["nltk_dir"] = nltk_dir
             search_config["exclusions_db"] = self._exclusions_db
 
+        if cache_config is True:
+            cache_config = OrderedDict()
+        elif not cache_config:
+            cache_config = None
+
         if not sql:
             sql = config.wiki.get("sql", OrderedDict()).copy()
             for key, value in sql.iteritems():
@@ -216,7 +306,8 @@ class SitesDB(object):
                     cookiejar=cookiejar, user_agent=user_agent,
                     use_https=use_https, assert_edit=assert_edit,
                     maxlag=maxlag, wait_between_queries=wait_between_queries,
-                    logger=logger, search_config=search_config)
+                    logger=logger, search_config=search_config,
+                    cache_config=cache_config, lazy=True)
 
     def _get_site_name_from_sitesdb(self, project, lang):
         """Return the name of the first site with the given project and lang.
@@ -231,19 +322,16 @@ class SitesDB(object):
         If the site is not found, return None. An empty sitesdb will be created
         if none exists.
         """
-        query1 = "SELECT site_name FROM sites WHERE site_project = ? and site_lang = ?"
-        query2 = "SELECT site_name FROM sites WHERE site_base_url LIKE ?"
-        with sqlite.connect(self._sitesdb) as conn:
-            try:
-                site = conn.execute(query1, (project, lang)).fetchone()
-                if site:
-                    return site[0]
-                else:
-                    url = "//{0}.{1}.%".format(lang, project)
-                    site = conn.execute(query2, (url,)).fetchone()
-                    return site[0] if site else None
-            except sqlite.OperationalError:
-                self._create_sitesdb()
+        snapshot = self._get_snapshot()
+        name = self._site_names.get((project, lang))
+        if name:
+            return name
+
+        prefix = "//{0}.{1}.".format(lang, project).lower()
+        for name, entry in snapshot.iteritems():
+            if entry[3] and entry[3].lower().startswith(prefix):
+                return name
+        return None
 
     def _add_site_to_sitesdb(self, site):
         """Extract relevant info from a Site object and add it to the sitesdb.
@@ -263,7 +351,7 @@ class SitesDB(object):
             for ns_name in ns_names:
                 ns_data.append((name, ns_id, ns_name, False))
 
-        with sqlite.connect(self._sitesdb) as conn:
+        with self._db.connect() as conn:
             check_exists = "SELECT 1 FROM sites WHERE site_name = ?"
             try:
                 exists = conn.execute(check_exists, (name,)).fetchone()
@@ -278,6 +366,15 @@ class SitesDB(object):
             conn.executemany("INSERT INTO sql_data VALUES (?, ?, ?)", sql_data)
             conn.executemany("INSERT INTO namespaces VALUES (?, ?, ?, ?)", ns_data)
 
+        with self._snapshot_lock:
+            if self._snapshot is not None:
+                entry = self._make_snapshot_entry(
+                    sites_data, [row[1:] for row in sql_data],
+                    [row[1:] for row in ns_data])
+                self._snapshot.pop(name, None)
+                self._snapshot[name] = entry
+                self._index_snapshot()
+
     def _remove_site_from_sitesdb(self, name):
         """Remove a site by name from the sitesdb and the internal cache."""
         try:
@@ -285,7 +382,12 @@ class SitesDB(object):
         except KeyError:
             pass
 
-        with sqlite.connect(self._sitesdb) as conn:
+        with self._snapshot_lock:
+            if self._snapshot is not None:
+                if self._snapshot.pop(name, None):
+                    self._index_snapshot()
+
+        with self._db.connect() as conn:
             cursor = conn.execute("DELETE FROM sites WHERE site_name = ?", (name,))
             if cursor.rowcount == 0:
                 return False
@@ -295,6 +397,39 @@ class SitesDB(object):
                 self._logger.info("Removed site '{0}'".format(name))
                 return True
 
+    def _after_fork(self):
+        """Forget our loaded sites in a newly forked child process.
+
+        Sites are then made again, with connections of their own, as they are
+        used. Locks are replaced in case another thread of the parent process
+        held them when it forked.
+        """
+        self._sites = {}
+        self._sites_lock = Lock()
+        self._snapshot_lock = Lock()
+        self._exclusions_db._after_fork()
+
+    def process_rc(self, rc):
+        """Update loaded sites in response to a recent change event.
+
+        This is called by the IRC watcher for every :py:class:`~.RC` event it
+        receives. If the event belongs to a site we have loaded, cached API
+        results referring to the changed page or the user who changed it are
+        invalidated. For log events (deletions, moves, and so on), whose page
+        is only ``Special:Log/...``, the pages linked from the log entry (like
+        a move's source and target) are invalidated too.
+        """
+        sites = [site for site in self._sites.values() if site._api_cache]
+        if not sites:
+            return
+        domain = urlparse(rc.url).netloc
+        names = [rc.page, rc.user]
+        if not rc.is_edit:
+            names += _LOG_TARGET.findall(rc.comment)
+        for site in sites:
+            if site.domain == domain:
+                site._api_cache.invalidate(*names)
+
     def get_site(self, name=None, project=None, lang=None):
         """Return a Site instance based on information from the sitesdb.
 
@@ -436,3 +571,68 @@ class SitesDB(object):
                 return self._remove_site_from_sitesdb(name)
 
         return False
+
+    def _warm_up_site(self, name):
+        """Load a site, log in, and fetch a token; return the time taken."""
+        start = time()
+        site = self.get_site(name)
+        site.get_token()
+        return time() - start
+
+    def preload(self):
+        """Read the sitesdb into memory now, instead of on first use.
+
+        The bot calls this at startup from a background thread, so the first
+        :py:meth:`get_site` made by a command or task doesn't have to. It does
+        nothing if the sitesdb doesn't exist yet.
+        """
+        if path.exists(self._sitesdb):
+            self._get_snapshot()
+
+    def warm_up(self, names, workers=None):
+        """Get the given sites ready for use, several at a time.
+
+        Each site in the list *names* is loaded, logged in to, and given a
+        CSRF token with :py:meth:`Site.get_token()
+        <earwigbot.wiki.site.Site.get_token>`, so later requests don't pay for
+        these. Up to *workers* sites (default :py:attr:`WARMUP_WORKERS`) are
+        warmed up at the same time. Each site's result is logged; failures
+        don't stop the others.
+
+        This blocks until every site is done, and returns a dict mapping the
+        names of the sites that are ready to the seconds each took.
+        """
+        queue = Queue()
+        for name in names:
+            queue.put(name)
+        ready = {}
+
+        def worker():
+            while True:
+                try:
+                    name = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    ready[name] = elapsed = self._warm_up_site(name)
+                except Exception as exc:
+                    log = u"Couldn't warm up site '{0}': {1}: {2}"
+                    self._logger.warn(log.format(
+                        name, type(exc).__name__, exc))
+                else:
+                    log = "Site '{0}' is ready ({1:.2f} seconds)"
+                    self._logger.info(log.format(name, elapsed))
+
+        start = time()
+        count = min(workers or self.WARMUP_WORKERS, len(names))
+        threads = [Thread(target=worker, name="wiki:warmup")
+                   for _ in xrange(count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        log = "Warmed up {0}/{1} sites in {2:.2f} seconds"
+        self._logger.info(log.format(len(ready), len(names), time() - start))
+        return ready
@@ -0,0 +1,195 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from earwigbot.irc import RC
+from earwigbot.wiki import SitesDB, cache
+from earwigbot.wiki.cache import APICache
+
+class FakeConfig(object):
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+class FakeBot(object):
+    def __init__(self, root_dir):
+        self.config = FakeConfig(root_dir)
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+
+class FakeSite(object):
+    domain = "en.wikipedia.org"
+
+    def __init__(self):
+        self._api_cache = APICache()
+
+class TestAPICache(unittest.TestCase):
+    """Test cases for the API response cache."""
+
+    def setUp(self):
+        self.now = 1000.0
+        self._time = cache.time
+        cache.time = lambda: self.now
+
+    def tearDown(self):
+        cache.time = self._time
+
+    @staticmethod
+    def page_query(title):
+        return {"action": "query", "prop": "info", "titles": title}
+
+    @staticmethod
+    def page_result(title):
+        return {"query": {"pages": {"1": {"title": title}}}}
+
+    def test_cacheable(self):
+        apicache = APICache({"query": 30, "edit": 30})
+        self.assertTrue(apicache.is_cacheable(self.page_query("Foo")))
+        self.assertFalse(apicache.is_cacheable({"action": "parse"}))
+        self.assertFalse(apicache.is_cacheable({"action": "edit"}))
+        tokens = {"action": "query", "meta": "userinfo|tokens"}
+        self.assertFalse(apicache.is_cacheable(tokens))
+
+    def test_get_store(self):
+        apicache = APICache()
+        params = self.page_query("Foo")
+        self.assertIs(None, apicache.get(params))
+        apicache.store(params, self.page_result("Foo"))
+        self.assertEqual(self.page_result("Foo"), apicache.get(params))
+        self.assertEqual(self.page_result("Foo"),
+                         apicache.get(self.page_query("Foo").copy()))
+        self.assertIs(None, apicache.get(self.page_query("Bar")))
+
+        result = apicache.get(params)
+        result["query"]["pages"]["1"]["title"] = "Changed"
+        self.assertEqual(self.page_result("Foo"), apicache.get(params))
+
+    def test_ttl(self):
+        apicache = APICache({"query": 30})
+        params = self.page_query("Foo")
+        apicache.store(params, self.page_result("Foo"))
+        self.now += 30
+        self.assertEqual(self.page_result("Foo"), apicache.get(params))
+        self.now += 1
+        self.assertIs(None, apicache.get(params))
+        self.assertEqual("<APICache of 0 entries (0 bytes)>", str(apicache))
+
+    def test_eviction(self):
+        size = len('{"query": {"pages": {"1": {"title": "A"}}}}')
+        apicache = APICache(max_size=size * 2)
+        apicache.store(self.page_query("A"), self.page_result("A"))
+        apicache.store(self.page_query("B"), self.page_result("B"))
+        apicache.get(self.page_query("A"))  # A is now more recent than B
+        apicache.store(self.page_query("C"), self.page_result("C"))
+        self.assertIsNot(None, apicache.get(self.page_query("A")))
+        self.assertIs(None, apicache.get(self.page_query("B")))
+        self.assertIsNot(None, apicache.get(self.page_query("C")))
+
+        apicache.store(self.page_query("Large"), {"data": "x" * size * 2})
+        self.assertIs(None, apicache.get(self.page_query("Large")))
+        self.assertIsNot(None, apicache.get(self.page_query("A")))
+
+    def test_invalidate(self):
+        apicache = APICache()
+        multi = self.page_query("Foo|Bar")
+        apicache.store(self.page_query("Foo"), self.page_result("Foo"))
+        apicache.store(self.page_query("Baz"), self.page_result("Baz"))
+        apicache.store(multi, {})
+        apicache.invalidate("foo")
+        self.assertIs(None, apicache.get(self.page_query("Foo")))
+        self.assertIs(None, apicache.get(multi))
+        self.assertIsNot(None, apicache.get(self.page_query("Baz")))
+
+        apicache.store({"action": "query", "pageids": 7},
+                       self.page_result("Some page"))
+        apicache.invalidate("Some_page")
+        self.assertIs(None, apicache.get({"action": "query", "pageids": 7}))
+
+    def test_invalidate_query(self):
+        apicache = APICache()
+        apicache.store(self.page_query("Foo"), self.page_result("Foo"))
+        apicache.invalidate_query(self.page_query("Foo"))
+        self.assertIsNot(None, apicache.get(self.page_query("Foo")))
+        apicache.invalidate_query({"action": "edit", "title": "Foo"})
+        self.assertIs(None, apicache.get(self.page_query("Foo")))
+
+    def test_clear(self):
+        apicache = APICache()
+        apicache.store(self.page_query("Foo"), self.page_result("Foo"))
+        apicache.clear()
+        self.assertIs(None, apicache.get(self.page_query("Foo")))
+        self.assertEqual("<APICache of 0 entries (0 bytes)>", str(apicache))
+
+
+class TestRCInvalidation(unittest.TestCase):
+    """Test cases for invalidating cached results from IRC watcher events."""
+
+    EDIT = ("\x0314[[\x0307{0}\x0314]]\x034 M\x0310 \x0302https://"
+            "en.wikipedia.org/w/index.php?diff=2&oldid=1\x03 \x035*\x03 "
+            "\x0303Bar\x03 \x035*\x03 (+1) \x0310Summary\x03")
+    MOVE = ("\x0314[[\x0307Special:Log/move\x0314]]\x034 move\x0310 "
+            "\x0302\x03 \x035*\x03 \x0303Admin\x03 \x035*\x03  \x0310moved "
+            "[[\x0302{0}\x0310]] to [[{1}]]: Typo\x03")
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.sitesdb = SitesDB(FakeBot(self.root))
+        self.site = FakeSite()
+        self.sitesdb._sites["enwiki"] = self.site
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def process(self, chan, msg):
+        rc = RC(chan, msg)
+        rc.parse()
+        self.sitesdb.process_rc(rc)
+
+    def store(self, *titles):
+        for title in titles:
+            params = {"action": "query", "titles": title}
+            self.site._api_cache.store(params, {})
+
+    def cached(self, title):
+        params = {"action": "query", "titles": title}
+        return self.site._api_cache.get(params) is not None
+
+    def test_edit(self):
+        self.store("Foo", "Other")
+        self.process("#en.wikipedia", self.EDIT.format("Foo"))
+        self.process("#de.wikipedia", self.EDIT.format("Other").replace(
+            "en.wikipedia", "de.wikipedia"))
+        self.assertFalse(self.cached("Foo"))
+        self.assertTrue(self.cached("Other"))
+
+    def test_log(self):
+        self.store("Foo", "Foo bar", "Other")
+        self.process("#en.wikipedia", self.MOVE.format("Foo", "Foo bar"))
+        self.assertFalse(self.cached("Foo"))
+        self.assertFalse(self.cached("Foo bar"))
+        self.assertTrue(self.cached("Other"))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
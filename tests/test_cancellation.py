@@ -0,0 +1,115 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from threading import Thread, Timer
+from time import time
+import unittest
+
+from earwigbot import cancellation
+from earwigbot.cancellation import CancelToken
+from earwigbot.exceptions import CancelledError
+
+class TestCancelToken(unittest.TestCase):
+    """Test cases for cancellation tokens."""
+
+    def tearDown(self):
+        cancellation.set_token(None)
+
+    def test_cancel(self):
+        token = CancelToken()
+        self.assertFalse(token.cancelled)
+        token.check()
+        self.assertEqual("<CancelToken (active)>", str(token))
+        token.cancel()
+        token.cancel()
+        self.assertTrue(token.cancelled)
+        self.assertRaises(CancelledError, token.check)
+        self.assertEqual("<CancelToken (cancelled)>", str(token))
+
+    def test_children(self):
+        parent = CancelToken()
+        child, other = CancelToken(parent), CancelToken(parent)
+        grandchild = CancelToken(child)
+        child.cancel()
+        self.assertTrue(grandchild.cancelled)
+        self.assertFalse(parent.cancelled)
+        self.assertFalse(other.cancelled)
+
+        parent.cancel()
+        self.assertTrue(other.cancelled)
+        self.assertTrue(CancelToken(parent).cancelled)
+
+    def test_callbacks(self):
+        calls = []
+        token = CancelToken(CancelToken())
+        token.add_callback(lambda: calls.append(1))
+        token.add_callback(lambda: calls.append(2))
+        self.assertEqual([], calls)
+        token.cancel()
+        token.cancel()
+        self.assertEqual([1, 2], calls)
+        token.add_callback(lambda: calls.append(3))
+        self.assertEqual([1, 2, 3], calls)
+
+    def test_wait(self):
+        token = CancelToken()
+        self.assertFalse(token.wait(0.01))
+        timer = Timer(0.05, token.cancel)
+        timer.start()
+        self.assertTrue(token.wait(5))
+        timer.join()
+
+    def test_current_token(self):
+        self.assertIs(None, cancellation.get_token())
+        cancellation.check()
+        token = CancelToken()
+        self.assertIs(None, cancellation.set_token(token))
+        self.assertIs(token, cancellation.get_token())
+
+        seen = []
+        thread = Thread(target=lambda: seen.append(cancellation.get_token()))
+        thread.start()
+        thread.join()
+        self.assertEqual([None], seen)
+
+        token.cancel()
+        self.assertRaises(CancelledError, cancellation.check)
+        self.assertIs(token, cancellation.set_token(None))
+        cancellation.check()
+
+    def test_sleep(self):
+        start = time()
+        cancellation.sleep(0.01)
+        self.assertTrue(time() - start >= 0.01)
+
+        token = CancelToken()
+        cancellation.set_token(token)
+        cancellation.sleep(0.01)
+        timer = Timer(0.05, token.cancel)
+        timer.start()
+        start = time()
+        self.assertRaises(CancelledError, cancellation.sleep, 30)
+        self.assertTrue(time() - start < 5)
+        timer.join()
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from earwigbot.tasks import Checkpoint, Task
+
+class FakeConfig(object):
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+class FakeTask(object):
+    name = "fake"
+    logger = None
+
+    def __init__(self, root_dir):
+        self.config = FakeConfig(root_dir)
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Test cases for resumable task checkpoints."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.filename = path.join(self.root, "task.log")
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_resume(self):
+        checkpoint = Checkpoint(self.filename)
+        checkpoint.mark_done("pages", "Foo")
+        checkpoint.mark_done("pages", "Bar")
+        checkpoint.mark_done("users", "Foo")
+        checkpoint.set_token("offset", 10)
+        checkpoint.set_token("offset", {"continue": "Baz"})
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.filename)
+        self.assertEqual({"Foo", "Bar"}, checkpoint.get_done("pages"))
+        self.assertTrue(checkpoint.is_done("users", "Foo"))
+        self.assertFalse(checkpoint.is_done("users", "Bar"))
+        self.assertEqual(set(), checkpoint.get_done("missing"))
+        self.assertEqual({"continue": "Baz"}, checkpoint.get_token("offset"))
+        self.assertEqual(5, checkpoint.get_token("missing", 5))
+        checkpoint.close()
+
+    def test_buffering(self):
+        checkpoint = Checkpoint(self.filename)
+        checkpoint.mark_done("pages", "Foo")
+        self.assertFalse(path.exists(self.filename))
+        for i in xrange(Checkpoint.FLUSH_SIZE):
+            checkpoint.mark_done("pages", i)
+        self.assertEqual(Checkpoint.FLUSH_SIZE,
+                         len(Checkpoint(self.filename).get_done("pages")))
+        checkpoint.close()
+        self.assertEqual(Checkpoint.FLUSH_SIZE + 1,
+                         len(Checkpoint(self.filename).get_done("pages")))
+
+    def test_complete(self):
+        checkpoint = Checkpoint(self.filename)
+        checkpoint.mark_done("pages", "Foo")
+        checkpoint.flush()
+        checkpoint.close(complete=True)
+        self.assertFalse(path.exists(self.filename))
+        self.assertEqual(set(), Checkpoint(self.filename).get_done("pages"))
+
+    def test_partial_line(self):
+        with open(self.filename, "w") as fp:
+            fp.write('["done", "pages", "Foo"]\n')
+            fp.write('not json\n')
+            fp.write('["done", "pages", "Bar"]\n')
+            fp.write('["done", "pa')
+
+        checkpoint = Checkpoint(self.filename)
+        self.assertEqual({"Foo", "Bar"}, checkpoint.get_done("pages"))
+        checkpoint.mark_done("pages", "Baz")
+        checkpoint.close()
+
+        with open(self.filename) as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual('["done", "pages", "Baz"]', lines[-1])
+        self.assertEqual(4, len(lines))
+        checkpoint = Checkpoint(self.filename)
+        self.assertEqual({"Foo", "Bar", "Baz"}, checkpoint.get_done("pages"))
+
+    def test_task_key(self):
+        task = FakeTask(self.root)
+        get_checkpoint = Task.get_checkpoint.im_func
+        first = get_checkpoint(task, {"page": "Foo", "_IRCCallback": 1})
+        second = get_checkpoint(task, {"page": "Foo", "_private": object()})
+        third = get_checkpoint(task, {"page": "Bar"})
+        self.assertEqual(first.filename, second.filename)
+        self.assertNotEqual(first.filename, third.filename)
+        self.assertEqual(path.join(self.root, "checkpoints"),
+                         path.dirname(first.filename))
+        self.assertTrue(path.basename(first.filename).startswith("fake-"))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
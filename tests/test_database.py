@@ -0,0 +1,102 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+import unittest
+
+from earwigbot import database
+from earwigbot.database import Database
+
+class TestDatabase(unittest.TestCase):
+    """Test cases for per-thread SQLite connections."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.db = Database(path.join(self.root, "test.db"))
+        with self.db.connect() as conn:
+            conn.execute("CREATE TABLE items (value)")
+
+    def tearDown(self):
+        self.db.close()
+        rmtree(self.root)
+
+    def in_thread(self, func):
+        """Call *func* in a new thread and return its result."""
+        result = []
+        thread = Thread(target=lambda: result.append(func()))
+        thread.start()
+        thread.join(5)
+        return result[0]
+
+    def test_connect(self):
+        conn = self.db.connect()
+        self.assertIs(conn, self.db.connect())
+        other = self.in_thread(self.db.connect)
+        self.assertIsNot(conn, other)
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual("wal", mode)
+
+    def test_context(self):
+        with self.db.connect() as conn:
+            conn.execute("INSERT INTO items VALUES (1)")
+        try:
+            with self.db.connect() as conn:
+                conn.execute("INSERT INTO items VALUES (2)")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        query = lambda: self.db.connect().execute(
+            "SELECT value FROM items").fetchall()
+        self.assertEqual([(1,)], query())
+        self.assertEqual([(1,)], self.in_thread(query))
+
+    def test_reader_during_write(self):
+        conn = self.db.connect()
+        conn.execute("INSERT INTO items VALUES (1)")  # Open transaction
+        count = lambda: self.db.connect().execute(
+            "SELECT COUNT(*) FROM items").fetchone()[0]
+        self.assertEqual(0, self.in_thread(count))
+        conn.commit()
+        self.assertEqual(1, self.in_thread(count))
+
+    def test_close(self):
+        conn = self.db.connect()
+        self.db.close()
+        self.db.close()
+        self.assertIsNot(conn, self.db.connect())
+
+    def test_fork(self):
+        conn = self.db.connect()
+        getpid = database.getpid
+        database.getpid = lambda: getpid() + 1
+        try:
+            child = self.db.connect()
+            self.assertIsNot(conn, child)
+            self.assertIs(child, self.db.connect())
+        finally:
+            database.getpid = getpid
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import unittest
+
+from earwigbot.commands import Command
+from earwigbot.irc import Data, RC
+from earwigbot.managers import CommandManager
+
+class Named(Command):
+    name = "named"
+    commands = ["named", "n"]
+
+class Shadowed(Command):
+    name = "shadowed"
+    commands = ["n"]
+
+class Everything(Command):
+    name = "everything"
+    hooks = ["msg", "join"]
+
+    def check(self, data):
+        return data.msg == "everything"
+
+class RCDefault(Command):
+    name = "rcdefault"
+    hooks = ["rc"]
+
+class RCCustom(Command):
+    name = "rccustom"
+    hooks = ["rc"]
+
+    def check(self, data):
+        return data.page == "Foo"
+
+class FakeConfig(object):
+    def __init__(self):
+        self.commands = {"workers": 0}
+        self.irc = {"frontend": {"quiet": {"#quiet": ["msg"]}}}
+
+class FakeBot(object):
+    def __init__(self):
+        self.config = FakeConfig()
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.commands = CommandManager(self)
+
+class FakeExecutor(object):
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, command, data):
+        self.submitted.append((command.name, data))
+
+
+class TestDispatch(unittest.TestCase):
+    """Test cases for finding which command handles an IRC event."""
+
+    def setUp(self):
+        self.bot = FakeBot()
+        self.manager = self.bot.commands
+        for klass in (Everything, Named, Shadowed, RCDefault, RCCustom):
+            self.manager._resources[klass.name] = klass(self.bot)
+        self.manager._build_dispatch()
+        self.executor = FakeExecutor()
+        self.manager._get_rc_executor = lambda: self.executor
+
+    def dispatched(self):
+        names = []
+        while not self.manager._jobs.empty():
+            _, _, (command, _) = self.manager._jobs.get()
+            names.append(command.name)
+        return names
+
+    def make_msg(self, chan, msg):
+        line = ":Foo!bar@example.com PRIVMSG {0} :{1}".format(chan, msg)
+        return Data("EarwigBot", line.split(), "PRIVMSG")
+
+    def test_names(self):
+        self.manager.call("msg", self.make_msg("#chan", "!named arg"))
+        self.manager.call("msg", self.make_msg("#chan", "!n"))
+        self.manager.call("msg", self.make_msg("#chan", "EarwigBot: n"))
+        self.manager.call("msg", self.make_msg("#chan", "named"))
+        self.manager.call("msg", self.make_msg("#chan", "!missing"))
+        self.manager.call("msg_public", self.make_msg("#chan", "!named"))
+        first = [command.name for command in self.manager._resources.values()
+                 if command.name in ("named", "shadowed")][0]
+        self.assertEqual(["named", first, first], self.dispatched())
+
+    def test_checked(self):
+        self.manager.call("msg", self.make_msg("#chan", "everything"))
+        self.manager.call("msg", self.make_msg("#quiet", "everything"))
+        line = ":Foo!bar@example.com JOIN :#chan".split()
+        self.manager.call("join", Data("EarwigBot", line, "JOIN"))
+        self.assertEqual(["everything"], self.dispatched())
+
+    def test_rc(self):
+        msg = ("\x0314[[\x0307Foo\x0314]]\x034 M\x0310 \x0302https://"
+               "en.wikipedia.org/w/index.php?diff=2&oldid=1\x03 \x035*\x03 "
+               "\x0303Bar\x03 \x035*\x03 (+1) \x0310Summary\x03")
+        rc = RC("#en.wikipedia", msg)
+        rc.parse()
+        self.manager.call("rc", rc)
+        self.assertEqual([("rccustom", rc)], self.executor.submitted)
+
+        other = RC("#en.wikipedia", msg.replace("Foo", "Baz"))
+        other.parse()
+        self.manager.call("rc", other)
+        self.assertEqual(1, len(self.executor.submitted))
+        self.assertEqual([], self.dispatched())
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
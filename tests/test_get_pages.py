@@ -0,0 +1,128 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import unittest
+
+from earwigbot.wiki import Site
+
+class ScriptedSite(Site):
+    """A Site that answers API queries from a list of canned responses."""
+
+    def __init__(self, responses):
+        super(ScriptedSite, self).__init__(
+            name="testwiki", project="wikipedia", lang="en",
+            base_url="//test.wikipedia.org", article_path="/wiki/$1",
+            script_path="/w", namespaces={0: [u""], 1: [u"Talk"],
+                                          14: [u"Category"]},
+            lazy=True)
+        self._attributes_loaded = True
+        self.PAGE_BATCH_SIZE = 2
+        self.responses = list(responses)
+        self.queries = []
+
+    def api_query(self, **kwargs):
+        self.queries.append(kwargs)
+        return self.responses.pop(0)
+
+def page(pageid, title, content=None, **extra):
+    """Return the API data for one page, with its content if given."""
+    data = {"title": title, "ns": 0, "fullurl": "url", "protection": []}
+    data.update(extra)
+    if content is not None:
+        data["revisions"] = [{"*": content, "timestamp": "T" + content}]
+    return str(pageid), data
+
+def response(pages=(), cont=None, **query):
+    """Return an API response holding the given pages."""
+    query["pages"] = dict(pages)
+    result = {"query": query}
+    if cont:
+        result["continue"] = cont
+    return result
+
+class TestGetPages(unittest.TestCase):
+    """Test cases for loading page content in batches."""
+
+    def test_batches(self):
+        site = ScriptedSite([
+            response([page(2, "B", "b"), page(1, "A", "a")]),
+            response([page(3, "C", "c")])
+        ])
+        pages = list(site.get_pages(["A", "B", "C"]))
+        self.assertEqual(["A", "B", "C"], [p.title for p in pages])
+        self.assertEqual(["a", "b", "c"], [p.get() for p in pages])
+        self.assertEqual("Tc", pages[2]._basetimestamp)
+        self.assertIsNot(None, pages[2]._starttimestamp)
+        self.assertEqual(["A|B", "C"], [q["titles"] for q in site.queries])
+        self.assertEqual("content|timestamp", site.queries[0]["rvprop"])
+        self.assertEqual([], site.responses)
+
+    def test_rvcontinue(self):
+        site = ScriptedSite([
+            response([page(1, "A", "a"), page(2, "B")],
+                     cont={"rvcontinue": "2|5", "continue": "||"}),
+            response([page(1, "A"), page(2, "B", "b")])
+        ])
+        pages = list(site.get_pages(["A", "B"]))
+        self.assertEqual(["a", "b"], [p.get() for p in pages])
+        self.assertEqual("2|5", site.queries[1]["rvcontinue"])
+        self.assertEqual("||", site.queries[1]["continue"])
+
+    def test_normalized(self):
+        site = ScriptedSite([
+            response([page(1, "Foo", "foo"), page(2, "B", "b")],
+                     normalized=[{"from": "foo", "to": "Foo"}])
+        ])
+        pages = list(site.get_pages(["B", "foo", "B"]))
+        self.assertEqual(["B", "Foo"], [p.title for p in pages])
+
+    def test_missing(self):
+        site = ScriptedSite([
+            response([page(-1, "Gone", missing=""),
+                      page(-2, "Bad<", invalid="")])
+        ])
+        pages = list(site.get_pages(["Gone", "Bad<"]))
+        self.assertEqual([pages[0].PAGE_MISSING, pages[1].PAGE_INVALID],
+                         [p.exists for p in pages])
+
+    def test_redirects(self):
+        site = ScriptedSite([
+            response([page(1, "R", "#REDIRECT [[T]]", redirect="")])
+        ])
+        redirect = list(site.get_pages(["R"], follow_redirects=True))[0]
+        self.assertEqual(redirect.PAGE_UNKNOWN, redirect._exists)
+        self.assertIs(None, redirect._content)
+
+    def test_category(self):
+        site = ScriptedSite([
+            response([page(1, "A", "a"), page(2, "B", "b")],
+                     cont={"gcmcontinue": "C", "continue": "gcmcontinue||"}),
+            response([page(3, "C", "c"), page(4, "D", "d")])
+        ])
+        category = site.get_category("Foo")
+        members = list(category.get_members(limit=3, content=True))
+        self.assertEqual(["a", "b", "c"], [p.get() for p in members])
+        self.assertEqual("Category:Foo", site.queries[0]["gcmtitle"])
+        self.assertEqual("C", site.queries[1]["gcmcontinue"])
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import random
+from threading import Event, Lock
+from time import sleep, time
+import unittest
+
+from earwigbot.managers import _HookExecutor
+
+class FakeCommand(object):
+    def __init__(self, name, block=False):
+        self.name = name
+        self.seen = []
+        self.running = 0
+        self.overlapped = False
+        self.started = Event()
+        self.release = Event()
+        if not block:
+            self.release.set()
+        self._lock = Lock()
+
+    def process(self, data):
+        with self._lock:
+            self.running += 1
+            self.overlapped |= self.running > 1
+        self.started.set()
+        self.release.wait()
+        with self._lock:
+            self.seen.append(data)
+            self.running -= 1
+
+class FakeManager(object):
+    IDLE_WORKER = "idle"
+    logger = logging.getLogger("earwigbot.test")
+    logger.addHandler(logging.NullHandler())
+
+    def _resolve(self, command):
+        return command
+
+    def _wrap_process(self, command, data):
+        command.process(data)
+
+
+class TestHookExecutor(unittest.TestCase):
+    """Test cases for the bounded hook executor and its overflow policies."""
+
+    def wait_for(self, predicate, timeout=5):
+        end = time() + timeout
+        while not predicate():
+            if time() > end:
+                self.fail("Timed out waiting for the executor")
+            sleep(0.01)
+
+    def test_drop_oldest(self):
+        executor = _HookExecutor(FakeManager(), "msg", 1, 3, "drop-oldest")
+        command = FakeCommand("slow", block=True)
+        executor.submit(command, 0)
+        self.assertTrue(command.started.wait(5))
+        for i in xrange(1, 6):
+            executor.submit(command, i)
+        stats = executor.stats()["slow"]
+        self.assertEqual(3, stats["depth"])
+        self.assertEqual(2, stats["dropped"])
+
+        command.release.set()
+        self.wait_for(lambda: executor.stats()["slow"]["processed"] == 4)
+        self.assertEqual([0, 3, 4, 5], command.seen)
+        self.assertEqual(3, executor.stats()["slow"]["peak"])
+
+    def test_sample(self):
+        random.seed(0)
+        executor = _HookExecutor(FakeManager(), "msg", 0, 3, "sample")
+        command = FakeCommand("sampled")
+        for i in xrange(1000):
+            executor.submit(command, i)
+        stats = executor.stats()["sampled"]
+        self.assertEqual(3, stats["depth"])
+        self.assertEqual(997, stats["dropped"])
+
+        events = [data for _, data in executor._queues["sampled"]["events"]]
+        self.assertEqual(3, len(set(events)))
+        self.assertTrue(all(0 <= data < 1000 for data in events))
+        self.assertTrue(any(data >= 3 for data in events))
+
+    def test_isolation(self):
+        executor = _HookExecutor(FakeManager(), "msg", 2, 10, "drop-oldest")
+        slow, fast = FakeCommand("slow", block=True), FakeCommand("fast")
+        for i in xrange(5):
+            executor.submit(slow, i)
+        self.assertTrue(slow.started.wait(5))
+        for i in xrange(5):
+            executor.submit(fast, i)
+        self.wait_for(lambda: len(fast.seen) == 5)
+        self.assertEqual([], slow.seen)
+        self.assertEqual(4, executor.stats()["slow"]["depth"])
+
+        slow.release.set()
+        self.wait_for(lambda: len(slow.seen) == 5)
+        self.assertEqual(range(5), slow.seen)
+        self.assertFalse(slow.overlapped)
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, _HookExecutor, FakeManager(), "msg",
+                          1, 3, "drop-newest")
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
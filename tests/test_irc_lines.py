@@ -0,0 +1,161 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import pickle
+import unittest
+
+from earwigbot.irc import Data, IRCConnection, RC
+from earwigbot.irc.connection import _Line
+
+class FramingConnection(IRCConnection):
+    def __init__(self, chunks):
+        logger = logging.getLogger("earwigbot.test")
+        logger.addHandler(logging.NullHandler())
+        super(FramingConnection, self).__init__(
+            "irc.example.com", 6667, "EarwigBot", "earwig", "Earwig", logger)
+        self._chunks = list(chunks)
+        self.lines = []
+
+    def _get(self, size=4096):
+        return self._chunks.pop(0)
+
+    def _process_message(self, line):
+        self.lines.append(list(line))
+
+
+class TestLine(unittest.TestCase):
+    """Test cases for lazily split IRC lines."""
+
+    RAW = ":Foo!bar@example.com PRIVMSG #channel :!help  me please"
+
+    def test_head(self):
+        line = _Line(self.RAW)
+        self.assertEqual(":Foo!bar@example.com", line[0])
+        self.assertEqual("PRIVMSG", line[1])
+        self.assertIs(None, line._words)
+        self.assertEqual("#channel", line[2])
+        self.assertEqual(self.RAW.split(), line.words)
+        self.assertEqual(self.RAW.split()[3:], line[3:])
+        self.assertEqual(len(self.RAW.split()), len(line))
+        self.assertEqual(self.RAW.split(), list(line))
+        self.assertEqual(["PING"], list(_Line("PING")))
+        self.assertEqual("PING", _Line("PING")[0])
+
+    def test_pickle(self):
+        line = _Line(self.RAW)
+        line[1]
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(line, protocol))
+            self.assertEqual(self.RAW, copy.raw)
+            self.assertEqual(line.words, copy.words)
+
+    def test_framing(self):
+        conn = FramingConnection([
+            ":a PRIVMSG #x :one\r\n:a PRI", "VMSG #x :two\r\n\r\n",
+            "  \r\n:a PRIVMSG #x :three", "\r\n"])
+        for i in xrange(4):
+            self.assertTrue(conn._handle_read())
+        self.assertEqual([[":a", "PRIVMSG", "#x", ":one"],
+                          [":a", "PRIVMSG", "#x", ":two"],
+                          [":a", "PRIVMSG", "#x", ":three"]], conn.lines)
+        self.assertEqual(0, len(conn._read_buffer))
+
+    def test_ping(self):
+        conn = FramingConnection(["PING :irc.example.com\r\n"])
+        conn._handle_read()
+        queued = [entry[1] for entry in conn._queues[conn.PRIORITY_PROTOCOL]]
+        self.assertEqual(["PONG irc.example.com"], queued)
+
+
+class TestData(unittest.TestCase):
+    """Test cases for parsing lines from the IRC frontend."""
+
+    def make(self, target, msg, msgtype="PRIVMSG"):
+        raw = ":Foo!bar@example.com {0} {1} :{2}".format(msgtype, target, msg)
+        return Data("EarwigBot", _Line(raw), msgtype)
+
+    def test_command(self):
+        data = self.make("#channel", "!Help  me key=value")
+        self.assertEqual(("Foo", "bar", "example.com"),
+                         (data.nick, data.ident, data.host))
+        self.assertTrue(data.is_command)
+        self.assertFalse(data.is_private)
+        self.assertEqual(("#channel", "!", "help"),
+                         (data.chan, data.trigger, data.command))
+        self.assertEqual(["me", "key=value"], data.args)
+        self.assertEqual({"key": "value"}, data.kwargs)
+
+    def test_private(self):
+        data = self.make("EarwigBot", "EarwigBot: help >Baz me.")
+        self.assertTrue(data.is_private)
+        self.assertEqual("Foo", data.chan)
+        self.assertEqual(("help", "Baz"), (data.command, data.reply_nick))
+        self.assertEqual(["me"], data.args)
+
+    def test_not_command(self):
+        data = self.make("#channel", "hello there")
+        self.assertFalse(data.is_command)
+        self.assertEqual("hello there", data.msg)
+        notice = self.make("#channel", "!help", "NOTICE")
+        self.assertFalse(notice.is_command)
+
+    def test_serialize(self):
+        data = self.make("#channel", "!help me")
+        copy = Data.unserialize(pickle.loads(pickle.dumps(data.serialize())))
+        self.assertEqual((data.command, data.args), (copy.command, copy.args))
+
+
+class TestRC(unittest.TestCase):
+    """Test cases for parsing recent changes from the IRC watcher."""
+
+    EDIT = ("\x0314[[\x0307Foo\x0314]]\x034 MB\x0310 \x0302https://"
+            "en.wikipedia.org/w/index.php?diff=2&oldid=1\x03 \x035*\x03 "
+            "\x0303Bar\x03 \x035*\x03 (+1) \x0310Summary\x03")
+    LOG = ("\x0314[[\x0307Special:Log/delete\x0314]]\x034 delete\x0310 "
+           "\x0302\x03 \x035*\x03 \x0303Admin\x03 \x035*\x03  \x0310deleted "
+           "\"[[\x0302Foo\x0310]]\": Spam\x03")
+
+    def test_edit(self):
+        rc = RC("#en.wikipedia", self.EDIT)
+        rc.parse()
+        self.assertTrue(rc.is_edit)
+        self.assertEqual(("Foo", "MB", "Bar"), (rc.page, rc.flags, rc.user))
+        self.assertTrue(rc.url.startswith("https://en.wikipedia.org/w/"))
+        self.assertIn("New minor bot edit", rc.prettify())
+
+    def test_log(self):
+        rc = RC("#en.wikipedia", self.LOG)
+        rc.parse()
+        self.assertFalse(rc.is_edit)
+        self.assertEqual(("Special:Log/delete", "delete", "Admin"),
+                         (rc.page, rc.flags, rc.user))
+        self.assertIn("New deletion", rc.prettify())
+
+    def test_malformed(self):
+        rc = RC("#en.wikipedia", "\x0314garbage")
+        self.assertRaises(ValueError, rc.parse)
+        self.assertEqual("\x0314garbage", rc.msg)
+        self.assertFalse(hasattr(rc, "page"))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from threading import Thread
+import unittest
+
+from earwigbot import exceptions
+from earwigbot.wiki import Site
+from earwigbot.wiki import site as sitemodule
+
+SITEINFO = {"query": {
+    "general": {"wikiid": "testwiki", "sitename": "Wikipedia", "lang": "en",
+                "server": "//test.wikipedia.org", "articlepath": "/wiki/$1",
+                "scriptpath": "/w"},
+    "namespaces": {"0": {"id": 0, "*": ""}, "1": {"id": 1, "*": "Talk"}},
+    "namespacealiases": []
+}}
+
+class LazySite(Site):
+    """A lazy Site whose low-level queries are answered by the test."""
+
+    def __init__(self, login=(None, None)):
+        self.queries = []
+        self.logins = 0
+        self.errors = []
+        super(LazySite, self).__init__(
+            base_url="//test.wikipedia.org", script_path="/w", login=login,
+            lazy=True)
+
+    def _api_query(self, params, *args, **kwargs):
+        self.queries.append(params.get("meta", params["action"]))
+        if self.errors:
+            raise self.errors.pop(0)
+        if params.get("meta") == "siteinfo":
+            return SITEINFO
+        return {"query": {}}
+
+    def _get_username_from_cookies(self):
+        return None
+
+    def _login(self, login):
+        self.logins += 1
+
+
+class TestLazySite(unittest.TestCase):
+    """Test cases for deferring login and siteinfo until first use."""
+
+    def setUp(self):
+        self.now = 1000.0
+        self._time = sitemodule.time
+        sitemodule.time = lambda: self.now
+
+    def tearDown(self):
+        sitemodule.time = self._time
+
+    def test_lazy(self):
+        site = LazySite(login=("Bot", "password"))
+        self.assertEqual([], site.queries)
+        site.api_query(action="query", list="foo")
+        site.api_query(action="query", list="bar")
+        self.assertEqual(["siteinfo", "query", "query"], site.queries)
+        self.assertEqual(1, site.logins)
+        self.assertEqual("testwiki", site.name)
+
+    def test_threads(self):
+        site = LazySite(login=("Bot", "password"))
+        threads = [Thread(target=site.api_query, kwargs={"action": "query"})
+                   for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(1, site.logins)
+        self.assertEqual(1, site.queries.count("siteinfo"))
+
+    def test_backoff(self):
+        site = LazySite()
+        error = exceptions.APIError("Down")
+        site.errors = [error, error]
+        self.assertRaises(exceptions.APIError, site.api_query, action="query")
+        self.now += Site.MIN_LOGIN_BACKOFF - 1
+        self.assertRaises(exceptions.APIError, site.api_query, action="query")
+        self.assertEqual(1, len(site.queries))
+
+        self.now += 1
+        self.assertRaises(exceptions.APIError, site.api_query, action="query")
+        self.assertEqual(2, len(site.queries))
+        self.assertEqual(Site.MIN_LOGIN_BACKOFF * 2, site._login_failure[2])
+        self.now += Site.MIN_LOGIN_BACKOFF * 2
+        site.api_query(action="query")
+        self.assertIs(None, site._login_failure)
+        self.assertEqual(["siteinfo"] * 3 + ["query"], site.queries)
+
+    def test_max_backoff(self):
+        site = LazySite()
+        for _ in xrange(12):
+            site.errors = [exceptions.APIError("Down")]
+            self.assertRaises(exceptions.APIError, site.api_query,
+                              action="query")
+            self.now += site._login_failure[2]
+        self.assertEqual(Site.MAX_LOGIN_BACKOFF, site._login_failure[2])
+
+    def test_cancelled(self):
+        site = LazySite()
+        site.errors = [exceptions.CancelledError()]
+        self.assertRaises(exceptions.CancelledError, site.api_query,
+                          action="query")
+        self.assertIs(None, site._login_failure)
+        site.api_query(action="query")
+        self.assertEqual(["siteinfo", "siteinfo", "query"], site.queries)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from json import dump, load
+import logging
+from os import mkdir, path, utime
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from earwigbot.managers import CommandManager, _LazyResource
+
+MODULE = """
+from earwigbot.commands import Command
+
+with open({log!r}, "a") as fp:
+    fp.write("imported\\n")
+
+class Greet(Command):
+    name = "greet"
+    commands = ["greet", "hi"]
+    hooks = ["msg", "join"]
+"""
+
+class FakeConfig(object):
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.commands = {"lazy": True, "disable": True, "enable": ["greet"]}
+
+class FakeBot(object):
+    def __init__(self, root_dir):
+        self.config = FakeConfig(root_dir)
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.commands = CommandManager(self)
+
+
+class TestManifest(unittest.TestCase):
+    """Test cases for lazily loading commands from a cached manifest."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.log = path.join(self.root, "imports.log")
+        self.module = path.join(self.root, "commands", "greet.py")
+        mkdir(path.join(self.root, "commands"))
+        with open(self.module, "w") as fp:
+            fp.write(MODULE.format(log=self.log))
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def load(self):
+        bot = FakeBot(self.root)
+        bot.commands.load()
+        return bot.commands
+
+    def imports(self):
+        if not path.exists(self.log):
+            return 0
+        with open(self.log) as fp:
+            return len(fp.readlines())
+
+    def test_round_trip(self):
+        manager = self.load()
+        self.assertEqual(1, self.imports())
+        self.assertIsInstance(manager._resources["greet"], _LazyResource)
+        self.assertEqual("greet", manager.get("greet").name)
+        self.assertEqual(1, self.imports())
+
+        manager = self.load()
+        self.assertEqual(1, self.imports())
+        placeholder = manager._resources["greet"]
+        self.assertIsInstance(placeholder, _LazyResource)
+        self.assertEqual(["msg", "join"], placeholder.hooks)
+        by_name, by_hook = manager._dispatch
+        self.assertEqual(["greet", "hi"], sorted(by_name["msg"]))
+        self.assertEqual("greet", manager.get("greet").name)
+        self.assertEqual(2, self.imports())
+
+    def test_changed_module(self):
+        self.load()
+        mtime = path.getmtime(self.module) + 10
+        utime(self.module, (mtime, mtime))
+        self.load()
+        self.assertEqual(2, self.imports())
+        self.load()
+        self.assertEqual(2, self.imports())
+
+    def test_version(self):
+        self.load()
+        manifest = path.join(self.root, ".commands.manifest")
+        with open(manifest) as fp:
+            data = load(fp)
+        self.assertEqual(CommandManager.MANIFEST_VERSION, data["version"][0])
+
+        data["version"][0] -= 1
+        with open(manifest, "w") as fp:
+            dump(data, fp)
+        self.load()
+        self.assertEqual(2, self.imports())
+
+        with open(manifest, "w") as fp:
+            dump(data["modules"], fp)  # The old format, without a version
+        self.load()
+        self.assertEqual(3, self.imports())
+        self.load()
+        self.assertEqual(3, self.imports())
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
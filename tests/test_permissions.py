@@ -0,0 +1,120 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from itertools import product
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from earwigbot.config.permissions import PermissionsDB, _User
+
+class FakeData(object):
+    def __init__(self, nick, ident, host):
+        self.nick = nick
+        self.ident = ident
+        self.host = host
+
+
+class TestPermissionsDB(unittest.TestCase):
+    """Test cases for the indexed permission rules."""
+
+    RULES = [("*", "*", "example.com"), ("Alice", "alice", "example.com"),
+             ("*", "bob", "*.example.net"), ("Bob", "*", "*"),
+             ("Alice", "alice", "example.com"), ("*", "*", "*.example.org"),
+             ("Carol", "carol", "host-?.example.org"),
+             ("*", "*", "example.com"), ("Dave", "dave", "127.0.0.1")]
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.perms = PermissionsDB(path.join(self.root, "permissions.db"))
+        self.perms.load()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def linear_search(self, user, rank):
+        for rule in self.perms.users.get(rank, []):
+            if rule.matches(user):
+                return rule
+        return False
+
+    def test_first_match(self):
+        for rule in self.RULES:
+            self.perms.add_owner(*rule)
+        nicks = ["Alice", "Bob", "Carol", "Dave", "Eve"]
+        idents = ["alice", "bob", "carol", "dave", "eve"]
+        hosts = ["example.com", "a.example.net", "host-1.example.org",
+                 "127.0.0.1", "example.net"]
+        for nick, ident, host in product(nicks, idents, hosts):
+            user = _User(nick, ident, host)
+            expected = self.linear_search(user, PermissionsDB.OWNER)
+            found = self.perms._search_index(user, PermissionsDB.OWNER)
+            self.assertIs(expected, found)
+            self.assertFalse(self.perms._search_index(user,
+                                                      PermissionsDB.ADMIN))
+
+    def test_changes(self):
+        data = FakeData("Dave", "dave", "127.0.0.1")
+        self.assertFalse(self.perms.is_owner(data))
+        self.perms.add_owner("Dave", "dave", "127.0.0.1")
+        self.assertTrue(self.perms.is_owner(data))
+        self.assertFalse(self.perms.is_admin(data))
+        self.perms.add_admin(host="127.0.0.*")
+        self.assertTrue(self.perms.is_admin(data))
+        self.perms.remove_owner("Dave", "dave", "127.0.0.1")
+        self.assertFalse(self.perms.is_owner(data))
+        self.assertTrue(self.perms.is_admin(data))
+
+    def test_reload(self):
+        for rule in self.RULES:
+            self.perms.add_admin(*rule)
+        perms = PermissionsDB(path.join(self.root, "permissions.db"))
+        perms.load()
+        user = _User("Someone", "else", "example.com")
+        rule = perms._search_index(user, PermissionsDB.ADMIN)
+        self.assertEqual(("*", "*", "example.com"),
+                         (rule.nick, rule.ident, rule.host))
+        self.assertIs(perms.users[PermissionsDB.ADMIN][0], rule)
+
+    def test_records(self):
+        self.perms.set_record("group", "a", "1")
+        self.perms.set_records("group", [("b", "2"), ("a", "3")])
+        self.perms.set_record("other", "a", "4")
+        self.perms.remove_record("group", "b")
+        self.perms.remove_record("group", "missing")
+        perms = PermissionsDB(path.join(self.root, "permissions.db"))
+        perms.load()
+        self.assertEqual({"a": "3"}, perms.get_records("group"))
+        self.assertEqual({"a": "4"}, perms.get_records("other"))
+        self.assertEqual({}, perms.get_records("none"))
+
+    def test_remove_attr(self):
+        self.perms.set_attr("command:foo", "data", "[]")
+        self.perms.remove_attr("command:foo", "data")
+        self.assertFalse(self.perms.has_attr("command:foo", "data"))
+        perms = PermissionsDB(path.join(self.root, "permissions.db"))
+        perms.load()
+        self.assertFalse(perms.has_attr("command:foo", "data"))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
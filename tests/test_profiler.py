@@ -0,0 +1,148 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import __builtin__
+import json
+from os import path
+from shutil import rmtree
+from StringIO import StringIO
+import sys
+from tempfile import mkdtemp
+from threading import Thread
+import unittest
+
+from earwigbot.util import _StartupProfiler
+
+class FakeConfig(object):
+    def __init__(self, components):
+        self.components = components
+
+class FakeBot(object):
+    def __init__(self, components):
+        self.config = FakeConfig(components)
+
+class Phase(object):
+    def load(self):
+        return "loaded"
+
+
+class TestStartupProfiler(unittest.TestCase):
+    """Test cases for timing imports and startup phases."""
+
+    MODULES = {
+        "profmod_outer": "import profmod_inner\nimport json\n",
+        "profmod_inner": "x = 1\n",
+        "profmod_thread": "x = 2\n"
+    }
+
+    def setUp(self):
+        self.root = mkdtemp()
+        for name, code in self.MODULES.iteritems():
+            with open(path.join(self.root, name + ".py"), "w") as fp:
+                fp.write(code)
+        sys.path.insert(0, self.root)
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+        self.original_load = Phase.__dict__["load"]
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        sys.path.remove(self.root)
+        for name in self.MODULES:
+            sys.modules.pop(name, None)
+        Phase.load = self.original_load
+        rmtree(self.root)
+
+    def test_imports(self):
+        real_import = __builtin__.__import__
+        profiler = _StartupProfiler()
+        profiler.install_import_hooks()
+        import profmod_outer
+        thread = Thread(target=__import__, args=("profmod_thread",))
+        thread.start()
+        thread.join()
+        profiler.finish()
+
+        self.assertIs(real_import, __builtin__.__import__)
+        imports = {name: (total, own)
+                   for name, start, total, own in profiler._imports}
+        self.assertEqual({"profmod_outer", "profmod_inner"}, set(imports))
+        outer, inner = imports["profmod_outer"], imports["profmod_inner"]
+        self.assertLessEqual(outer[1], outer[0])
+        self.assertGreaterEqual(outer[0] - outer[1], inner[0])
+        report = sys.stdout.getvalue()
+        self.assertIn("imports (cumulative, self; 2 of 2)", report)
+
+    def test_resolve_name(self):
+        resolve = _StartupProfiler._resolve_name
+        package = {"__name__": "earwigbot.wiki", "__path__": []}
+        module = {"__name__": "earwigbot.wiki.site"}
+        self.assertEqual("json", resolve("json", module, None, 0))
+        self.assertEqual("earwigbot.wiki.page",
+                         resolve("page", module, None, 1))
+        self.assertEqual("earwigbot.wiki.page",
+                         resolve("page", package, None, 1))
+        self.assertEqual("earwigbot.exceptions",
+                         resolve("exceptions", module, None, 2))
+        self.assertEqual("earwigbot.wiki.a, earwigbot.wiki.b",
+                         resolve("", module, ["a", "b"], 1))
+        self.assertEqual("earwigbot.wiki.constants",
+                         resolve("constants", module, None, -1))
+        self.assertEqual("nonexistent", resolve("nonexistent", module,
+                                                None, -1))
+
+    def test_phases(self):
+        profiler = _StartupProfiler()
+        profiler._patch(Phase, "load", lambda inst: "phase.load()")
+        self.assertEqual("loaded", Phase().load())
+        profiler.wait_for_irc(FakeBot({"irc_frontend": True,
+                                       "irc_watcher": False}))
+        self.assertFalse(profiler._finished)
+        profiler._connected()
+        self.assertTrue(profiler._finished)
+        self.assertIs(self.original_load, Phase.__dict__["load"])
+        self.assertEqual(["phase.load()"],
+                         [label for label, _, _ in profiler._phases])
+
+        profiler = _StartupProfiler()
+        profiler.wait_for_irc(FakeBot({}))
+        self.assertTrue(profiler._finished)
+
+    def test_trace(self):
+        filename = path.join(self.root, "trace.json")
+        profiler = _StartupProfiler(filename)
+        profiler.install_import_hooks()
+        profiler._patch(Phase, "load", lambda inst: "phase.load()")
+        import profmod_outer
+        Phase().load()
+        profiler.finish()
+        profiler.finish()
+
+        with open(filename) as fp:
+            events = json.load(fp)["traceEvents"]
+        names = sorted((event["cat"], event["name"]) for event in events)
+        self.assertEqual([("import", "profmod_inner"),
+                          ("import", "profmod_outer"),
+                          ("phase", "phase.load()")], names)
+        self.assertEqual(1, sys.stdout.getvalue().count("Startup trace"))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import socket
+from threading import Event, Thread
+from time import sleep, time
+import unittest
+
+from earwigbot.irc import IRCConnection, Reactor
+
+class LineConnection(IRCConnection):
+    """A connection that remembers the messages it receives."""
+
+    def __init__(self, port, logger):
+        super(LineConnection, self).__init__(
+            "127.0.0.1", port, "EarwigBot", "earwig", "Earwig", logger)
+        self.lines = []
+
+    def _process_message(self, line):
+        self.lines.append(list(line))
+
+class Server(object):
+    """A listening socket that hands out accepted clients."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(5)
+        self.sock.settimeout(5)
+        self.port = self.sock.getsockname()[1]
+
+    def accept(self):
+        client = self.sock.accept()[0]
+        client.settimeout(5)
+        return client
+
+    def read_until(self, client, text):
+        data = ""
+        while text not in data:
+            chunk = client.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+
+class TestReactor(unittest.TestCase):
+    """Test cases for the IRC reactor, using epoll where available."""
+
+    def setUp(self):
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.reactor = self.make_reactor()
+        self.thread = Thread(target=self.reactor.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.server = Server()
+
+    def tearDown(self):
+        self.reactor.stop()
+        self.thread.join(5)
+        self.server.sock.close()
+        self.assertFalse(self.thread.is_alive())
+
+    def make_reactor(self):
+        return Reactor(self.logger)
+
+    def wait_for(self, condition):
+        deadline = time() + 5
+        while not condition() and time() < deadline:
+            sleep(0.01)
+        return condition()
+
+    def test_timers(self):
+        calls = []
+        done = Event()
+        self.reactor.call_later(0.05, calls.append, "second")
+        self.reactor.call_later(0.05, calls.append, "third")
+        self.reactor.call_later(0, calls.append, "first")
+        self.reactor.call_later(0, lambda: 1 / 0)
+        self.reactor.call_later(0.1, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(["first", "second", "third"], calls)
+
+    def test_connection(self):
+        conn = LineConnection(self.server.port, self.logger)
+        self.reactor.add(conn)
+        client = self.server.accept()
+        data = self.server.read_until(client, "USER")
+        self.assertTrue(data.startswith("NICK EarwigBot\r\n"))
+
+        client.sendall("PING :abc\r\n:srv 001 EarwigBot :Hi\r\n:a!b@c PRIV")
+        self.assertIn("PONG abc", self.server.read_until(client, "PONG abc"))
+        client.sendall("MSG #chan :hello\r\n")
+        self.assertTrue(self.wait_for(lambda: len(conn.lines) == 3))
+        self.assertEqual(["PING", ":abc"], conn.lines[0])
+        self.assertEqual([":a!b@c", "PRIVMSG", "#chan", ":hello"],
+                         conn.lines[2])
+
+        conn.stop("Bye")
+        self.assertIn("QUIT :Bye", self.server.read_until(client, "QUIT"))
+        client.close()
+        self.server.sock.settimeout(0.5)
+        self.assertRaises(socket.timeout, self.server.accept)
+
+    def test_reconnect(self):
+        conn = LineConnection(self.server.port, self.logger)
+        self.reactor.add(conn)
+        client = self.server.accept()
+        self.server.read_until(client, "USER")
+        client.close()
+
+        client = self.server.accept()
+        self.assertIn("NICK", self.server.read_until(client, "USER"))
+        self.assertEqual(Reactor.MIN_BACKOFF, self.reactor._backoffs[conn])
+        client.sendall(":srv 001 EarwigBot :Welcome\r\n")
+        self.assertTrue(self.wait_for(
+            lambda: conn not in self.reactor._backoffs))
+        conn.stop()
+        client.close()
+
+
+class TestSelectReactor(TestReactor):
+    """Test cases for the IRC reactor, falling back to select()."""
+
+    def make_reactor(self):
+        reactor = Reactor(self.logger)
+        if reactor._epoll:
+            reactor._epoll.close()
+            reactor._epoll = None
+        return reactor
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
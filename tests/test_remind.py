@@ -0,0 +1,169 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+import time
+import unittest
+
+from earwigbot.commands.remind import Remind
+from earwigbot.config.permissions import PermissionsDB
+from earwigbot.irc import Data
+
+class FakeConfig(object):
+    def __init__(self, permdb):
+        self.irc = {"permissions": permdb}
+
+class FakeCommands(object):
+    def __init__(self):
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.jobs = []
+
+    def run_in_worker(self, name, func, *args):
+        self.jobs.append((name, func, args))
+
+class FakeReactor(object):
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, func, *args):
+        self.timers.append((delay, func, args))
+
+class FakeFrontend(object):
+    def __init__(self):
+        self.replies = []
+
+    def reply(self, data, msg, hidelog=False):
+        self.replies.append(msg)
+
+class FakeBot(object):
+    def __init__(self, permdb):
+        self.config = FakeConfig(permdb)
+        self.commands = FakeCommands()
+        self.reactor = FakeReactor()
+        self.frontend = FakeFrontend()
+
+
+def make_data(args):
+    """Return a Data object for a !remind command from a channel."""
+    line = [":Alice!alice@example.com", "PRIVMSG", "#chan", ":!remind"]
+    return Data("EarwigBot", line + args.split(), "PRIVMSG")
+
+
+class TestRemind(unittest.TestCase):
+    """Test cases for storing and scheduling reminders."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.bot = self.load_bot()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def load_bot(self):
+        permdb = PermissionsDB(path.join(self.root, "permissions.db"))
+        permdb.load()
+        return FakeBot(permdb)
+
+    def test_records(self):
+        remind = Remind(self.bot)
+        remind.process(make_data("1h first"))
+        remind.process(make_data("2h second"))
+        permdb = self.bot.config.irc["permissions"]
+        self.assertEqual(2, len(permdb.get_records("command:remind")))
+
+        rid = remind.reminders["example.com"][0].id
+        remind.process(make_data("cancel " + rid))
+        bot = self.load_bot()
+        remind = Remind(bot)
+        messages = [rem.message for rem in remind.reminders["example.com"]]
+        self.assertEqual(["second"], messages)
+
+    def test_migrate(self):
+        permdb = self.bot.config.irc["permissions"]
+        data = make_data("1h hello").serialize()
+        end = time.time() + 3600
+        legacy = [("R123", "example.com", 3600, end, "hello", data)]
+        permdb.set_attr("command:remind", "data", str(legacy))
+        remind = Remind(self.bot)
+        reminder = remind.reminders["example.com"][0]
+        self.assertEqual(("R123", "hello", end),
+                         (reminder.id, reminder.message, reminder.end))
+        self.assertEqual(["R123"], permdb.get_records("command:remind").keys())
+
+        bot = self.load_bot()
+        permdb = bot.config.irc["permissions"]
+        self.assertFalse(permdb.has_attr("command:remind", "data"))
+        remind = Remind(bot)
+        self.assertEqual(["R123"], [rem.id for rem in
+                                    remind.reminders["example.com"]])
+
+    def run_timers(self):
+        """Fire every pending reactor timer and worker job, in order."""
+        reactor, commands = self.bot.reactor, self.bot.commands
+        timers, reactor.timers = reactor.timers, []
+        for delay, func, args in timers:
+            func(*args)
+        jobs, commands.jobs = commands.jobs, []
+        for name, func, args in jobs:
+            self.assertEqual("reminder", name)
+            func(*args)
+        return [delay for delay, func, args in timers]
+
+    def test_timers(self):
+        remind = Remind(self.bot)
+        remind.process(make_data("60 hello"))
+        delays = self.run_timers()
+        self.assertEqual(1, len(delays))
+        self.assertAlmostEqual(60, delays[0], places=0)
+        self.assertTrue(self.bot.frontend.replies[-1].endswith("hello"))
+        reminder = remind.reminders["example.com"][0]
+        self.assertTrue(reminder.expired)
+
+        self.assertAlmostEqual(86400, self.run_timers()[0], places=0)
+        self.assertEqual({}, remind.reminders)
+        self.assertEqual([], self.bot.reactor.timers)
+
+    def test_stale_timers(self):
+        remind = Remind(self.bot)
+        remind.process(make_data("60 first"))
+        remind.process(make_data("snooze 120"))
+        replies = len(self.bot.frontend.replies)
+        delays = self.run_timers()
+        self.assertEqual(2, len(delays))
+        self.assertAlmostEqual(120, delays[1], places=0)
+        self.assertEqual(replies + 1, len(self.bot.frontend.replies))
+
+        remind.process(make_data("60 second"))
+        rid = remind.reminders["example.com"][1].id
+        remind.process(make_data("cancel " + rid))
+        remind.unload()
+        replies = len(self.bot.frontend.replies)
+        self.run_timers()
+        self.assertEqual(replies, len(self.bot.frontend.replies))
+        self.assertEqual([], self.bot.commands.jobs)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from calendar import timegm
+from datetime import datetime
+import logging
+from time import gmtime
+import unittest
+
+from earwigbot.scheduler import ScheduleEntry, Scheduler
+
+def stamp(*args):
+    return timegm(datetime(*args).utctimetuple())
+
+class FakeBot(object):
+    logger = logging.getLogger("earwigbot.test")
+    logger.addHandler(logging.NullHandler())
+
+
+class TestScheduleEntry(unittest.TestCase):
+    """Test cases for compiling schedule entries and finding their runs."""
+
+    def assertNext(self, event, after, expected):
+        entry = ScheduleEntry(event)
+        self.assertEqual(expected, entry.next_after(after))
+
+    def test_steps(self):
+        every15 = {"minute": "*/15"}
+        self.assertNext(every15, stamp(2024, 1, 1, 12, 7),
+                        stamp(2024, 1, 1, 12, 15))
+        self.assertNext(every15, stamp(2024, 1, 1, 12, 15),
+                        stamp(2024, 1, 1, 12, 30))
+        self.assertNext(every15, stamp(2024, 1, 1, 23, 59), stamp(2024, 1, 2))
+
+        odd_hours = {"minute": 0, "hour": "9-17/2"}
+        self.assertNext(odd_hours, stamp(2024, 1, 1, 9, 0),
+                        stamp(2024, 1, 1, 11, 0))
+        self.assertNext(odd_hours, stamp(2024, 1, 1, 17, 0),
+                        stamp(2024, 1, 2, 9, 0))
+
+    def test_lists(self):
+        event = {"minute": [0, 30], "hour": [9, 17]}
+        self.assertNext(event, stamp(2024, 1, 1, 10, 0),
+                        stamp(2024, 1, 1, 17, 0))
+        self.assertNext(event, stamp(2024, 1, 1, 17, 0),
+                        stamp(2024, 1, 1, 17, 30))
+        self.assertNext(event, stamp(2024, 1, 1, 17, 30),
+                        stamp(2024, 1, 2, 9, 0))
+        self.assertNext({"minute": "0,45"}, stamp(2024, 1, 1, 0, 1),
+                        stamp(2024, 1, 1, 0, 45))
+
+    def test_days(self):
+        last_day = {"minute": 0, "hour": 0, "month_day": 31}
+        self.assertNext(last_day, stamp(2024, 4, 1), stamp(2024, 5, 31))
+        leap_day = {"minute": 0, "hour": 0, "month": 2, "month_day": 29}
+        self.assertNext(leap_day, stamp(2021, 3, 1), stamp(2024, 2, 29))
+        sundays = {"minute": 0, "hour": 12, "week_day": 6}
+        self.assertNext(sundays, stamp(2024, 1, 1), stamp(2024, 1, 7, 12, 0))
+
+    def test_impossible(self):
+        self.assertNext({"month": 2, "month_day": 31}, stamp(2024, 1, 1), None)
+        self.assertNext({"month": [4, 6, 9, 11], "month_day": 31},
+                        stamp(2024, 1, 1), None)
+
+    def test_cron(self):
+        # 2024-01-01 is a Monday:
+        self.assertNext({"cron": "30 5 * * 1"}, stamp(2024, 1, 1, 6, 0),
+                        stamp(2024, 1, 8, 5, 30))
+        self.assertNext({"cron": "0 0 * * 7"}, stamp(2024, 1, 1),
+                        stamp(2024, 1, 7))
+        self.assertNext({"cron": "0 0 * * 0"}, stamp(2024, 1, 1),
+                        stamp(2024, 1, 7))
+        # Either the 13th or a Friday, as in cron:
+        self.assertNext({"cron": "0 0 13 * 5"}, stamp(2024, 1, 1),
+                        stamp(2024, 1, 5))
+        self.assertNext({"cron": "0 0 13 * 5"}, stamp(2024, 1, 12),
+                        stamp(2024, 1, 13))
+
+    def test_matches(self):
+        events = [{"minute": "*/20", "hour": "1-3"}, {"cron": "15 2 2 * 2"},
+                  {"minute": [5, 59], "week_day": [0, 3]}]
+        start = stamp(2024, 1, 1)
+        for event in events:
+            entry = ScheduleEntry(event)
+            due = [when for when in xrange(start, start + 86400 * 3, 60)
+                   if entry.matches(gmtime(when))]
+            found, when = [], start - 60
+            while True:
+                when = entry.next_after(when)
+                if when >= start + 86400 * 3:
+                    break
+                found.append(when)
+            self.assertEqual(due, found)
+
+    def test_invalid(self):
+        bad = [{"minute": 60}, {"hour": "5-2"}, {"month_day": 0},
+               {"minute": "*/0"}, {"cron": "* * * *"}, {"catchup": "never"}]
+        for event in bad:
+            self.assertRaises(ValueError, ScheduleEntry, event)
+
+
+class TestScheduler(unittest.TestCase):
+    """Test cases for the scheduler's handling of missed runs."""
+
+    def test_catchup(self):
+        scheduler = Scheduler(FakeBot())
+        first = stamp(2024, 1, 1, 0, 0)
+        on_time = first + 3 * 3600 + 10
+        late = first + 3 * 3600 + 120
+        tests = [("all", on_time, 4), ("once", on_time, 1),
+                 ("skip", on_time, 1), ("all", late, 4), ("once", late, 1),
+                 ("skip", late, 0), ("skip", first, 1)]
+        for policy, now, runs in tests:
+            entry = ScheduleEntry({"minute": 0, "catchup": policy})
+            self.assertEqual(runs, scheduler._get_runs(entry, first, now))
+
+    def test_max_catchup(self):
+        scheduler = Scheduler(FakeBot())
+        entry = ScheduleEntry({"catchup": "all"})
+        first = stamp(2024, 1, 1)
+        runs = scheduler._get_runs(entry, first, first + 3600)
+        self.assertEqual(Scheduler.MAX_CATCHUP, runs)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
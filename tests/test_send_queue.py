@@ -0,0 +1,130 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import unittest
+
+from earwigbot.irc import IRCConnection
+from earwigbot.irc import connection as connmodule
+
+class FakeReactor(object):
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, func):
+        self.timers.append((delay, func))
+
+class QueueConnection(IRCConnection):
+    def __init__(self):
+        logger = logging.getLogger("earwigbot.test")
+        logger.addHandler(logging.NullHandler())
+        super(QueueConnection, self).__init__(
+            "irc.example.com", 6667, "EarwigBot", "earwig", "Earwig", logger)
+        self._reactor = FakeReactor()
+        self._is_running = True
+        self.written = []
+
+    def _write(self, msg, hidelog=False):
+        self.written.append(msg)
+
+
+class TestSendQueue(unittest.TestCase):
+    """Test cases for prioritised, rate-limited sending."""
+
+    def setUp(self):
+        self.now = 1000.0
+        self._time = connmodule.time
+        connmodule.time = lambda: self.now
+        self.conn = QueueConnection()
+
+    def tearDown(self):
+        connmodule.time = self._time
+
+    def run_timers(self):
+        timers, self.conn._reactor.timers = self.conn._reactor.timers, []
+        for delay, func in timers:
+            func()
+        return [delay for delay, func in timers]
+
+    def test_priority(self):
+        conn = self.conn
+        conn.say("#chan", "report", priority=conn.PRIORITY_RC)
+        conn.say("#chan", "reply")
+        conn.pong("irc.example.com")
+        self.assertEqual([], conn.written)
+        self.assertEqual([0], self.run_timers())
+        self.assertEqual(["PONG irc.example.com", "PRIVMSG #chan :reply",
+                          "PRIVMSG #chan :report"], conn.written)
+
+    def test_token_bucket(self):
+        conn = self.conn
+        for i in xrange(conn.SEND_BURST + 2):
+            conn.say("#chan", str(i))
+        self.run_timers()
+        self.assertEqual(conn.SEND_BURST, len(conn.written))
+        delays = self.run_timers()
+        self.assertEqual(1, len(delays))
+        self.assertAlmostEqual(conn.SEND_INTERVAL, delays[0])
+
+        self.now += conn.SEND_INTERVAL
+        conn._flush()
+        self.assertEqual(conn.SEND_BURST + 1, len(conn.written))
+        self.now += conn.SEND_INTERVAL * 10
+        conn._flush()
+        self.assertEqual(conn.SEND_BURST + 2, len(conn.written))
+
+        self.now += conn.SEND_INTERVAL * 10
+        for i in xrange(conn.SEND_BURST + 1):
+            conn.say("#chan", str(i))
+        conn._flush()
+        self.assertEqual(conn.SEND_BURST * 2 + 2, len(conn.written))
+
+    def test_rc_backlog(self):
+        conn = self.conn
+        conn._tokens = 0
+        for i in xrange(conn.RC_MAX_QUEUE + 5):
+            conn.say("#chan", str(i), priority=conn.PRIORITY_RC)
+        conn.say("#chan", "6", priority=conn.PRIORITY_RC)
+        conn.say("#chan", "reply")
+        conn.say("#chan", "reply")
+        queue = conn._queues[conn.PRIORITY_RC]
+        self.assertEqual(conn.RC_MAX_QUEUE, len(queue))
+        self.assertEqual("PRIVMSG #chan :5", queue[0][1])
+        self.assertEqual(2, len(conn._queues[conn.PRIORITY_REPLY]))
+
+        self.now += conn.RC_MAX_AGE + 1
+        conn.say("#chan", "fresh", priority=conn.PRIORITY_RC)
+        conn._tokens = conn.SEND_BURST
+        conn._last_refill = self.now
+        conn._flush()
+        self.assertEqual(["PRIVMSG #chan :reply", "PRIVMSG #chan :reply",
+                          "PRIVMSG #chan :fresh"], conn.written)
+
+    def test_stopped(self):
+        conn = self.conn
+        conn.say("#chan", "reply")
+        conn._is_running = False
+        self.run_timers()
+        self.assertEqual([], conn.written)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
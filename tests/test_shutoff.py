@@ -0,0 +1,123 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import unittest
+
+from earwigbot.managers import TaskManager
+
+class FakeConfig(object):
+    def __init__(self):
+        self.tasks = {}
+        self.wiki = {"shutoff": {"interval": 60}}
+
+class FakeBot(object):
+    def __init__(self):
+        self.config = FakeConfig()
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+
+class FakeSite(object):
+    name = "enwiki"
+    domain = "en.wikipedia.org"
+
+class FakeRC(object):
+    def __init__(self, page, domain="en.wikipedia.org"):
+        self.page = page
+        self.url = "https://{0}/wiki/{1}".format(domain, page)
+
+class FakeTask(object):
+    number = 7
+    title = "User:Bot/Shutoff/Task 7"
+
+    def __init__(self):
+        self.loads = 0
+        self.enabled = False
+        self.during_load = None
+
+    def load_shutoff_state(self, site):
+        self.loads += 1
+        if self.during_load:
+            self.during_load()
+        return self.title, self.enabled
+
+
+class TestShutoffState(unittest.TestCase):
+    """Test cases for the shared cache of on-wiki shutoff states."""
+
+    def setUp(self):
+        self.manager = TaskManager(FakeBot())
+        self.task, self.site = FakeTask(), FakeSite()
+
+    def get(self):
+        return self.manager.get_shutoff_state(self.task, self.site)
+
+    def test_cached(self):
+        self.assertFalse(self.get())
+        self.task.enabled = True
+        self.assertFalse(self.get())
+        self.assertEqual(1, self.task.loads)
+
+        self.manager._shutoff_states[("enwiki", 7)]["checked"] -= 61
+        self.assertTrue(self.get())
+        self.assertEqual(2, self.task.loads)
+
+    def test_invalidated(self):
+        self.get()
+        self.manager.process_rc(FakeRC("Other page"))
+        self.manager.process_rc(FakeRC(FakeTask.title, "de.wikipedia.org"))
+        self.get()
+        self.assertEqual(1, self.task.loads)
+        self.task.enabled = True
+        self.manager.process_rc(FakeRC(FakeTask.title))
+        self.assertTrue(self.get())
+        self.assertEqual(2, self.task.loads)
+
+    def test_edited_while_loading(self):
+        edit = lambda: self.manager.process_rc(FakeRC(FakeTask.title))
+        self.task.during_load = edit
+        self.assertFalse(self.get())
+        self.task.during_load = None
+        self.task.enabled = True
+        self.assertTrue(self.get())
+        self.assertEqual(2, self.task.loads)
+        self.assertTrue(self.get())
+        self.assertEqual(2, self.task.loads)
+        self.assertEqual({}, self.manager._shutoff_edits)
+
+    def test_other_edit_while_loading(self):
+        self.task.during_load = lambda: self.manager.process_rc(
+            FakeRC("Other page"))
+        self.get()
+        self.get()
+        self.assertEqual(1, self.task.loads)
+
+    def test_error(self):
+        def fail():
+            raise RuntimeError()
+        self.task.during_load = fail
+        self.assertRaises(RuntimeError, self.get)
+        self.assertEqual(0, self.manager._shutoff_fetches)
+        self.assertEqual({}, self.manager._shutoff_states)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
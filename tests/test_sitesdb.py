@@ -0,0 +1,176 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from time import sleep
+import unittest
+
+from earwigbot.exceptions import LoginError, SiteNotFoundError
+from earwigbot.wiki import SitesDB
+
+class FakeConfig(object):
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.wiki = {}
+
+class FakeBot(object):
+    def __init__(self, root_dir):
+        self.config = FakeConfig(root_dir)
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+
+class FakeSite(object):
+    def __init__(self, name, project, lang, base_url):
+        self.name = name
+        self.project = project
+        self.lang = lang
+        self._base_url = base_url
+        self._article_path = "/wiki/$1"
+        self._script_path = "/w"
+        self._sql_data = {"host": name + ".db"}
+        self._namespaces = {0: [u""], 4: [u"Wikipedia", u"WP", u"Project"]}
+
+
+class TestSitesDB(unittest.TestCase):
+    """Test cases for the in-memory snapshot of the sitesdb."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.bot = FakeBot(self.root)
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def make(self):
+        return SitesDB(self.bot)
+
+    def add(self, sitesdb, *args):
+        sitesdb._add_site_to_sitesdb(FakeSite(*args))
+
+    def test_preload(self):
+        sitesdb = self.make()
+        sitesdb.preload()
+        self.assertIs(None, sitesdb._snapshot)
+        self.assertFalse(path.exists(path.join(self.root, "sites.db")))
+
+        self.add(sitesdb, "enwiki", "wikipedia", "en", "//en.wikipedia.org")
+        sitesdb = self.make()
+        sitesdb.preload()
+        self.assertEqual(["enwiki"], sitesdb._snapshot.keys())
+
+    def test_load(self):
+        sitesdb = self.make()
+        self.add(sitesdb, "enwiki", "wikipedia", "en", "//en.wikipedia.org")
+        self.add(sitesdb, "frwiki", u"wikipédia", "fr", "//fr.wikipedia.org")
+        for sitesdb in (sitesdb, self.make()):
+            entry = sitesdb._load_site_from_sitesdb("enwiki")
+            self.assertEqual(("enwiki", "wikipedia", "en",
+                              "//en.wikipedia.org", "/wiki/$1", "/w"),
+                             entry[:6])
+            self.assertEqual({"host": "enwiki.db"}, entry[6])
+            self.assertEqual(u"Wikipedia", entry[7][4][0])
+            self.assertEqual({u"WP", u"Project"}, set(entry[7][4][1:]))
+            entry[7][4].pop()
+            entry = sitesdb._load_site_from_sitesdb("enwiki")
+            self.assertEqual(3, len(entry[7][4]))
+            self.assertRaises(SiteNotFoundError,
+                              sitesdb._load_site_from_sitesdb, "dewiki")
+
+    def test_names(self):
+        sitesdb = self.make()
+        self.add(sitesdb, "enwiki", "wikipedia", "en", "//en.wikipedia.org")
+        self.add(sitesdb, "frwiki", u"wikipédia", "fr", "//fr.wikipedia.org")
+        find = sitesdb._get_site_name_from_sitesdb
+        self.assertEqual("enwiki", find("wikipedia", "en"))
+        self.assertEqual("frwiki", find("wikipedia", "fr"))
+        self.assertIs(None, find("wikipedia", "de"))
+
+    def test_changes(self):
+        sitesdb = self.make()
+        self.add(sitesdb, "enwiki", "wikipedia", "en", "//en.wikipedia.org")
+        sitesdb.preload()
+        self.add(sitesdb, "enwiki", "wikipedia", "en", "//new.example.org")
+        self.add(sitesdb, "dewiki", "wikipedia", "de", "//de.wikipedia.org")
+        entry = sitesdb._load_site_from_sitesdb("enwiki")
+        self.assertEqual("//new.example.org", entry[3])
+        self.assertTrue(sitesdb._remove_site_from_sitesdb("dewiki"))
+        self.assertFalse(sitesdb._remove_site_from_sitesdb("dewiki"))
+        self.assertIs(None, sitesdb._get_site_name_from_sitesdb("wikipedia",
+                                                                "de"))
+
+        other = self.make()
+        self.assertEqual(["enwiki"], other._get_snapshot().keys())
+        self.assertEqual("//new.example.org",
+                         other._load_site_from_sitesdb("enwiki")[3])
+
+
+class WarmSite(object):
+    """A site that takes a while to get a token, tracking concurrency."""
+
+    def __init__(self, name, counter):
+        self.name = name
+        self.counter = counter
+
+    def get_token(self):
+        with self.counter["lock"]:
+            self.counter["now"] += 1
+            self.counter["max"] = max(self.counter["max"],
+                                      self.counter["now"])
+        sleep(0.05)
+        with self.counter["lock"]:
+            self.counter["now"] -= 1
+        if self.name == "badwiki":
+            raise LoginError("Bad password")
+
+
+class TestWarmUp(unittest.TestCase):
+    """Test cases for warming up several sites at once."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.sitesdb = SitesDB(FakeBot(self.root))
+        self.counter = {"lock": Lock(), "now": 0, "max": 0}
+        self.sitesdb.get_site = lambda name: WarmSite(name, self.counter)
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_warm_up(self):
+        names = ["enwiki", "badwiki", "dewiki", "frwiki", "eswiki"]
+        ready = self.sitesdb.warm_up(names, workers=2)
+        self.assertEqual({"enwiki", "dewiki", "frwiki", "eswiki"},
+                         set(ready))
+        self.assertTrue(all(elapsed >= 0.04 for elapsed in ready.values()))
+        self.assertEqual(2, self.counter["max"])
+
+    def test_default_workers(self):
+        names = ["wiki{0}".format(i) for i in xrange(10)]
+        self.assertEqual(10, len(self.sitesdb.warm_up(names)))
+        self.assertEqual(SitesDB.WARMUP_WORKERS, self.counter["max"])
+        self.assertEqual({}, self.sitesdb.warm_up([]))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from os import path
+import re
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from earwigbot.commands.stalk import Stalk, _StalkMatcher
+from earwigbot.config.permissions import PermissionsDB
+
+class FakeConfig(object):
+    def __init__(self, permdb):
+        self.irc = {"permissions": permdb}
+
+class TestStalkMatcher(unittest.TestCase):
+    """Test cases for the stalk command's combined target matching."""
+
+    def naive_match(self, table, tag):
+        found = []
+        for target in table:
+            if target.startswith("re:"):
+                try:
+                    if re.match(target[3:], tag):
+                        found.append(target)
+                except (re.error, AssertionError):
+                    pass
+            elif target == tag:
+                found.append(target)
+        return sorted(found)
+
+    def assertSameMatches(self, table, tags):
+        matcher = _StalkMatcher(table)
+        for tag in tags:
+            self.assertEqual(self.naive_match(table, tag),
+                             sorted(matcher.match(tag)), tag)
+
+    def test_exact(self):
+        table = ["Foo", "Bar baz"]
+        self.assertSameMatches(table, ["Foo", "Bar baz", "foo", "Bar", ""])
+
+    def test_combined(self):
+        table = ["re:Foo.*", "re:.*bar$", "re:(a|b)+c", "re:[0-9]{3}",
+                 "re:(x)(y)?z", "Foobar", "re:(?:abc)"]
+        tags = ["Foo", "Foobar", "xbar", "ababc", "c", "123", "12", "xz",
+                "xyz", "yz", "abc", ""]
+        self.assertSameMatches(table, tags)
+
+    def test_uncombinable(self):
+        table = ["re:(a)\\1", "re:(?P<x>b)(?P=x)", "re:(?i)case",
+                 "re:(a)?(?(1)b|c)", "re:(x)?(?(1)y|z)", "re:q(r)"]
+        tags = ["aa", "ab", "bb", "CASE", "case", "ab", "c", "xy", "z",
+                "x", "qr", "q"]
+        self.assertSameMatches(table, tags)
+
+    def test_invalid(self):
+        table = ["re:(unclosed", "re:ok"]
+        self.assertSameMatches(table, ["ok", "(unclosed"])
+
+    def test_many_groups(self):
+        table = ["re:({0})(x)?".format(i) for i in xrange(150)]
+        table.append("re:" + "(a)" * 100)
+        tags = ["0", "42x", "149", "150", "a" * 100, "a" * 99]
+        self.assertSameMatches(table, tags)
+
+
+class TestStalkRecords(unittest.TestCase):
+    """Test cases for saving stalks as per-target records."""
+
+    USER = {"Foo": [("Alice", "#chan")]}
+    PAGE = {"re:Bar.*": [("Bob", "Bob")]}
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.permdb = self.load_permdb()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def load_permdb(self):
+        permdb = PermissionsDB(path.join(self.root, "permissions.db"))
+        permdb.load()
+        return permdb
+
+    def make_stalk(self, permdb):
+        stalk = Stalk.__new__(Stalk)
+        stalk.config = FakeConfig(permdb)
+        stalk._users, stalk._pages = {}, {}
+        stalk._load_stalks()
+        return stalk
+
+    def test_save(self):
+        stalk = self.make_stalk(self.permdb)
+        stalk._users.update(self.USER)
+        stalk._save_stalks("user", "Foo")
+        stalk._pages.update(self.PAGE)
+        stalk._save_stalks("page", "re:Bar.*")
+        stalk = self.make_stalk(self.load_permdb())
+        self.assertEqual(self.USER, stalk._users)
+        self.assertEqual(self.PAGE, stalk._pages)
+
+        del stalk._users["Foo"]
+        stalk._save_stalks("user", "Foo")
+        self.assertEqual(1, len(self.permdb.get_records("command:stalk")))
+
+    def test_migrate(self):
+        self.permdb.set_attr("command:stalk", "data",
+                             str((self.USER, self.PAGE)))
+        stalk = self.make_stalk(self.permdb)
+        self.assertEqual(self.USER, stalk._users)
+        self.assertEqual(self.PAGE, stalk._pages)
+
+        permdb = self.load_permdb()
+        self.assertFalse(permdb.has_attr("command:stalk", "data"))
+        stalk = self.make_stalk(permdb)
+        self.assertEqual(self.USER, stalk._users)
+        self.assertEqual(self.PAGE, stalk._pages)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from threading import Event
+import unittest
+
+from earwigbot.cancellation import CancelToken
+from earwigbot.managers import TaskManager, _TaskJob
+
+class FakeTask(object):
+    def __init__(self, name):
+        self.name = name
+        self.runs = []
+        self.release = Event()
+
+    def run(self, _cancel, **kwargs):
+        self.runs.append(kwargs)
+        while not self.release.wait(0.01):
+            if _cancel.cancelled:
+                return
+
+class FakeConfig(object):
+    def __init__(self):
+        self.tasks = {"maxWorkers": 1}
+
+class FakeBot(object):
+    def __init__(self):
+        self.config = FakeConfig()
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.cancel_token = CancelToken()
+
+
+class TestTaskJobs(unittest.TestCase):
+    """Test cases for queueing, deduplicating, and waiting for task jobs."""
+
+    def setUp(self):
+        self.manager = TaskManager(FakeBot())
+        self.first, self.second = FakeTask("first"), FakeTask("second")
+        self.manager._resources = {"first": self.first,
+                                   "second": self.second}
+
+    def tearDown(self):
+        self.first.release.set()
+        self.second.release.set()
+        self.manager.wait(5)
+
+    def test_key(self):
+        key = _TaskJob(self.first, {"page": "Foo"}, 0).key
+        callback = lambda: None
+        job = _TaskJob(self.first, {"page": "Foo", "_IRCCallback": callback},
+                       TaskManager.PRIORITY_HIGH)
+        self.assertEqual(key, job.key)
+        self.assertNotEqual(key, _TaskJob(self.first, {"page": "Bar"}, 0).key)
+        self.assertNotEqual(key, _TaskJob(self.first, {}, 0).key)
+        self.assertNotEqual(key,
+                            _TaskJob(self.second, {"page": "Foo"}, 0).key)
+
+    def test_dedup(self):
+        running = self.manager.start("first")
+        self.assertTrue(running.started)
+        queued = self.manager.start("second", page="Foo", _private=1)
+        self.assertIs(None, queued.started)
+        self.assertIs(queued, self.manager.start("second", page="Foo"))
+        other = self.manager.start("second", page="Bar")
+        self.assertIsNot(queued, other)
+        self.assertEqual([queued, other], self.manager.get_queued())
+        self.assertEqual([running, queued, other], self.manager.get_jobs())
+
+        self.first.release.set()
+        self.second.release.set()
+        queued.join(5)
+        other.join(5)
+        self.assertEqual([{"page": "Foo", "_private": 1}, {"page": "Bar"}],
+                         self.second.runs)
+
+    def test_running(self):
+        running = self.manager.start("first", page="Foo")
+        self.assertIs(running, self.manager.start("first", page="Foo",
+                                                  _private=1))
+        self.manager.cancel(running)
+        restarted = self.manager.start("first", page="Foo")
+        self.assertIsNot(running, restarted)
+
+    def test_limits(self):
+        self.manager.bot.config.tasks = {"maxWorkers": 2}
+        first = self.manager.start("first", page="Foo")
+        second = self.manager.start("first", page="Bar")
+        self.assertTrue(first.started and second.started)
+        self.assertEqual(2, self.manager.get_running("first"))
+
+        self.manager.bot.config.tasks["second"] = {"maxRunning": 1}
+        self.manager.bot.config.tasks["maxWorkers"] = 0
+        third = self.manager.start("second", page="Foo")
+        fourth = self.manager.start("second", page="Bar")
+        self.assertTrue(third.started)
+        self.assertIs(None, fourth.started)
+
+    def test_priority(self):
+        self.manager.start("first")
+        low = self.manager.start("second", _priority=TaskManager.PRIORITY_LOW)
+        high = self.manager.start("second", page="Foo",
+                                  _priority=TaskManager.PRIORITY_HIGH)
+        normal = self.manager.start("second", page="Bar")
+        self.assertEqual([high, normal, low], self.manager.get_queued())
+
+    def test_cancel(self):
+        running = self.manager.start("first")
+        queued = self.manager.start("second")
+        self.assertTrue(queued.is_alive())
+        self.assertTrue(self.manager.cancel(queued))
+        self.assertFalse(queued.is_alive())
+        self.assertTrue(queued.cancelled)
+        queued.join()
+        self.assertFalse(self.manager.cancel(queued))
+        self.assertEqual([], self.manager.get_queued())
+
+        self.assertTrue(self.manager.cancel(running))
+        self.assertTrue(running.token.cancelled)
+        running.join(5)
+        self.assertFalse(running.is_alive())
+        self.assertEqual([], self.second.runs)
+
+    def test_wait(self):
+        running = self.manager.start("first")
+        self.assertEqual([running], self.manager.wait(0.05))
+        self.assertTrue(running.is_alive())
+        running.join(0.01)
+        self.assertTrue(running.is_alive())
+
+        queued = self.manager.start("second")
+        self.first.release.set()
+        self.second.release.set()
+        self.assertEqual([], self.manager.wait(5))
+        queued.join(5)
+        self.assertFalse(running.is_alive())
+        self.assertFalse(queued.is_alive())
+        self.assertEqual(0, self.manager.get_running("first"))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
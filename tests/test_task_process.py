@@ -0,0 +1,165 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+import os
+from signal import SIG_IGN, SIGTERM, signal
+import time
+import unittest
+
+from earwigbot import cancellation
+from earwigbot.cancellation import CancelToken
+from earwigbot.irc import IRCConnection
+from earwigbot.managers import TaskManager
+
+class ChildTask(object):
+    """A task whose behaviour in the child process is picked by an argument.
+    """
+    name = "child"
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.logger = logging.getLogger("earwigbot.test.child")
+
+    def run(self, _cancel, action):
+        if action == "report":
+            self.logger.info("pid {0}".format(os.getpid()))
+            self.bot.frontend._send("PRIVMSG #chan :done",
+                                    priority=IRCConnection.PRIORITY_RC)
+        elif action == "wait":
+            self.logger.info("ready")
+            cancellation.sleep(30)
+        elif action == "ignore":
+            signal(SIGTERM, SIG_IGN)
+            self.logger.info("ready")
+            time.sleep(30)
+        elif action == "exit":
+            os._exit(3)
+
+class FakeConnection(object):
+    PRIORITY_REPLY = IRCConnection.PRIORITY_REPLY
+
+    def __init__(self):
+        self.sent = []
+
+    def _send(self, msg, hidelog=False, priority=PRIORITY_REPLY):
+        self.sent.append((msg, priority))
+
+class FakeConfig(object):
+    def __init__(self):
+        self.tasks = {"maxWorkers": 2, "child": {"subprocess": True}}
+
+class FakeBot(object):
+    def __init__(self):
+        self.config = FakeConfig()
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.cancel_token = CancelToken()
+        self.frontend = FakeConnection()
+        self.watcher = None
+
+    def _after_fork(self):
+        pass
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@unittest.skipUnless(os.name == "posix", "tasks only fork on POSIX")
+class TestTaskProcess(unittest.TestCase):
+    """Test cases for running tasks in child processes."""
+
+    def setUp(self):
+        self.bot = FakeBot()
+        self.manager = TaskManager(self.bot)
+        self.manager._resources = {"child": ChildTask(self.bot)}
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(logging.NOTSET)
+        for job in self.manager.get_jobs():
+            self.manager.cancel(job)
+
+    def messages(self):
+        return [record.getMessage() for record in self.handler.records]
+
+    def run_job(self, action):
+        job = self.manager.start("child", action=action)
+        self.assertTrue(job.subprocess)
+        return job
+
+    def wait_until_ready(self):
+        deadline = time.time() + 10
+        while "ready" not in self.messages() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn("ready", self.messages())
+
+    def test_report(self):
+        job = self.run_job("report")
+        job.join(10)
+        self.assertFalse(job.is_alive())
+        self.assertEqual(0, job.process.exitcode)
+        pids = [record.getMessage() for record in self.handler.records
+                if record.name == "earwigbot.test.child"]
+        self.assertEqual(1, len(pids))
+        self.assertNotEqual("pid {0}".format(os.getpid()), pids[0])
+        self.assertIn("Task 'child' finished successfully", self.messages())
+        self.assertEqual([("PRIVMSG #chan :done", IRCConnection.PRIORITY_RC)],
+                         self.bot.frontend.sent)
+
+    def test_cancel(self):
+        job = self.run_job("wait")
+        self.wait_until_ready()
+        self.assertTrue(self.manager.cancel(job))
+        job.join(10)
+        self.assertFalse(job.is_alive())
+        self.assertEqual(0, job.process.exitcode)
+        self.assertIn("Task 'child' was cancelled", self.messages())
+
+    def test_kill(self):
+        self.manager.KILL_TIMEOUT = 0.5
+        job = self.run_job("ignore")
+        self.wait_until_ready()
+        start = time.time()
+        self.assertTrue(self.manager.cancel(job))
+        self.assertLess(time.time() - start, 5)
+        job.join(10)
+        self.assertEqual(-9, job.process.exitcode)
+        self.assertIn("Killing task 'child', which didn't stop after 0.5 "
+                      "seconds", self.messages())
+
+    def test_exit_status(self):
+        job = self.run_job("exit")
+        job.join(10)
+        self.assertIn("Task 'child' exited with status 3", self.messages())
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
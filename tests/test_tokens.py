@@ -0,0 +1,108 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from json import dumps
+from urlparse import parse_qsl
+import unittest
+
+from earwigbot.wiki import Site
+
+class FakeResponse(object):
+    headers = {}
+
+    def __init__(self, result):
+        self._data = dumps(result)
+
+    def read(self):
+        return self._data
+
+class FakeOpener(object):
+    """Answers API requests, handing out tokens for each type asked for."""
+
+    def __init__(self):
+        self.requests = []
+        self.issued = 0
+
+    def open(self, url, data):
+        params = dict(parse_qsl(data))
+        self.requests.append(params)
+        if params["action"] == "login":
+            return FakeResponse({"login": {"result": "Success"}})
+        result = {"query": {}}
+        if "tokens" in params.get("meta", "").split("|"):
+            self.issued += 1
+            types = params.get("type", "csrf").split("|")
+            result["query"]["tokens"] = {
+                kind + "token": "{0}-{1}".format(kind, self.issued)
+                for kind in types}
+        return FakeResponse(result)
+
+
+class TestTokens(unittest.TestCase):
+    """Test cases for fetching every needed token type together."""
+
+    def setUp(self):
+        self.site = Site(
+            name="testwiki", project="wikipedia", lang="en",
+            base_url="//test.wikipedia.org", article_path="/wiki/$1",
+            script_path="/w", namespaces={0: [u""]}, wait_between_queries=0)
+        self.opener = self.site._opener = FakeOpener()
+
+    def test_get_token(self):
+        self.assertEqual("rollback-1", self.site.get_token("rollback"))
+        self.assertEqual("csrf|rollback", self.opener.requests[0]["type"])
+        self.assertEqual("csrf-1", self.site.get_token())
+        self.assertEqual("csrf-1", self.site.get_token("edit"))
+        self.assertEqual(1, len(self.opener.requests))
+
+        self.assertEqual("csrf-2", self.site.get_token(force=True))
+        self.assertEqual("rollback-2", self.site.get_token("rollback"))
+        self.assertEqual(2, len(self.opener.requests))
+
+    def test_piggyback(self):
+        self.site.api_query(action="query", list="recentchanges")
+        self.assertEqual("tokens", self.opener.requests[0]["meta"])
+        self.assertEqual("csrf", self.opener.requests[0]["type"])
+        self.site.get_token()
+        self.assertEqual(1, len(self.opener.requests))
+
+        self.site.get_token("patrol")
+        self.site._tokens.clear()
+        self.site.api_query(action="query", meta="userinfo", type="watch")
+        request = self.opener.requests[-1]
+        self.assertEqual("userinfo|tokens", request["meta"])
+        self.assertEqual("watch|csrf|patrol", request["type"])
+        self.site.api_query(action="query", meta="userinfo")
+        self.assertNotIn("type", self.opener.requests[-1])
+        self.site.api_query(action="parse", page="Foo")
+        self.assertNotIn("meta", self.opener.requests[-1])
+
+    def test_login(self):
+        self.site.get_token("rollback")
+        self.site._login(("Bot", "password"))
+        self.assertEqual("login", self.opener.requests[1]["action"])
+        self.assertEqual("csrf|rollback", self.opener.requests[2]["type"])
+        self.assertEqual("rollback-2", self.site.get_token("rollback"))
+        self.assertEqual(3, len(self.opener.requests))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
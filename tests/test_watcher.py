@@ -0,0 +1,134 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from time import sleep, time
+import unittest
+
+from earwigbot.irc import Watcher
+
+EDIT = ("\x0314[[\x0307{0}\x0314]]\x034 M\x0310 \x0302https://"
+        "en.wikipedia.org/w/index.php?diff=2&oldid=1\x03 \x035*\x03 "
+        "\x0303Bar\x03 \x035*\x03 (+1) \x0310Summary\x03")
+
+class FakeConfig(object):
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.irc = {"watcher": {
+            "host": "irc.example.com", "port": 6667, "nick": "Watcher",
+            "ident": "watcher", "realname": "Watcher",
+            "channels": ["#en.wikipedia"]}}
+
+class Recorder(object):
+    def __init__(self):
+        self.seen = []
+
+    def process_rc(self, rc):
+        self.seen.append(rc.page)
+
+    def call(self, hook, rc):
+        self.seen.append((hook, rc.page))
+
+class FakeFrontend(object):
+    PRIORITY_RC = 2
+
+    def __init__(self):
+        self.said = []
+
+    def is_stopped(self):
+        return False
+
+    def say(self, chan, msg, priority):
+        self.said.append((chan, priority))
+
+class FakeBot(object):
+    def __init__(self, root_dir):
+        self.config = FakeConfig(root_dir)
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.wiki, self.tasks, self.commands = (Recorder(), Recorder(),
+                                                Recorder())
+        self.frontend = FakeFrontend()
+        self.component_lock = Lock()
+
+
+class TestWatcher(unittest.TestCase):
+    """Test cases for handling RC events off the reactor thread."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.bot = FakeBot(self.root)
+        self.watcher = Watcher(self.bot)
+        self.watcher._process_hook = lambda bot, rc: ["#reports"]
+
+    def tearDown(self):
+        self.watcher.stop()
+        rmtree(self.root)
+
+    def send(self, chan, msg):
+        line = ":rc!rc@example.com PRIVMSG {0} :{1}".format(chan, msg)
+        self.watcher._process_message(line.split(" "))
+
+    def wait_for(self, predicate):
+        end = time() + 5
+        while not predicate():
+            if time() > end:
+                self.fail("Timed out waiting for the watcher")
+            sleep(0.01)
+
+    def test_order(self):
+        self.send("#en.wikipedia", EDIT.format("Foo"))
+        self.send("#en.wikipedia", "not an event")
+        self.send("#elsewhere", EDIT.format("Spam"))
+        self.send("#en.wikipedia", EDIT.format("Bar"))
+        self.wait_for(lambda: len(self.bot.commands.seen) == 2)
+        self.assertEqual(["Foo", "Bar"], self.bot.wiki.seen)
+        self.assertEqual(["Foo", "Bar"], self.bot.tasks.seen)
+        self.assertEqual([("rc", "Foo"), ("rc", "Bar")],
+                         self.bot.commands.seen)
+        self.assertEqual([("#reports", 2)] * 2, self.bot.frontend.said)
+
+    def test_component_lock(self):
+        with self.bot.component_lock:
+            start = time()
+            for i in xrange(3):
+                self.send("#en.wikipedia", EDIT.format(i))
+            self.assertTrue(time() - start < 1)
+            self.wait_for(lambda: len(self.bot.wiki.seen) == 1)
+            sleep(0.05)
+            self.assertEqual([], self.bot.frontend.said)
+        self.wait_for(lambda: len(self.bot.commands.seen) == 3)
+        self.assertEqual(3, len(self.bot.frontend.said))
+
+    def test_stop(self):
+        self.send("#en.wikipedia", EDIT.format("Foo"))
+        thread = self.watcher._event_thread
+        self.watcher.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([("rc", "Foo")], self.bot.commands.seen)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8  -*-
+#
+# Copyright (C) 2009-2015 Ben Kurtovic <ben.kurtovic@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import logging
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+import unittest
+
+from earwigbot import exceptions
+from earwigbot.tasks import Checkpoint
+from earwigbot.tasks.wikiproject_tagger import (WikiProjectTagger, _Job,
+                                                _Pipeline, _ShutoffEnabled)
+
+class FakePage(object):
+    def __init__(self, site, title):
+        self.site = site
+        self.title = title
+
+    def get(self):
+        text = self.site.content.get(self.title)
+        if text is None:
+            raise exceptions.PageNotFoundError(self.title)
+        return text
+
+class FakeSite(object):
+    PAGE_BATCH_SIZE = 2
+
+    def __init__(self, content):
+        self.content = content
+        self.queries = []
+
+    def get_pages(self, titles):
+        self.queries.append(titles)
+        for title in titles:
+            yield FakePage(self, title)
+
+class Tagger(WikiProjectTagger):
+    """A tagger that remembers what it would have saved."""
+
+    def __init__(self):
+        self.logger = logging.getLogger("earwigbot.test")
+        self.logger.addHandler(logging.NullHandler())
+        self.shutoff = False
+        self.saved = []
+
+    def shutoff_enabled(self, site=None):
+        return self.shutoff
+
+    def save_page(self, page, job, text, banner):
+        self.saved.append((page.title, text))
+
+
+class TestWikiProjectTagger(unittest.TestCase):
+    """Test cases for tagging pages, in sequence and in a pipeline."""
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.tagger = Tagger()
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def make_job(self, **kwargs):
+        options = {
+            "banner": "WikiProject Foo", "names": ["WikiProject Foo"],
+            "summary": "Tagging", "update": False, "append": None,
+            "autoassess": False, "only_with": None, "nocreate": False,
+            "tag_categories": False, "dry_run": False, "workers": 2,
+            "edit_delay": 0,
+            "checkpoint": Checkpoint(path.join(self.root, "task.log"))
+        }
+        options.update(kwargs)
+        return _Job(**options)
+
+    def test_tag_text(self):
+        job = self.make_job()
+        self.assertEqual((u"{{WikiProject Foo}}\nText", "{{WikiProject Foo}}"),
+                         self.tagger.tag_text("Talk:A", "Text", job))
+        self.assertIs(None, self.tagger.tag_text(
+            "Talk:B", "{{wikiProject Foo|class=B}}", job))
+        self.assertEqual(("{{WikiProject Foo}}", "{{WikiProject Foo}}"),
+                         self.tagger.tag_text("Talk:C", None, job))
+        self.assertIs(None, self.tagger.tag_text(
+            "Talk:C", None, self.make_job(nocreate=True)))
+
+        job = self.make_job(update=True, append="importance=low")
+        self.assertEqual(
+            (u"{{WikiProject Foo|class=B|importance=low}}",
+             "{{WikiProject Foo|class=B|importance=low}}"),
+            self.tagger.tag_text("Talk:B", "{{WikiProject Foo|class=B}}", job))
+
+    def test_pipeline(self):
+        site = FakeSite({"Talk:A": "A", "Talk:B": "{{WikiProject Foo}}",
+                         "Talk:D": "D"})
+        job = self.make_job()
+        pipeline = _Pipeline(self.tagger, site, job)
+        saved_at_callback = []
+        callback = lambda: saved_at_callback.append(len(self.tagger.saved))
+        pipeline.submit(["Talk:A", "Talk:B"])
+        pipeline.submit(["Talk:C"], callback)
+        pipeline.submit(["Talk:D", "Talk:A"])
+        pipeline.finish()
+
+        self.assertEqual([("Talk:A", u"{{WikiProject Foo}}\nA"),
+                          ("Talk:C", "{{WikiProject Foo}}"),
+                          ("Talk:D", u"{{WikiProject Foo}}\nD")],
+                         self.tagger.saved)
+        self.assertEqual([2], saved_at_callback)
+        self.assertEqual(4, job.counter)
+        self.assertEqual({"Talk:A", "Talk:B", "Talk:C", "Talk:D"},
+                         job.checkpoint.get_done("pages"))
+
+    def test_shutoff(self):
+        site = FakeSite({"Talk:A": "A"})
+        self.tagger.shutoff = True
+        pipeline = _Pipeline(self.tagger, site, self.make_job())
+        pipeline.submit(["Talk:A"])
+        self.assertRaises(_ShutoffEnabled, pipeline.finish)
+        self.assertEqual([], self.tagger.saved)
+        self.assertRaises(_ShutoffEnabled, pipeline.submit, ["Talk:B"])
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)